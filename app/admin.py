@@ -1,17 +1,35 @@
+from datetime import datetime
+
 import pandas as pd
 import streamlit as st
 
 from app.db import (
-    add_answer,
     add_question,
-    delete_answer,
-    delete_question,
+    apply_answer_changes,
+    apply_question_changes,
+    apply_scale_changes,
+    fetch_all_clients,
     fetch_all_questions,
+    fetch_answer_scales,
     fetch_answers_by_question,
     fetch_categories,
-    update_answer,
-    update_question,
+    fetch_live_questionnaire,
+    fetch_questionnaire,
+    fetch_questionnaire_versions,
+    fetch_scale_answers,
+    publish_questionnaire,
+    storage_stats,
 )
+from app.backup import BACKUP_DIR, list_backups
+from app.job_queue import enqueue_job
+from app.reports import REPORT_DIR
+from app.retention import ARCHIVE_DIR
+
+# Columns shown in the admin grids, id first
+QUESTION_COLUMNS = ['id', 'qtype', 'csequence', 'category', 'qsequence', 'question', 'scale_id']
+ANSWER_COLUMNS = ['id', 'question_id', 'score', 'answer']
+SCALE_COLUMNS = ['id', 'name']
+SCALE_ANSWER_COLUMNS = ['id', 'scale_id', 'score', 'answer']
 
 
 def admin_view():
@@ -19,18 +37,35 @@ def admin_view():
     st.title("Admin Panel")
     
     # Tabs for different admin functions
-    tab1, tab2 = st.tabs(["Manage Questions", "Manage Answers"])
+    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+        ["Manage Questions", "Answer Scales", "Manage Answers", "Questionnaire Versions", "Reports", "Data Retention"]
+    )
     
     with tab1:
         manage_questions()
     
     with tab2:
+        manage_scales()
+    
+    with tab3:
         manage_answers()
+    
+    with tab4:
+        manage_versions()
+    
+    with tab5:
+        manage_reports()
+    
+    with tab6:
+        manage_retention()
 
 def manage_questions():
     """Interface for managing questions."""
     st.header("Manage Questions")
     
+    scale_names = {scale['id']: scale['name'] for scale in fetch_answer_scales()}
+    scale_ids = {name: scale_id for scale_id, name in scale_names.items()}
+    
     # Create a new question
     with st.expander("Add New Question", expanded=False):
         with st.form("add_question_form"):
@@ -55,11 +90,16 @@ def manage_questions():
             csequence = st.number_input("Category Sequence", min_value=0, value=0, step=1)
             qsequence = st.number_input("Question Sequence", min_value=0, value=0, step=1)
             question_text = st.text_area("Question")
+            scale_id = st.selectbox(
+                "Answer Scale:",
+                [None] + list(scale_names),
+                format_func=lambda x: "None (add answers under Manage Answers)" if x is None else scale_names[x]
+            )
             
             submit_button = st.form_submit_button("Add Question")
             
             if submit_button and selected_category and question_text:
-                question_id = add_question(selected_category, qtype, qsequence, csequence, question_text)
+                question_id = add_question(selected_category, qtype, qsequence, csequence, question_text, scale_id)
                 st.success(f"Question added successfully with ID: {question_id}")
                 st.rerun()
     
@@ -90,92 +130,62 @@ def manage_questions():
            (filter_category == "All" or q['category'] == filter_category):
             filtered_questions.append(q)
     
-    # Convert to DataFrame for display
     if filtered_questions:
-        df = pd.DataFrame([dict(q) for q in filtered_questions])
-        df = df.rename(columns={
-            'id': 'ID',
-            'csequence': 'Cat Seq',
-            'category': 'Category',
-            'qtype': 'Type',
-            'qsequence': 'Q Seq',
-            'question': 'Question'
-        })
-        
-        # Format the Type column
-        df['Type'] = df['Type'].apply(lambda x: "Organization" if x == "org" else "Action")
-        
-        st.dataframe(df)
-        
-        # Question selection for editing/deleting
-        question_ids = [q['id'] for q in filtered_questions]
-        selected_q_idx = st.selectbox(
-            "Select Question to Edit/Delete:",
-            range(len(filtered_questions)),
-            format_func=lambda i: f"ID {filtered_questions[i]['id']}: {filtered_questions[i]['question'][:50]}..."
+        st.write(
+            "Edit cells directly, add rows at the bottom, or select rows and delete them. "
+            "Nothing is saved until you click Save Changes; all changes are then applied together."
         )
         
-        selected_question = filtered_questions[selected_q_idx]
-        
-        # Edit or delete the selected question
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button("Edit Selected Question"):
-                st.session_state['editing_question'] = selected_question
-        
-        with col2:
-            if st.button("Delete Selected Question"):
-                if st.session_state.get('confirm_delete') == selected_question['id']:
-                    delete_question(selected_question['id'])
-                    st.success(f"Question ID {selected_question['id']} deleted successfully!")
-                    # Clear the session state
-                    if 'confirm_delete' in st.session_state:
-                        del st.session_state['confirm_delete']
-                    st.rerun()
-                else:
-                    st.session_state['confirm_delete'] = selected_question['id']
-                    st.warning(f"Click 'Delete Selected Question' again to confirm deletion of question ID {selected_question['id']}.")
+        # Bumping the version resets the grid to freshly loaded rows after a save
+        grid_key = f"question_grid_{st.session_state.get('question_grid_version', 0)}"
+        with st.form("question_grid_form"):
+            df = pd.DataFrame([dict(q) for q in filtered_questions], columns=QUESTION_COLUMNS)
+            df['scale_id'] = df['scale_id'].map(scale_names)
+            edited = st.data_editor(
+                df,
+                column_config={
+                    'id': st.column_config.NumberColumn('ID', disabled=True),
+                    'qtype': st.column_config.SelectboxColumn(
+                        'Type', options=["org", "action"], required=True, default="org"
+                    ),
+                    'csequence': st.column_config.NumberColumn('Cat Seq', min_value=0, step=1, required=True, default=0),
+                    'category': st.column_config.TextColumn('Category', required=True),
+                    'qsequence': st.column_config.NumberColumn('Q Seq', min_value=0, step=1, required=True, default=0),
+                    'question': st.column_config.TextColumn('Question', required=True, width="large"),
+                    'scale_id': st.column_config.SelectboxColumn('Answer Scale', options=list(scale_ids)),
+                },
+                num_rows="dynamic",
+                hide_index=True,
+                key=grid_key
+            )
+            renumber = st.checkbox("Renumber question sequences within each category (1, 2, 3, ...)")
+            save_button = st.form_submit_button("Save Changes")
         
-        # Edit question form
-        if st.session_state.get('editing_question'):
-            q = st.session_state['editing_question']
-            st.subheader(f"Edit Question ID: {q['id']}")
-            
-            with st.form("edit_question_form"):
-                # Get existing categories for dropdown
-                categories = fetch_categories()
-                
-                # Pre-fill form with existing values
-                new_category = st.text_input("New Category")
-                category_idx = categories.index(q['category']) if q['category'] in categories else 0
-                category_select = st.selectbox(
-                    "Or select existing category:",
-                    [""] + categories,
-                    index=category_idx + 1  # +1 because we added an empty option at index 0
-                )
-                selected_category = new_category if new_category else category_select
-                
-                qtype = st.selectbox(
-                    "Question Type:",
-                    ["org", "action"],
-                    index=0 if q['qtype'] == "org" else 1,
-                    format_func=lambda x: "Organization" if x == "org" else "Action"
-                )
-                
-                csequence = st.number_input("Category Sequence", min_value=0, value=q['csequence'], step=1)
-                qsequence = st.number_input("Question Sequence", min_value=0, value=q['qsequence'], step=1)
-                question_text = st.text_area("Question", value=q['question'])
-                
-                update_button = st.form_submit_button("Update Question")
-                
-                if update_button and selected_category and question_text:
-                    update_question(q['id'], selected_category, qtype, qsequence, csequence, question_text)
-                    st.success(f"Question ID {q['id']} updated successfully!")
-                    # Clear the editing state
-                    if 'editing_question' in st.session_state:
-                        del st.session_state['editing_question']
-                    st.rerun()
+        if save_button:
+            rows = _grid_rows(edited)
+            if any(not row['category'] or not row['question'] for row in rows):
+                st.error("Every question needs a category and question text.")
+                return
+            for row in rows:
+                row['scale_id'] = scale_ids.get(row['scale_id'])
+            if renumber:
+                _renumber(rows)
+            inserts, updates, deletes = _diff_rows(filtered_questions, rows, QUESTION_COLUMNS[1:])
+            if not (inserts or updates or deletes):
+                st.info("No changes to save.")
+                return
+            try:
+                apply_question_changes(inserts, updates, deletes)
+            except ValueError as e:
+                st.error(str(e))
+                return
+            st.session_state['question_grid_version'] = st.session_state.get('question_grid_version', 0) + 1
+            st.session_state['question_grid_saved'] = (
+                f"Saved: {len(inserts)} added, {len(updates)} updated, {len(deletes)} deleted."
+            )
+            st.rerun()
+        if 'question_grid_saved' in st.session_state:
+            st.success(st.session_state.pop('question_grid_saved'))
     else:
         st.info("No questions found matching the selected filters.")
 
@@ -216,95 +226,342 @@ def manage_answers():
         st.info("No questions found matching the selected filters.")
         return
     
-    # Question selection
-    selected_q_idx = st.selectbox(
-        "Select Question:",
-        range(len(filtered_questions)),
-        format_func=lambda i: f"{filtered_questions[i]['category']} - {filtered_questions[i]['question'][:50]}...",
-        key="answer_question_selector"
+    st.write(
+        "Answers added here belong to one question. A question with answers of its own "
+        "offers them instead of its answer scale's."
     )
     
-    selected_question = filtered_questions[selected_q_idx]
-    question_id = selected_question['id']
+    # All answers of the filtered questions in one grid
+    question_labels = {q['id']: f"{q['id']}: {q['question'][:60]}" for q in filtered_questions}
+    label_ids = {label: question_id for question_id, label in question_labels.items()}
+    loaded = [dict(a) for question_id in question_labels for a in fetch_answers_by_question(question_id)]
     
-    st.subheader(f"Answers for: {selected_question['question']}")
+    st.write(
+        "Edit cells directly, add rows at the bottom, or select rows and delete them. "
+        "Nothing is saved until you click Save Changes; all changes are then applied together."
+    )
     
-    # Add new answer
-    with st.expander("Add New Answer", expanded=False):
-        with st.form("add_answer_form"):
-            answer_text = st.text_area("Answer")
-            score = st.number_input("Score", value=0, step=1)
-            
-            submit_button = st.form_submit_button("Add Answer")
-            
-            if submit_button and answer_text:
-                answer_id = add_answer(question_id, score, answer_text)
-                st.success(f"Answer added successfully with ID: {answer_id}")
-                st.rerun()
+    grid_key = f"answer_grid_{st.session_state.get('answer_grid_version', 0)}"
+    with st.form("answer_grid_form"):
+        df = pd.DataFrame(loaded, columns=ANSWER_COLUMNS)
+        df['question_id'] = df['question_id'].map(question_labels)
+        edited = st.data_editor(
+            df,
+            column_config={
+                'id': st.column_config.NumberColumn('ID', disabled=True),
+                'question_id': st.column_config.SelectboxColumn(
+                    'Question', options=list(label_ids), required=True, width="large"
+                ),
+                'score': st.column_config.NumberColumn('Score', step=1, required=True, default=0),
+                'answer': st.column_config.TextColumn('Answer', required=True, width="large"),
+            },
+            num_rows="dynamic",
+            hide_index=True,
+            key=grid_key
+        )
+        save_button = st.form_submit_button("Save Changes")
     
-    # List existing answers
-    answers = fetch_answers_by_question(question_id)
-    
-    if answers:
-        # Convert to DataFrame for display
-        df = pd.DataFrame([dict(a) for a in answers])
-        df = df.rename(columns={
-            'id': 'ID',
-            'question_id': 'Question ID',
-            'score': 'Score',
-            'answer': 'Answer'
-        })
-        
-        st.dataframe(df)
-        
-        # Answer selection for editing/deleting
-        answer_ids = [a['id'] for a in answers]
-        selected_a_idx = st.selectbox(
-            "Select Answer to Edit/Delete:",
-            range(len(answers)),
-            format_func=lambda i: f"ID {answers[i]['id']}: {answers[i]['answer'][:50]}..."
+    if save_button:
+        rows = _grid_rows(edited)
+        if any(row['question_id'] not in label_ids or not row['answer'] for row in rows):
+            st.error("Every answer needs a question and answer text.")
+            return
+        for row in rows:
+            row['question_id'] = label_ids[row['question_id']]
+        inserts, updates, deletes = _diff_rows(loaded, rows, ANSWER_COLUMNS[1:])
+        if not (inserts or updates or deletes):
+            st.info("No changes to save.")
+            return
+        try:
+            apply_answer_changes(inserts, updates, deletes)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        st.session_state['answer_grid_version'] = st.session_state.get('answer_grid_version', 0) + 1
+        st.session_state['answer_grid_saved'] = (
+            f"Saved: {len(inserts)} added, {len(updates)} updated, {len(deletes)} deleted."
+        )
+        st.rerun()
+    if 'answer_grid_saved' in st.session_state:
+        st.success(st.session_state.pop('answer_grid_saved'))
+
+def manage_scales():
+    """Interface for managing shared answer scales and their answers."""
+    st.header("Answer Scales")
+    st.write(
+        "A scale is a named set of answers that any number of questions can share. "
+        "Assign scales to questions under Manage Questions. Deleting a scale deletes its answers."
+    )
+    
+    scales = fetch_answer_scales()
+    grid_key = f"scale_grid_{st.session_state.get('scale_grid_version', 0)}"
+    with st.form("scale_grid_form"):
+        edited = st.data_editor(
+            pd.DataFrame([dict(s) for s in scales], columns=SCALE_COLUMNS),
+            column_config={
+                'id': st.column_config.NumberColumn('ID', disabled=True),
+                'name': st.column_config.TextColumn('Name', required=True, width="large"),
+            },
+            num_rows="dynamic",
+            hide_index=True,
+            key=grid_key
         )
+        save_button = st.form_submit_button("Save Scales")
+    
+    if save_button:
+        rows = _grid_rows(edited)
+        names = [row['name'] for row in rows]
+        if any(not name for name in names) or len(set(names)) != len(names):
+            st.error("Every scale needs a name, and names must be unique.")
+            return
+        _save_grid(scales, rows, SCALE_COLUMNS[1:], apply_scale_changes, 'scale_grid')
+    if 'scale_grid_saved' in st.session_state:
+        st.success(st.session_state.pop('scale_grid_saved'))
+    
+    if not scales:
+        st.info("Add a scale above to give it answers.")
+        return
+    
+    st.subheader("Scale Answers")
+    scale_names = {scale['id']: scale['name'] for scale in scales}
+    scale_ids = {name: scale_id for scale_id, name in scale_names.items()}
+    loaded = [dict(a) for a in fetch_scale_answers()]
+    grid_key = f"scale_answer_grid_{st.session_state.get('scale_answer_grid_version', 0)}"
+    with st.form("scale_answer_grid_form"):
+        df = pd.DataFrame(loaded, columns=SCALE_ANSWER_COLUMNS)
+        df['scale_id'] = df['scale_id'].map(scale_names)
+        edited = st.data_editor(
+            df,
+            column_config={
+                'id': st.column_config.NumberColumn('ID', disabled=True),
+                'scale_id': st.column_config.SelectboxColumn('Scale', options=list(scale_ids), required=True),
+                'score': st.column_config.NumberColumn('Score', step=1, required=True, default=0),
+                'answer': st.column_config.TextColumn('Answer', required=True, width="large"),
+            },
+            num_rows="dynamic",
+            hide_index=True,
+            key=grid_key
+        )
+        save_button = st.form_submit_button("Save Scale Answers")
+    
+    if save_button:
+        rows = _grid_rows(edited)
+        if any(row['scale_id'] not in scale_ids or not row['answer'] for row in rows):
+            st.error("Every answer needs a scale and answer text.")
+            return
+        for row in rows:
+            row['scale_id'] = scale_ids[row['scale_id']]
+        _save_grid(loaded, rows, SCALE_ANSWER_COLUMNS[1:], apply_answer_changes, 'scale_answer_grid')
+    if 'scale_answer_grid_saved' in st.session_state:
+        st.success(st.session_state.pop('scale_answer_grid_saved'))
+
+def _save_grid(loaded, rows, columns, apply_changes, grid):
+    """Diff an edited grid against its loaded rows, apply the changes and reset the grid."""
+    inserts, updates, deletes = _diff_rows(loaded, rows, columns)
+    if not (inserts or updates or deletes):
+        st.info("No changes to save.")
+        return
+    try:
+        apply_changes(inserts, updates, deletes)
+    except ValueError as e:
+        st.error(str(e))
+        return
+    st.session_state[f'{grid}_version'] = st.session_state.get(f'{grid}_version', 0) + 1
+    st.session_state[f'{grid}_saved'] = (
+        f"Saved: {len(inserts)} added, {len(updates)} updated, {len(deletes)} deleted."
+    )
+    st.rerun()
+
+def _grid_rows(df):
+    """Rows of an edited grid as dicts of plain Python values (None for blanks)."""
+    rows = []
+    for record in df.to_dict('records'):
+        row = {}
+        for key, value in record.items():
+            if pd.isna(value):
+                value = None
+            elif hasattr(value, 'item'):
+                # numpy scalars cannot be bound as SQL parameters
+                value = value.item()
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            row[key] = value
+        rows.append(row)
+    return rows
+
+def _diff_rows(loaded, rows, columns):
+    """
+    Compare edited grid rows with the rows originally loaded into it. Returns
+    (inserts, updates, deletes): new rows' values, (loaded row, new values)
+    pairs for changed rows, and ids of rows no longer present.
+    """
+    loaded_by_id = {row['id']: dict(row) for row in loaded}
+    inserts, updates, kept = [], [], set()
+    for row in rows:
+        values = {column: row[column] for column in columns}
+        if row.get('id') is None:
+            inserts.append(values)
+            continue
+        old = loaded_by_id[row['id']]
+        kept.add(row['id'])
+        if any(values[column] != old[column] for column in columns):
+            updates.append((old, values))
+    deletes = [row_id for row_id in loaded_by_id if row_id not in kept]
+    return inserts, updates, deletes
+
+def _renumber(rows):
+    """Set qsequence to 1, 2, 3, ... within each type and category, keeping the current order."""
+    groups = {}
+    for row in sorted(rows, key=lambda r: (r['qsequence'] or 0, r['id'] or float('inf'))):
+        groups.setdefault((row['qtype'], row['category']), []).append(row)
+    for group in groups.values():
+        for i, row in enumerate(group, start=1):
+            row['qsequence'] = i
+
+def manage_reports():
+    """Interface for batch generating static HTML reports."""
+    st.header("Generate Reports")
+    st.write(f"Reports are written to `{REPORT_DIR}`. Assessments whose choices have not changed since the last run are skipped.")
+    
+    clients = fetch_all_clients()
+    client_options = [None] + [client['id'] for client in clients]
+    client_names = {client['id']: client['name'] for client in clients}
+    
+    with st.form("generate_reports_form"):
+        client_id = st.selectbox(
+            "Client:",
+            client_options,
+            format_func=lambda x: "All Clients" if x is None else client_names[x]
+        )
+        force = st.checkbox("Re-render all reports, ignoring the cache", value=False)
         
-        selected_answer = answers[selected_a_idx]
+        submit_button = st.form_submit_button("Generate Reports")
         
-        # Edit or delete the selected answer
-        col1, col2 = st.columns(2)
+        if submit_button:
+            # Report runs can take minutes, so they go to the background job queue
+            job_id = enqueue_job("reports", {"client_id": client_id, "force": force})
+            st.success(f"Report run queued as job {job_id}. Follow its progress in the Jobs panel.")
+
+def _questionnaire_content(questionnaire):
+    """Comparable content of a questionnaire, ignoring how it was loaded."""
+    return (questionnaire['questions'], sorted(questionnaire['answers_by_id'].items()))
+
+def manage_versions():
+    """Interface for publishing questionnaire versions."""
+    st.header("Questionnaire Versions")
+    st.write(
+        "Each assessment is pinned to the questionnaire version that was current when it was created. "
+        "Question and answer edits only reach new assessments once a new version is published."
+    )
+    
+    versions = fetch_questionnaire_versions()
+    
+    for qtype, label in [("org", "Organization"), ("action", "Action")]:
+        latest = next((v for v in versions if v['qtype'] == qtype), None)
+        live = fetch_live_questionnaire(qtype)
+        unpublished = latest is None or (
+            _questionnaire_content(live) != _questionnaire_content(fetch_questionnaire(latest['id']))
+        )
         
-        with col1:
-            if st.button("Edit Selected Answer"):
-                st.session_state['editing_answer'] = selected_answer
+        st.subheader(f"{label} Questionnaire")
+        if latest is None:
+            st.write("Not yet published.")
+        else:
+            published = datetime.fromtimestamp(latest['published_at']).strftime("%Y-%m-%d %H:%M")
+            st.write(f"Latest version: **{latest['id']}**, published {published}.")
         
-        with col2:
-            if st.button("Delete Selected Answer"):
-                if st.session_state.get('confirm_delete_answer') == selected_answer['id']:
-                    delete_answer(selected_answer['id'])
-                    st.success(f"Answer ID {selected_answer['id']} deleted successfully!")
-                    # Clear the session state
-                    if 'confirm_delete_answer' in st.session_state:
-                        del st.session_state['confirm_delete_answer']
-                    st.rerun()
-                else:
-                    st.session_state['confirm_delete_answer'] = selected_answer['id']
-                    st.warning(f"Click 'Delete Selected Answer' again to confirm deletion of answer ID {selected_answer['id']}.")
+        if unpublished:
+            if latest is not None:
+                st.info("The questions or answers have changed since the latest version.")
+            if st.button(f"Publish {label} Questionnaire", key=f"publish_{qtype}"):
+                version_id = publish_questionnaire(qtype)
+                st.success(f"Published version {version_id}.")
+                st.rerun()
+        else:
+            st.write("The latest version matches the current questions and answers.")
+    
+    if versions:
+        st.subheader("All Versions")
+        df = pd.DataFrame([dict(v) for v in versions])
+        df['published_at'] = df['published_at'].apply(
+            lambda t: datetime.fromtimestamp(t).strftime("%Y-%m-%d %H:%M:%S")
+        )
+        st.dataframe(
+            df,
+            column_config={'id': 'Version', 'qtype': 'Type', 'published_at': 'Published'},
+            hide_index=True
+        )
+
+def manage_retention():
+    """Interface for purging old data and reclaiming space."""
+    st.header("Data Retention")
+    st.write(f"Purged data is archived as compressed JSON Lines in `{ARCHIVE_DIR}` before it is deleted.")
+    
+    st.subheader("Storage")
+    st.dataframe(
+        pd.DataFrame(storage_stats()),
+        column_config={
+            'database': 'Database',
+            'size_kb': 'Size (KB)',
+            'free_kb': 'Free (KB)',
+            'cache_kb': 'Page Cache (KB)',
+        },
+        hide_index=True
+    )
+    if st.button("Reclaim Free Space"):
+        job_id = enqueue_job("reclaim_space")
+        st.success(f"Reclaim queued as job {job_id}.")
+    
+    st.subheader("Backups")
+    st.write(
+        f"Online backups are written to `{BACKUP_DIR}` without blocking assessors. "
+        "Restore one with `python -m app.backup restore <name>`."
+    )
+    backups = list_backups()
+    if backups:
+        st.write("Latest backups: " + ", ".join(f"`{path.name}`" for path in backups[:5]))
+    else:
+        st.info("No backups yet.")
+    if st.button("Back Up Now"):
+        job_id = enqueue_job("backup", max_attempts=1)
+        st.success(f"Backup queued as job {job_id}. Follow its progress in the Jobs panel.")
+    
+    clients = fetch_all_clients()
+    client_options = [None] + [client['id'] for client in clients]
+    client_names = {client['id']: client['name'] for client in clients}
+    
+    st.subheader("Purge Old Assessments")
+    with st.form("purge_assessments_form"):
+        older_than_days = st.number_input("Not changed for at least (days):", min_value=1, value=365, step=1)
+        client_id = st.selectbox(
+            "Client:",
+            client_options,
+            format_func=lambda x: "All Clients" if x is None else client_names[x],
+            key="purge_client_filter"
+        )
+        archive = st.checkbox("Archive before deleting", value=True, key="purge_assessments_archive")
         
-        # Edit answer form
-        if st.session_state.get('editing_answer'):
-            a = st.session_state['editing_answer']
-            st.subheader(f"Edit Answer ID: {a['id']}")
+        if st.form_submit_button("Purge Assessments"):
+            job_id = enqueue_job("purge", {
+                "older_than_days": int(older_than_days), "client_id": client_id, "archive": archive,
+            }, max_attempts=1)
+            st.success(f"Purge queued as job {job_id}. Follow its progress in the Jobs panel.")
+    
+    st.subheader("Purge a Client")
+    if clients:
+        with st.form("purge_client_form"):
+            client_id = st.selectbox(
+                "Client:",
+                [client['id'] for client in clients],
+                format_func=lambda x: client_names[x],
+                key="purge_client"
+            )
+            archive = st.checkbox("Archive before deleting", value=True, key="purge_client_archive")
+            confirm = st.checkbox("I understand this deletes the client and all of its assessments")
             
-            with st.form("edit_answer_form"):
-                # Pre-fill form with existing values
-                answer_text = st.text_area("Answer", value=a['answer'])
-                score = st.number_input("Score", value=a['score'], step=1)
-                
-                update_button = st.form_submit_button("Update Answer")
-                
-                if update_button and answer_text:
-                    update_answer(a['id'], score, answer_text)
-                    st.success(f"Answer ID {a['id']} updated successfully!")
-                    # Clear the editing state
-                    if 'editing_answer' in st.session_state:
-                        del st.session_state['editing_answer']
-                    st.rerun()
-    else:
-        st.info(f"No answers found for this question. Please add answers.")
+            if st.form_submit_button("Purge Client"):
+                if confirm:
+                    job_id = enqueue_job("purge", {"client_ids": [client_id], "archive": archive}, max_attempts=1)
+                    st.success(f"Purge queued as job {job_id}. Follow its progress in the Jobs panel.")
+                else:
+                    st.error("Please confirm the purge.")
@@ -0,0 +1,181 @@
+import pandas as pd
+import plotly.express as px
+
+
+def results_frame(results):
+    """Build the per-question results DataFrame with a gap column."""
+    df = pd.DataFrame([dict(r) for r in results])
+
+    # Calculate gap for each row (gap is 0 when actual >= desired)
+    df['gap'] = (df['desired_score'] - df['actual_score']).clip(lower=0)
+    return df
+
+def category_summary(df):
+    """Aggregate scores and gaps by category, largest gap first."""
+    # Group by category and calculate metrics
+    category_df = df.groupby('category').agg({
+        'actual_score': 'sum',
+        'desired_score': 'sum',
+        'gap': 'sum'
+    }).reset_index()
+
+    # Calculate gap percentage correctly (sum of gaps / sum of desired)
+    category_df['gap_percentage'] = (category_df['gap'] / category_df['desired_score'] * 100).round(1)
+
+    # Sort by gap (largest first)
+    return category_df.sort_values('gap', ascending=False)
+
+def top_gaps(df, category=None, only_gaps=True, limit=10, offset=0, ranking=None):
+    """
+    One page of question results, largest gap first, optionally for a single
+    category. Returns (page, total rows across all pages). Only the rows up to
+    the end of the page are ranked, not the whole category, unless ranking
+    (row positions already in gap order, from a result document) is given.
+    """
+    rows = df if ranking is None else df.iloc[ranking]
+    if category is not None:
+        rows = rows[rows['category'] == category]
+    if only_gaps:
+        rows = rows[rows['gap'] > 0]
+    if ranking is not None:
+        return rows.iloc[offset:offset + limit], len(rows)
+    return rows.nlargest(offset + limit, 'gap').iloc[offset:], len(rows)
+
+def result_document(df, category_df, trends):
+    """
+    A completed assessment's results as a compact, JSON-serialisable document:
+    totals, the question and category tables column by column, the question
+    positions ranked by gap and the trend points the charts are drawn from.
+    """
+    def columns(frame):
+        # NaN (a question with no answers left in the catalog) becomes null
+        return {name: [None if pd.isna(v) else v for v in frame[name].tolist()] for name in frame.columns}
+    return {
+        'format': 1,
+        'totals': {
+            'actual_score': df['actual_score'].sum().item(),
+            'desired_score': df['desired_score'].sum().item(),
+            'gap': df['gap'].sum().item(),
+        },
+        'questions': columns(df),
+        'categories': columns(category_df),
+        'ranked_gaps': df['gap'].sort_values(ascending=False, kind='stable').index.tolist(),
+        'trends': [dict(point) for point in trends],
+    }
+
+def document_frames(document):
+    """The results frame and category summary stored in a result document."""
+    df = pd.DataFrame(document['questions'])
+    category_df = pd.DataFrame(document['categories'])
+    return df, category_df
+
+def score_chart(category_df):
+    """Grouped bar chart of actual vs. required scores by category."""
+    # Prepare data for bar chart
+    chart_data = pd.melt(
+        category_df,
+        id_vars=['category'],
+        value_vars=['actual_score', 'desired_score'],
+        var_name='Score Type',
+        value_name='Score'
+    )
+
+    # Rename the score types for better display
+    chart_data['Score Type'] = chart_data['Score Type'].map({
+        'actual_score': 'Actual',
+        'desired_score': 'Required'
+    })
+
+    return px.bar(
+        chart_data,
+        x='category',
+        y='Score',
+        color='Score Type',
+        barmode='group',
+        title='Actual vs. Required Scores by Category',
+        labels={'category': 'Category', 'Score': 'Score'}
+    )
+
+def gap_chart(category_df):
+    """Bar chart of score gaps by category."""
+    return px.bar(
+        category_df,
+        x='category',
+        y='gap',
+        color='gap',
+        title='Score Gaps by Category',
+        labels={'category': 'Category', 'gap': 'Gap (Required - Actual)'},
+        color_continuous_scale='RdYlGn_r'  # Red for large gaps, green for small gaps
+    )
+
+def trend_chart(trends):
+    """Line chart of each category's gap over time from trend points."""
+    trend_df = pd.DataFrame(trends)
+    trend_df['time'] = pd.to_datetime(trend_df['bucket_start'], unit='s')
+    return px.line(
+        trend_df,
+        x='time',
+        y='gap',
+        color='category',
+        markers=True,
+        title='Score Gaps by Category Over Time',
+        labels={'time': 'Date', 'gap': 'Gap (Required - Actual)', 'category': 'Category'}
+    )
+
+def sweep_chart(summary):
+    """Line chart of the total gap for each uniform target level of a sweep."""
+    return px.line(
+        summary.reset_index(),
+        x='target_level',
+        y='gap',
+        markers=True,
+        title='Total Gap by Target Level',
+        labels={'target_level': 'Target Level', 'gap': 'Total Gap'}
+    )
+
+def scenario_chart(category_gaps):
+    """Grouped bar chart of each scenario's gap by category."""
+    chart_data = category_gaps.reset_index().melt(id_vars='scenario', var_name='category', value_name='gap')
+    return px.bar(
+        chart_data,
+        x='category',
+        y='gap',
+        color='scenario',
+        barmode='group',
+        title='Gaps by Category per Scenario',
+        labels={'category': 'Category', 'gap': 'Gap (Target - Actual)', 'scenario': 'Scenario'}
+    )
+
+def assessment_heatmap(category_gaps):
+    """Heatmap of the gap per assessment (rows) and category (columns)."""
+    return px.imshow(
+        category_gaps,
+        color_continuous_scale='RdYlGn_r',
+        aspect='auto',
+        text_auto=True,
+        title='Score Gaps by Category per Assessment',
+        labels={'x': 'Category', 'y': 'Assessment', 'color': 'Gap'}
+    )
+
+def client_heatmap(client_values, value_label='Gap'):
+    """Heatmap of a value per client (rows) and category (columns), for the portfolio dashboard."""
+    return px.imshow(
+        client_values,
+        color_continuous_scale='RdYlGn_r',
+        aspect='auto',
+        text_auto=True,
+        title=f'{value_label} by Category per Client',
+        labels={'x': 'Category', 'y': 'Client', 'color': value_label}
+    )
+
+def category_weakness_chart(category_totals):
+    """Bar chart of each category's gap percentage across all clients, weakest first."""
+    return px.bar(
+        category_totals.reset_index(),
+        x='category',
+        y='gap_percentage',
+        color='gap_percentage',
+        title='Gap % by Category across Clients',
+        labels={'category': 'Category', 'gap_percentage': 'Gap % of Required'},
+        color_continuous_scale='RdYlGn_r'
+    )
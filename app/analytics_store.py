@@ -0,0 +1,416 @@
+"""
+Columnar analytics store: every assessment's scores as NumPy arrays on disk.
+
+Without it, each dashboard, portfolio report and export joins choices,
+answers and questions again for every assessment it reads. The store keeps one
+entry per answered question in flat arrays, grouped by assessment:
+
+    assessment_ids.npy   stored assessments, sorted by id
+    offsets.npy          assessment i's entries are offsets[i]:offsets[i + 1]
+    event_ids.npy        each assessment's latest choice event when it was stored
+    question_ids.npy     per entry: question id,
+    actual.npy           actual score,
+    desired.npy          required score,
+    category_codes.npy   and category, as an index into manifest.json's categories
+
+The arrays are memory-mapped read-only. Every process shares the operating
+system's page cache, and slicing out one assessment copies nothing. Totals
+are computed over whole arrays at once, not per row.
+
+A refresh compares each assessment's latest choice event id with the stored
+one. It reloads only the assessments that were saved since, and drops purged
+ones. Each refresh writes a new generation directory and then points the
+CURRENT file at it atomically, so readers never see a half-written store. It
+is refreshed by a job (queued from the Jobs page, or by the job workers every
+RUDI_ANALYTICS_INTERVAL seconds if that is set) or by hand:
+
+    python -m app.analytics_store refresh [--full]
+    python -m app.analytics_store stats
+    python -m app.analytics_store export [--client-id N]
+
+Question and answer texts stay in the database. Assessments that predate
+questionnaire versions are scored against the live catalog. Editing an
+answer's score changes their results without a new save, so run
+refresh --full after such an edit.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from app import db
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+ANALYTICS_DIR = Path(os.environ.get("RUDI_ANALYTICS_DIR", Path(__file__).parents[1] / "analytics"))
+# Seconds between scheduled refreshes (0, the default, schedules none)
+ANALYTICS_INTERVAL = float(os.environ.get("RUDI_ANALYTICS_INTERVAL", "0"))
+# Assessments written to the export CSV at a time
+EXPORT_BATCH = 1000
+
+_ASSESSMENT_ARRAYS = {"assessment_ids": np.int64, "event_ids": np.int64}
+_ENTRY_ARRAYS = {"question_ids": np.int64, "actual": np.int32, "desired": np.int32, "category_codes": np.int32}
+
+_loaded = None
+
+
+class AnalyticsStore:
+    """One generation of the store, with its arrays memory-mapped read-only."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.generation = self.path.name
+        for name in ("offsets", *_ASSESSMENT_ARRAYS, *_ENTRY_ARRAYS):
+            setattr(self, name, np.load(self.path / f"{name}.npy", mmap_mode="r"))
+        manifest = json.loads((self.path / "manifest.json").read_text(encoding="utf-8"))
+        self.categories = manifest["categories"]
+        self.refreshed_at = manifest["refreshed_at"]
+        self._cumulative = {}
+
+    def __len__(self):
+        return len(self.assessment_ids)
+
+    def positions(self, assessment_ids):
+        """Positions of the given assessments in the store; ids that are not stored are left out."""
+        assessment_ids = np.asarray(assessment_ids, dtype=np.int64)
+        positions = np.searchsorted(self.assessment_ids, assessment_ids)
+        found = positions < len(self)
+        found[found] = self.assessment_ids[positions[found]] == assessment_ids[found]
+        return positions[found]
+
+    def scores(self, assessment_id):
+        """
+        One assessment's entries as a dict of array views ('question_ids',
+        'actual', 'desired', 'category_codes'), or None if it is not stored.
+        """
+        positions = self.positions([assessment_id])
+        if not len(positions):
+            return None
+        start, end = self.offsets[positions[0]], self.offsets[positions[0] + 1]
+        return {name: getattr(self, name)[start:end] for name in _ENTRY_ARRAYS}
+
+    def _sums(self, column):
+        """Per-assessment sums of 'actual', 'desired' or 'gap', from a cumulative sum kept per generation."""
+        if column not in self._cumulative:
+            values = np.clip(self.desired - self.actual, 0, None) if column == "gap" else getattr(self, column)
+            self._cumulative[column] = np.concatenate([[0], np.cumsum(values, dtype=np.int64)])
+        cumulative = self._cumulative[column]
+        return cumulative[self.offsets[1:]] - cumulative[self.offsets[:-1]]
+
+    def totals(self, assessment_ids=None):
+        """Score totals per assessment: a DataFrame indexed by assessment_id (all stored ones by default)."""
+        frame = pd.DataFrame({
+            'actual_score': self._sums("actual"),
+            'desired_score': self._sums("desired"),
+            'gap': self._sums("gap"),
+            'questions': np.diff(self.offsets),
+        }, index=pd.Index(np.asarray(self.assessment_ids), name='assessment_id'))
+        if assessment_ids is not None:
+            frame = frame.iloc[self.positions(assessment_ids)]
+        return frame
+
+    def _entry_positions(self, positions):
+        """Entry indexes of the assessments at positions, and which of those assessments each belongs to."""
+        counts = self.offsets[positions + 1] - self.offsets[positions]
+        owner = np.repeat(np.arange(len(positions)), counts)
+        # Each entry's index is its assessment's start plus its place within the assessment
+        starts = np.repeat(self.offsets[positions], counts)
+        within = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return starts + within, owner
+
+    def category_totals(self, assessment_ids=None, column="gap"):
+        """
+        Sum of 'actual', 'desired' or 'gap' per assessment (rows) and category
+        (columns). A category an assessment has no answers in is NaN.
+        """
+        positions = np.arange(len(self)) if assessment_ids is None else self.positions(assessment_ids)
+        entries, owner = self._entry_positions(positions)
+        if column == "gap":
+            values = np.clip(self.desired[entries] - self.actual[entries], 0, None)
+        else:
+            values = getattr(self, column)[entries]
+        cells = owner * len(self.categories) + self.category_codes[entries]
+        shape = (len(positions), len(self.categories))
+        sums = np.bincount(cells, weights=values, minlength=shape[0] * shape[1]).reshape(shape)
+        counts = np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)
+        frame = pd.DataFrame(
+            np.where(counts > 0, sums, np.nan),
+            index=pd.Index(self.assessment_ids[positions], name='assessment_id'),
+            columns=self.categories,
+        )
+        return frame.loc[:, counts.any(axis=0)]
+
+    def entries(self, assessment_ids=None):
+        """One row per stored answer (assessment_id, question_id, category, scores and gap) as a DataFrame."""
+        positions = np.arange(len(self)) if assessment_ids is None else self.positions(assessment_ids)
+        entries, owner = self._entry_positions(positions)
+        actual, desired = self.actual[entries], self.desired[entries]
+        return pd.DataFrame({
+            'assessment_id': self.assessment_ids[positions][owner],
+            'question_id': self.question_ids[entries],
+            'category': pd.Categorical.from_codes(self.category_codes[entries], self.categories),
+            'actual_score': actual,
+            'desired_score': desired,
+            'gap': np.clip(desired - actual, 0, None),
+        })
+
+
+def portfolio_totals(store, assessments, qtype=None):
+    """
+    Gap and required score per client (rows) and category (columns) across
+    the portfolio, as (gaps, desired) DataFrames indexed by client_id. Each
+    client counts with its latest stored assessment of each type (of qtype
+    only, if given), so repeated assessments of one client are not added up.
+    assessments are rows with id, client_id and qtype, as from
+    db.fetch_assessments().
+    """
+    frame = pd.DataFrame([
+        {'id': a['id'], 'client_id': a['client_id'], 'qtype': a['qtype']}
+        for a in assessments if qtype is None or a['qtype'] == qtype
+    ], columns=['id', 'client_id', 'qtype'])
+    frame = frame[frame['id'].isin(np.asarray(store.assessment_ids))]
+    latest = frame.sort_values('id').groupby(['client_id', 'qtype']).tail(1)
+    clients = latest.set_index('id')['client_id']
+    totals = []
+    for column in ("gap", "desired"):
+        by_assessment = store.category_totals(latest['id'].tolist(), column)
+        # A category none of a client's assessments answered stays NaN
+        totals.append(by_assessment.groupby(by_assessment.index.map(clients)).sum(min_count=1)
+                      .rename_axis('client_id'))
+    return tuple(totals)
+
+
+def load_store():
+    """The current generation of the store, or None if it has never been refreshed."""
+    global _loaded
+    try:
+        generation = (ANALYTICS_DIR / "CURRENT").read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    if _loaded is None or _loaded.generation != generation:
+        _loaded = AnalyticsStore(ANALYTICS_DIR / generation)
+    return _loaded
+
+
+@contextmanager
+def _refresh_lock():
+    """Only one process refreshes at a time; others wait and then find little left to do."""
+    ANALYTICS_DIR.mkdir(parents=True, exist_ok=True)
+    # Appending never truncates a file another process holds locked
+    with open(ANALYTICS_DIR / ".refresh.lock", "a") as lock_file:
+        _lock_file(lock_file)
+        try:
+            yield
+        finally:
+            _unlock_file(lock_file)
+
+
+def _lock_file(lock_file):
+    """Block until this process holds an exclusive lock on lock_file."""
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return
+    # msvcrt locks bytes from the current position and gives up after about 10 seconds
+    lock_file.seek(0)
+    while True:
+        try:
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def _unlock_file(lock_file):
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _load_assessment(assessment_id, category_codes):
+    """
+    One assessment's entries as arrays keyed like the store's, ordered by
+    question id, or None if it no longer exists. New category names are
+    added to category_codes.
+    """
+    assessment = db.fetch_assessment_by_id(assessment_id)
+    if assessment is None:
+        return None
+    questions_by_id = db.fetch_assessment_questionnaire(assessment_id, assessment['qtype'])['questions_by_id']
+    rows = sorted(
+        (row for row in db.fetch_choices_by_assessment(assessment_id) if row['question_id'] in questions_by_id),
+        key=lambda row: row['question_id'],
+    )
+    codes = [
+        category_codes.setdefault(questions_by_id[row['question_id']]['category'], len(category_codes))
+        for row in rows
+    ]
+    return {
+        "question_ids": np.array([row['question_id'] for row in rows], dtype=np.int64),
+        "actual": np.array([row['actual_score'] for row in rows], dtype=np.int32),
+        "desired": np.array([row['desired_score'] for row in rows], dtype=np.int32),
+        "category_codes": np.array(codes, dtype=np.int32),
+    }
+
+
+def _write_generation(arrays, categories):
+    """Write the arrays as the next generation, point CURRENT at it and drop all but the previous one."""
+    previous = (ANALYTICS_DIR / "CURRENT").read_text(encoding="utf-8").strip() \
+        if (ANALYTICS_DIR / "CURRENT").exists() else None
+    number = int(previous.removeprefix("gen_")) + 1 if previous else 1
+    generation = f"gen_{number:06d}"
+    tmp_path = ANALYTICS_DIR / f"{generation}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tmp_path.mkdir()
+    for name, array in arrays.items():
+        np.save(tmp_path / f"{name}.npy", array)
+    manifest = {'categories': categories, 'refreshed_at': int(time.time())}
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    tmp_path.rename(ANALYTICS_DIR / generation)
+    pointer = ANALYTICS_DIR / "CURRENT.tmp"
+    pointer.write_text(generation, encoding="utf-8")
+    os.replace(pointer, ANALYTICS_DIR / "CURRENT")
+    # Readers may still have the previous generation open
+    for path in ANALYTICS_DIR.glob("gen_*"):
+        if path.name not in (generation, previous):
+            shutil.rmtree(path, ignore_errors=True)
+    return generation
+
+
+def refresh_store(full=False, progress=None):
+    """
+    Bring the store up to date with the database, reloading only assessments
+    saved since the last refresh (every assessment if full). Returns a dict
+    with the 'generation', stored 'assessments' and 'entries', and how many
+    assessments were 'reloaded' and 'removed'. progress(done, total) is called
+    after each reloaded assessment.
+    """
+    with _refresh_lock():
+        current = None if full else load_store()
+        stored = dict(zip(current.assessment_ids.tolist(), current.event_ids.tolist())) if current else {}
+        with db.read_snapshot():
+            latest = db.fetch_latest_choice_events()
+            changed = sorted(a for a, event_id in latest.items() if stored.get(a) != event_id)
+            removed = sorted(set(stored) - set(latest))
+            if current is not None and not changed and not removed:
+                return {'generation': current.generation, 'assessments': len(current),
+                        'entries': len(current.actual), 'reloaded': 0, 'removed': 0}
+
+            categories = list(current.categories) if current else []
+            category_codes = {name: code for code, name in enumerate(categories)}
+            loaded = {}
+            for i, assessment_id in enumerate(changed):
+                entries = _load_assessment(assessment_id, category_codes)
+                if entries is not None:
+                    loaded[assessment_id] = entries
+                if progress:
+                    progress(i + 1, len(changed))
+
+        # Keep the unchanged assessments' entries as they are and append the reloaded ones
+        if current is not None:
+            keep = ~np.isin(current.assessment_ids, changed + removed)
+            counts = [np.diff(current.offsets)[keep]]
+            parts = {name: [getattr(current, name)[keep]] for name in _ASSESSMENT_ARRAYS}
+            kept_entries = np.repeat(keep, np.diff(current.offsets))
+            parts.update({name: [getattr(current, name)[kept_entries]] for name in _ENTRY_ARRAYS})
+        else:
+            # Empty arrays to start from, so a database without answers still gets a store
+            counts = [np.empty(0, dtype=np.int64)]
+            parts = {name: [np.empty(0, dtype=dtype)] for name, dtype in {**_ASSESSMENT_ARRAYS, **_ENTRY_ARRAYS}.items()}
+        ids = list(loaded)
+        counts.append(np.array([len(loaded[a]["actual"]) for a in ids], dtype=np.int64))
+        parts["assessment_ids"].append(np.array(ids, dtype=np.int64))
+        parts["event_ids"].append(np.array([latest[a] for a in ids], dtype=np.int64))
+        for name in _ENTRY_ARRAYS:
+            parts[name].extend(loaded[a][name] for a in ids)
+        dtypes = {**_ASSESSMENT_ARRAYS, **_ENTRY_ARRAYS}
+        arrays = {name: np.concatenate(chunks).astype(dtypes[name], copy=False) for name, chunks in parts.items()}
+        counts = np.concatenate(counts).astype(np.int64, copy=False)
+
+        # Put the assessments back in id order, moving each one's entries with it
+        order = np.argsort(arrays["assessment_ids"], kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        entry_order = np.argsort(rank[np.repeat(np.arange(len(counts)), counts)], kind="stable")
+        for name in _ASSESSMENT_ARRAYS:
+            arrays[name] = arrays[name][order]
+        for name in _ENTRY_ARRAYS:
+            arrays[name] = arrays[name][entry_order]
+        arrays["offsets"] = np.concatenate([[0], np.cumsum(counts[order])]).astype(np.int64)
+
+        names = [None] * len(category_codes)
+        for name, code in category_codes.items():
+            names[code] = name
+        generation = _write_generation(arrays, names)
+        return {'generation': generation, 'assessments': len(arrays["assessment_ids"]),
+                'entries': len(arrays["actual"]), 'reloaded': len(loaded), 'removed': len(removed)}
+
+
+def export_scores(path, client_id=None, progress=None):
+    """
+    Write every stored answer of every assessment (optionally one client's)
+    to a CSV file at path, after a refresh. Returns the number of assessments.
+    progress(done, total) is called after each batch.
+    """
+    refresh_store()
+    store = load_store()
+    assessments = {a['id']: a for a in db.fetch_assessments(client_id)}
+    ids = [a for a in store.assessment_ids.tolist() if a in assessments]
+    tmp_path = Path(path).with_suffix(".csv.tmp")
+    with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+        # One pass even with nothing to export, so the file still gets its header
+        for start in range(0, max(len(ids), 1), EXPORT_BATCH):
+            batch = store.entries(ids[start:start + EXPORT_BATCH])
+            batch.insert(0, 'client_name', batch['assessment_id'].map(lambda a: assessments[a]['client_name']))
+            batch.insert(2, 'assessment_name', batch['assessment_id'].map(lambda a: assessments[a]['name']))
+            batch.to_csv(f, index=False, header=start == 0)
+            if progress:
+                progress(min(start + EXPORT_BATCH, len(ids)), len(ids))
+    tmp_path.replace(path)
+    return len(ids)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Columnar analytics store maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    refresh_parser = subparsers.add_parser("refresh", help="Reload assessments saved since the last refresh")
+    refresh_parser.add_argument("--full", action="store_true", help="Rebuild the store from every assessment")
+    subparsers.add_parser("stats", help="Describe the current store")
+    export_parser = subparsers.add_parser("export", help="Export every stored answer to CSV")
+    export_parser.add_argument("--client-id", type=int, help="Only this client's assessments")
+    export_parser.add_argument("--output", type=Path, default=Path("scores.csv"), help="CSV file to write")
+    args = parser.parse_args(argv)
+
+    if args.command == "refresh":
+        start = time.perf_counter()
+        result = refresh_store(full=args.full)
+        print(f"{result['generation']}: {result['assessments']} assessments, {result['entries']} answers "
+              f"({result['reloaded']} reloaded, {result['removed']} removed) in {time.perf_counter() - start:.2f}s")
+    elif args.command == "stats":
+        store = load_store()
+        if store is None:
+            print(f"No analytics store under {ANALYTICS_DIR} yet; run the refresh command.")
+            return
+        size = sum(path.stat().st_size for path in store.path.iterdir())
+        print(f"{store.generation} under {ANALYTICS_DIR}, refreshed {time.ctime(store.refreshed_at)}")
+        print(f"{len(store)} assessments, {len(store.actual)} answers, {len(store.categories)} categories, "
+              f"{size / 1024:.0f} KiB")
+    elif args.command == "export":
+        count = export_scores(args.output, client_id=args.client_id)
+        print(f"Exported {count} assessments to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
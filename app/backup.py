@@ -0,0 +1,274 @@
+"""
+Online backups of the SQLite databases (the main file and every client shard)
+while the app keeps running, and restore from them.
+
+Each database is copied with SQLite's online backup API from a read-only
+connection that holds one read transaction for the whole copy. Under WAL that
+gives a consistent snapshot without blocking writers, and the copy never has
+to restart when an assessor saves mid-backup. Pages are copied in small
+batches with a pause after each, so saves are not starved of disk I/O during
+business hours (RUDI_BUSINESS_HOURS); outside them batches are larger and
+unpaused.
+
+A backup is a directory BACKUP_DIR/<timestamp>/ with one gzip-compressed
+database per file and a manifest.json of SHA-256 checksums. Restore verifies
+the checksums and the database integrity before anything is overwritten.
+
+    python -m app.backup create
+    python -m app.backup list
+    python -m app.backup verify BACKUP
+    python -m app.backup restore BACKUP
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app import db
+
+# Where backups are written
+BACKUP_DIR = Path(os.environ.get("RUDI_BACKUP_DIR", Path(__file__).parents[1] / "backups"))
+# Seconds between scheduled backups; 0 disables them
+BACKUP_INTERVAL = float(os.environ.get("RUDI_BACKUP_INTERVAL", "0"))
+# Number of backups kept; older ones are deleted after each new backup
+BACKUP_KEEP = int(os.environ.get("RUDI_BACKUP_KEEP", "14"))
+# Pages copied per step, and the pause after each step, during business hours
+BACKUP_PAGES = int(os.environ.get("RUDI_BACKUP_PAGES", "256"))
+BACKUP_SLEEP = float(os.environ.get("RUDI_BACKUP_SLEEP", "0.05"))
+# Local hours (start-end, end exclusive) in which backups are throttled; empty throttles always
+BUSINESS_HOURS = os.environ.get("RUDI_BUSINESS_HOURS", "8-18")
+
+MANIFEST_NAME = "manifest.json"
+# Multiplier on the batch size outside business hours
+OFF_HOURS_BATCH_FACTOR = 16
+
+
+def _throttle(now=None):
+    """(pages per step, pause after each step) for a backup starting now."""
+    if BUSINESS_HOURS:
+        start, end = (int(hour) for hour in BUSINESS_HOURS.split("-"))
+        hour = (now or datetime.now()).hour
+        if not start <= hour < end:
+            return BACKUP_PAGES * OFF_HOURS_BATCH_FACTOR, 0.0
+    return BACKUP_PAGES, BACKUP_SLEEP
+
+
+def _databases():
+    """(name, engine) of every database to back up: the main file and each client shard."""
+    databases = [("main", db.get_engine())]
+    if db.sharding_enabled():
+        databases += [(f"client_{client_id}", db.get_shard_engine(client_id)) for client_id in db.shard_client_ids()]
+    for name, engine in databases:
+        if engine.dialect.name != "sqlite" or not engine.url.database or engine.url.database == ":memory:":
+            raise ValueError("Online backups are only supported for SQLite database files")
+    return databases
+
+
+def _database_path(name):
+    """Live file a backed-up database is restored to."""
+    if name == "main":
+        return Path(db.get_engine().url.database)
+    return db.shard_path(int(name.removeprefix("client_")))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _check_integrity(path):
+    """Raise ValueError unless the database file passes SQLite's quick_check."""
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise ValueError(f"{path} failed its integrity check: {result}")
+
+
+def _copy_database(engine, dest_path, pages, pause, progress):
+    """Copy one live database to dest_path through the online backup API from a snapshot."""
+    raw = db.get_read_engine(engine).raw_connection()
+    dest = sqlite3.connect(dest_path)
+    try:
+        source = raw.driver_connection
+        # Pin one snapshot for the whole copy so concurrent writes never restart it
+        source.execute("BEGIN")
+        source.execute("SELECT count(*) FROM sqlite_master").fetchall()
+
+        def step(status, remaining, total):
+            if progress:
+                progress((total - remaining) / total if total else 1.0)
+            if remaining and pause:
+                time.sleep(pause)
+
+        try:
+            source.backup(dest, pages=pages, progress=step)
+        finally:
+            source.execute("ROLLBACK")
+    finally:
+        dest.close()
+        raw.close()
+
+
+def create_backup(progress=None):
+    """
+    Back up every database into a new directory under BACKUP_DIR and return its
+    path. progress, if given, is called with (fraction, message) as pages are
+    copied.
+    """
+    pages, pause = _throttle()
+    databases = _databases()
+    BACKUP_DIR.mkdir(parents=True, exist_ok=True)
+    backup_dir = BACKUP_DIR / datetime.now().strftime("%Y%m%d_%H%M%S")
+    tmp_dir = backup_dir.with_name(backup_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+
+    manifest = {"created_at": time.time(), "databases": []}
+    try:
+        for i, (name, engine) in enumerate(databases):
+            raw_path = tmp_dir / f"{name}.db"
+
+            def report(fraction, i=i, name=name):
+                if progress:
+                    progress((i + fraction) / len(databases), f"Copying {name}")
+
+            _copy_database(engine, raw_path, pages, pause, report)
+            _check_integrity(raw_path)
+
+            gz_path = raw_path.with_suffix(".db.gz")
+            with open(raw_path, "rb") as src, gzip.open(gz_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            manifest["databases"].append({
+                "name": name,
+                "file": gz_path.name,
+                "size": raw_path.stat().st_size,
+                "sha256": _sha256(gz_path),
+            })
+            raw_path.unlink()
+        (tmp_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=1))
+        tmp_dir.replace(backup_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    _prune_backups()
+    return backup_dir
+
+
+def _prune_backups():
+    """Delete all but the newest BACKUP_KEEP backups."""
+    for backup_dir in list_backups()[BACKUP_KEEP:]:
+        shutil.rmtree(backup_dir, ignore_errors=True)
+
+
+def list_backups():
+    """Completed backup directories, newest first."""
+    if not BACKUP_DIR.exists():
+        return []
+    return sorted(
+        (path for path in BACKUP_DIR.iterdir() if (path / MANIFEST_NAME).exists()),
+        reverse=True,
+    )
+
+
+def _resolve_backup(backup):
+    """Accept a backup directory path or its name under BACKUP_DIR."""
+    path = Path(backup)
+    if not path.exists():
+        path = BACKUP_DIR / backup
+    if not (path / MANIFEST_NAME).exists():
+        raise FileNotFoundError(f"No backup manifest in {path}")
+    return path
+
+
+def verify_backup(backup):
+    """Check every file of a backup against its manifest checksum; returns the manifest."""
+    backup_dir = _resolve_backup(backup)
+    manifest = json.loads((backup_dir / MANIFEST_NAME).read_text())
+    for entry in manifest["databases"]:
+        path = backup_dir / entry["file"]
+        if not path.exists():
+            raise ValueError(f"{path} is missing")
+        if _sha256(path) != entry["sha256"]:
+            raise ValueError(f"{path} does not match its checksum")
+    return manifest
+
+
+def restore_backup(backup):
+    """
+    Restore every database in a backup over the live files. Each file is
+    verified and decompressed first, then copied in with the backup API in one
+    step, so other connections see either the old or the restored database.
+    Restart the app afterwards so no process keeps cached rows.
+    """
+    backup_dir = _resolve_backup(backup)
+    manifest = verify_backup(backup_dir)
+
+    staged = []
+    try:
+        for entry in manifest["databases"]:
+            raw_path = backup_dir / f"{entry['name']}.restore.db"
+            with gzip.open(backup_dir / entry["file"], "rb") as src, open(raw_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+            _check_integrity(raw_path)
+            staged.append((entry["name"], raw_path))
+
+        for name, raw_path in staged:
+            target = _database_path(name)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            source = sqlite3.connect(raw_path)
+            dest = sqlite3.connect(target, timeout=30)
+            try:
+                source.backup(dest)
+            finally:
+                dest.close()
+                source.close()
+    finally:
+        for _, raw_path in staged:
+            raw_path.unlink(missing_ok=True)
+
+    db.dispose_engines()
+    return [name for name, _ in staged]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Online backup and restore of the SQLite databases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("create", help="Back up the main database and all shards")
+    subparsers.add_parser("list", help="List backups, newest first")
+    verify_parser = subparsers.add_parser("verify", help="Check a backup's checksums")
+    verify_parser.add_argument("backup", help="Backup directory or name")
+    restore_parser = subparsers.add_parser("restore", help="Restore a backup over the live databases")
+    restore_parser.add_argument("backup", help="Backup directory or name")
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        print(f"Backup written to {create_backup()}")
+    elif args.command == "list":
+        for backup_dir in list_backups():
+            manifest = json.loads((backup_dir / MANIFEST_NAME).read_text())
+            size = sum(entry["size"] for entry in manifest["databases"])
+            print(f"{backup_dir.name}\t{len(manifest['databases'])} databases\t{size // 1024} KB")
+    elif args.command == "verify":
+        manifest = verify_backup(args.backup)
+        print(f"OK: {len(manifest['databases'])} databases match their checksums")
+    elif args.command == "restore":
+        restored = restore_backup(args.backup)
+        print(f"Restored {', '.join(restored)}. Restart the app to clear cached data.")
+
+
+if __name__ == "__main__":
+    main()
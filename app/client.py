@@ -1,3 +1,5 @@
+import os
+
 import streamlit as st
 
 from app.db import (
@@ -5,12 +7,16 @@ from app.db import (
     create_assessment,
     delete_assessment,
     fetch_all_clients,
-    fetch_answers_by_question,
+    fetch_assessment_questionnaire,
     fetch_assessments,
-    fetch_choices_by_assessment,
-    fetch_questions_by_type,
-    save_choice,
+    merge_choices,
 )
+from app.finalize import complete_assessment
+from app.offline import CONFLICT_POLICIES, merge_upload, parse_upload, template_csv, template_json, templates_zip
+from app.prefetch import CategoryCache
+
+# Questions per page of a category form; only the visible page's widgets are built
+FORM_PAGE_SIZE = int(os.environ.get("RUDI_FORM_PAGE_SIZE", "20"))
 
 
 def client_view():
@@ -98,7 +104,8 @@ def client_view():
                 cols = st.columns([4, 1])
                 
                 # Make the assessment name clickable
-                if cols[0].button(f"{assessment['name']} ({assessment['qtype']} type)", key=f"select_{assessment['id']}"):
+                status = " - completed" if assessment['status'] == 'completed' else ""
+                if cols[0].button(f"{assessment['name']} ({assessment['qtype']} type{status})", key=f"select_{assessment['id']}"):
                     st.session_state['assessment_id'] = assessment['id']
                     st.session_state['assessment_name'] = assessment['name']
                     st.session_state['assessment_type'] = assessment['qtype']
@@ -141,6 +148,9 @@ def client_view():
                 st.success(f"Assessment '{assessment_name}' created successfully!")
                 st.rerun()
         
+        with st.expander("Offline Capture", expanded=False):
+            offline_capture(client_id, existing_assessments)
+        
         # Step 3: Answer Questions
         if 'assessment_id' in st.session_state:
             assessment_id = st.session_state['assessment_id']
@@ -148,9 +158,12 @@ def client_view():
             assessment_type = st.session_state['assessment_type']
             
             st.header(f"Step 3: Complete Assessment - {assessment_name}")
+            if any(a['id'] == assessment_id and a['status'] == 'completed' for a in existing_assessments):
+                st.info("This assessment is completed. Saving a changed answer reopens it until it is completed again.")
             
-            # Fetch questions for this assessment type
-            questions = fetch_questions_by_type(assessment_type)
+            # Fetch the questionnaire version this assessment is pinned to
+            questionnaire = fetch_assessment_questionnaire(assessment_id, assessment_type)
+            questions = questionnaire['questions']
             
             if not questions:
                 st.warning(f"No questions found for {assessment_type} assessment type. Please add questions in the Admin Panel.")
@@ -167,6 +180,7 @@ def client_view():
                 if 'progress' not in st.session_state:
                     st.session_state['progress'] = {
                         'current_category_index': 0,
+                        'current_page': 0,
                         'completed_questions': set()
                     }
                 
@@ -179,31 +193,55 @@ def client_view():
                 if current_cat_idx > 0:
                     if col1.button("Previous Category"):
                         st.session_state['progress']['current_category_index'] -= 1
+                        st.session_state['progress']['current_page'] = 0
+                        st.session_state.pop(f"category_{current_cat_idx - 1}_page", None)
                         st.rerun()
                 
                 if current_cat_idx < len(category_names) - 1:
                     if col2.button("Next Category"):
                         st.session_state['progress']['current_category_index'] += 1
+                        st.session_state['progress']['current_page'] = 0
+                        st.session_state.pop(f"category_{current_cat_idx + 1}_page", None)
                         st.rerun()
                 
                 # Display current category
                 current_category = category_names[current_cat_idx] if category_names else "Strategy & Leadership"
                 st.subheader(f"Category: {current_category}")
                 
-                # Fetch existing choices if this is an existing assessment
-                existing_choices = {}
-                if 'assessment_id' in st.session_state:
-                    choices = fetch_choices_by_assessment(st.session_state['assessment_id'])
-                    for choice in choices:
-                        question_id = choice['question_id']
-                        existing_choices[question_id] = {
-                            'actual': choice['answer_id_actual'],
-                            'desired': choice['answer_id_desired']
-                        }
+                # Categories are loaded through a per-session cache; the neighbouring
+                # ones are prefetched in the background while this one is answered
+                cache = st.session_state.get('category_cache')
+                if cache is None or cache.assessment_id != assessment_id:
+                    cache = st.session_state['category_cache'] = CategoryCache(assessment_id, assessment_type)
+                category_data = cache.get(current_category)
+                cache.prefetch(category_names[max(current_cat_idx - 1, 0):current_cat_idx + 2])
+                existing_choices = category_data['choices']
+                
+                # Split the category into pages; the index marks pages with unanswered questions
+                category_questions = category_data['questions']
+                pages = [category_questions[i:i + FORM_PAGE_SIZE]
+                         for i in range(0, len(category_questions), FORM_PAGE_SIZE)] or [[]]
+                current_page = min(st.session_state['progress'].get('current_page', 0), len(pages) - 1)
+                if len(pages) > 1:
+                    unanswered = [sum(q['id'] not in existing_choices for q in page) for page in pages]
+                    current_page = st.radio(
+                        "Page:",
+                        range(len(pages)),
+                        index=current_page,
+                        horizontal=True,
+                        format_func=lambda p: (
+                            f"Q{pages[p][0]['qsequence']}"
+                            + (f"-Q{pages[p][-1]['qsequence']}" if len(pages[p]) > 1 else "")
+                            + (f" ({unanswered[p]} unanswered)" if unanswered[p] else " ✓")
+                        ),
+                        key=f"category_{current_cat_idx}_page"
+                    )
+                st.session_state['progress']['current_page'] = current_page
+                page_questions = pages[current_page]
                 
-                # Process questions for the current category
-                with st.form(f"category_{current_cat_idx}_form"):
-                    for i, question in enumerate(categories[current_category]):
+                # Process questions for the current page
+                with st.form(f"category_{current_cat_idx}_page_{current_page}_form"):
+                    for i, question in enumerate(page_questions):
                         question_id = question['id']
                         
                         # Add spacing between questions (except the first one)
@@ -214,7 +252,7 @@ def client_view():
                         st.write(f"**Q{question['qsequence']}**: {question['question']}")
                         
                         # Get answers for this question
-                        answers = fetch_answers_by_question(question_id)
+                        answers = category_data['answers_by_question'][question_id]
                         if not answers:
                             st.warning(f"No answers found for question ID {question_id}.")
                             continue
@@ -248,7 +286,7 @@ def client_view():
                                     index=actual_default_idx,
                                     key=f"actual_radio_{question_id}",
                                     horizontal=True,
-                                    format_func=lambda x: answer_labels[x]
+                                    format_func=lambda x, labels=answer_labels: labels[x]
                                 )
                             with cols[1]:
                                 required_idx = st.radio(
@@ -257,7 +295,7 @@ def client_view():
                                     index=desired_default_idx,
                                     key=f"required_radio_{question_id}",
                                     horizontal=True,
-                                    format_func=lambda x: answer_labels[x]
+                                    format_func=lambda x, labels=answer_labels: labels[x]
                                 )
                             st.session_state[f"q_{question_id}_actual_idx"] = actual_idx
                             st.session_state[f"q_{question_id}_desired_idx"] = required_idx
@@ -270,25 +308,39 @@ def client_view():
                         st.session_state[f"q_{question_id}_actual"] = answer_ids[actual_idx]
                         st.session_state[f"q_{question_id}_desired"] = answer_ids[desired_idx]
                     
-                    # Submit button for this category
+                    # Submit button for this page
                     submit_category = st.form_submit_button("Save Answers")
                     
                     if submit_category:
-                        # Save all answers for questions in this category
-                        for question in categories[current_category]:
+                        # Save all answers on this page in one transaction
+                        rows = []
+                        for question in page_questions:
                             question_id = question['id']
                             actual_answer_id = st.session_state.get(f"q_{question_id}_actual")
                             desired_answer_id = st.session_state.get(f"q_{question_id}_desired")
                             
                             if actual_answer_id and desired_answer_id:
-                                save_choice(assessment_id, question_id, desired_answer_id, actual_answer_id)
-                                st.session_state['progress']['completed_questions'].add(question_id)
+                                rows.append({
+                                    'assessment_id': assessment_id,
+                                    'question_id': question_id,
+                                    'answer_id_desired': desired_answer_id,
+                                    'answer_id_actual': actual_answer_id,
+                                })
+                        merge_choices(rows)
+                        st.session_state['progress']['completed_questions'].update(row['question_id'] for row in rows)
                         
+                        cache.invalidate(current_category)
                         st.success(f"Answers for {current_category} saved successfully!")
                         
-                        # Auto-advance to next category if not the last one
-                        if current_cat_idx < len(category_names) - 1:
+                        # Auto-advance to the next page, or the next category if this was the last page
+                        if current_page < len(pages) - 1:
+                            st.session_state['progress']['current_page'] = current_page + 1
+                            st.session_state.pop(f"category_{current_cat_idx}_page", None)
+                            st.rerun()
+                        elif current_cat_idx < len(category_names) - 1:
                             st.session_state['progress']['current_category_index'] += 1
+                            st.session_state['progress']['current_page'] = 0
+                            st.session_state.pop(f"category_{current_cat_idx + 1}_page", None)
                             st.rerun()
                 
                 # Show progress
@@ -300,10 +352,116 @@ def client_view():
                 # Complete assessment button (only show if some progress has been made)
                 if completed > 0:
                     if st.button("Complete Assessment"):
-                        # Clear session state related to the assessment
-                        for key in ['assessment_id', 'assessment_name', 'assessment_type', 'progress']:
-                            if key in st.session_state:
-                                del st.session_state[key]
-                        
-                        st.success("Assessment completed successfully! You can view the results in the Results Dashboard.")
-                        st.rerun()
+                        try:
+                            # Finalizes the results; saving a changed answer later reopens the assessment
+                            complete_assessment(assessment_id, assessment_type)
+                        except ValueError as e:
+                            st.error(str(e))
+                        else:
+                            # Clear session state related to the assessment
+                            for key in ['assessment_id', 'assessment_name', 'assessment_type', 'progress']:
+                                if key in st.session_state:
+                                    del st.session_state[key]
+                            
+                            st.success("Assessment completed successfully! You can view the results in the Results Dashboard.")
+                            st.rerun()
+
+def offline_capture(client_id, assessments):
+    """Download offline templates and bulk upload completed ones."""
+    st.write(
+        "Download templates to fill in without a connection, then upload the completed files here. "
+        "Any number of files (or zip archives of them) can be uploaded at once."
+    )
+    
+    # Templates
+    if assessments:
+        fmt = st.radio("Template format:", ["json", "csv"], horizontal=True,
+                       format_func=str.upper, key="offline_format")
+        assessment_names = {a['id']: a['name'] for a in assessments}
+        col1, col2 = st.columns(2)
+        selected_id = col1.selectbox(
+            "Assessment:",
+            list(assessment_names),
+            format_func=lambda x: assessment_names[x],
+            key="offline_assessment"
+        )
+        # Templates are built on request, not on every rerun of this page
+        if col1.button("Prepare Template", key="offline_prepare_one"):
+            render = template_csv if fmt == "csv" else template_json
+            st.session_state['offline_template'] = (selected_id, fmt, render(selected_id))
+        prepared = st.session_state.get('offline_template')
+        if prepared and prepared[:2] == (selected_id, fmt):
+            col1.download_button(
+                "Download Template",
+                data=prepared[2],
+                file_name=f"assessment_{selected_id}.{fmt}",
+                mime="text/csv" if fmt == "csv" else "application/json",
+                key="offline_download_one"
+            )
+
+        if col2.button("Prepare All Templates", key="offline_prepare_all"):
+            st.session_state['offline_templates_zip'] = (
+                client_id, fmt, templates_zip([a['id'] for a in assessments], fmt)
+            )
+        prepared = st.session_state.get('offline_templates_zip')
+        if prepared and prepared[:2] == (client_id, fmt):
+            col2.download_button(
+                f"Download All {len(assessments)} Templates",
+                data=prepared[2],
+                file_name=f"client_{client_id}_templates.zip",
+                mime="application/zip",
+                key="offline_download_all"
+            )
+    else:
+        st.info("Create an assessment to download its template.")
+    
+    # Upload
+    with st.form("offline_upload_form"):
+        uploads = st.file_uploader(
+            "Completed templates:", type=["json", "csv", "zip"], accept_multiple_files=True
+        )
+        on_conflict = st.radio(
+            "When an answer was changed here after the template was downloaded:",
+            list(CONFLICT_POLICIES),
+            format_func=lambda x: CONFLICT_POLICIES[x]
+        )
+        col1, col2 = st.columns(2)
+        preview = col1.form_submit_button("Preview")
+        merge = col2.form_submit_button("Merge Answers")
+    
+    if (preview or merge) and uploads:
+        rows, errors = [], []
+        for upload in uploads:
+            try:
+                rows.extend(parse_upload(upload.name, upload.getvalue()))
+            except ValueError as e:
+                errors.append(str(e))
+        if errors:
+            st.error("Some files could not be read; nothing was saved.")
+            st.write("\n".join(f"- {e}" for e in errors))
+            return
+        
+        report = merge_upload(rows, on_conflict, dry_run=preview)
+        if report['errors']:
+            st.error(f"{len(report['errors'])} rows are invalid; nothing was saved.")
+            st.write("\n".join(f"- {e}" for e in report['errors'][:50]))
+            return
+        
+        assessment_count = len({c['assessment_id'] for c in report['written']})
+        if not report['written'] and not report['conflict']:
+            st.info("The upload contains no new answers.")
+        elif report['applied']:
+            if 'category_cache' in st.session_state:
+                st.session_state['category_cache'].invalidate()
+            st.success(f"Saved {len(report['written'])} answers across {assessment_count} assessments.")
+        elif preview:
+            st.info(f"{len(report['written'])} answers across {assessment_count} assessments would be saved.")
+        else:
+            st.error("The upload conflicts with answers changed since the templates were downloaded; nothing was saved.")
+        st.write(f"Unchanged: {len(report['unchanged'])}. Conflicts: {len(report['conflict'])}.")
+        if report['conflict']:
+            st.dataframe(
+                [{'Row': c['source'], 'Assessment': c['assessment_id'], 'Question': c['question_id']}
+                 for c in report['conflict']],
+                hide_index=True
+            )
@@ -1,238 +1,1900 @@
+import json
+import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
 
-# Path to the database file
+from sqlalchemy import (
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    exists,
+    func,
+    insert,
+    inspect,
+    literal,
+    make_url,
+    select,
+    text,
+    update,
+)
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
+from app.schema import (
+    CHANGE_TABLES,
+    SHARD_TABLES,
+    answer_scales,
+    answers,
+    assessment_shards,
+    assessment_versions,
+    assessments,
+    category_trends,
+    choice_events,
+    choices,
+    clients,
+    metadata,
+    questionnaire_versions,
+    questions,
+    result_documents,
+    table_versions,
+    trend_checkpoints,
+)
+
+# Default database file, used unless RUDI_DATABASE_URL points elsewhere.
+# Everything that opens the database (the app, init_db.py, the CLIs) goes
+# through DATABASE_URL, so they always agree on where it is.
 DB_PATH = Path(__file__).parents[1] / "data.db"
 
+# Engine and pool settings, overridable from the environment
+DATABASE_URL = os.environ.get("RUDI_DATABASE_URL", f"sqlite:///{DB_PATH}")
+# A pre-built SQLite database (schema and catalog) copied in whenever the
+# database does not exist yet, instead of creating its tables and seeding them
+TEMPLATE_DB = os.environ.get("RUDI_TEMPLATE_DB")
+POOL_SIZE = int(os.environ.get("RUDI_POOL_SIZE", "5"))
+POOL_MAX_OVERFLOW = int(os.environ.get("RUDI_POOL_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.environ.get("RUDI_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.environ.get("RUDI_POOL_RECYCLE", "3600"))
+STATEMENT_CACHE_SIZE = int(os.environ.get("RUDI_STATEMENT_CACHE_SIZE", "500"))
+# WAL lets dashboard readers and assessors' writes proceed concurrently
+SQLITE_JOURNAL_MODE = os.environ.get("RUDI_SQLITE_JOURNAL_MODE", "WAL")
+# Freed pages are kept on a free list and handed back to the filesystem by
+# reclaim_space() (scheduled from app/retention.py) instead of on every commit
+SQLITE_AUTO_VACUUM = os.environ.get("RUDI_SQLITE_AUTO_VACUUM", "INCREMENTAL")
+_AUTO_VACUUM_MODES = {"NONE": 0, "FULL": 1, "INCREMENTAL": 2}
+# Page cache of each read-write connection
+CACHE_KB = int(os.environ.get("RUDI_CACHE_KB", "16384"))
+
+# Read-only connections used by the dashboard, exports and reports. They get
+# their own pool and page cache so report traffic never touches the write path.
+READ_POOL_SIZE = int(os.environ.get("RUDI_READ_POOL_SIZE", "5"))
+READ_CACHE_KB = int(os.environ.get("RUDI_READ_CACHE_KB", "65536"))
+
+# Optional per-client sharding: when set, each client's assessments and choices
+# live in their own SQLite file in this directory and the main database only
+# holds the shared catalog (clients, questions, answers).
+SHARD_DIR = os.environ.get("RUDI_SHARD_DIR")
+SHARD_POOL_SIZE = int(os.environ.get("RUDI_SHARD_POOL_SIZE", "2"))
+
+_engine = None
+# Keeps a shared-cache in-memory database alive; SQLite drops it with its last connection
+_memory_anchor = None
+_shard_engines = {}
+_read_engines = {}
+# Open snapshot connections (keyed by source engine url) for the current read_snapshot() block
+_snapshot = ContextVar("snapshot", default=None)
+_shard_lock = threading.Lock()
+# The job worker threads and the first script run may open the database at the same time
+_engine_lock = threading.Lock()
+# Assessments never change client, so routing lookups are cached for the process
+# until the assessment is deleted
+_assessment_clients = {}
+# Published questionnaires are immutable, as is an assessment's pinned version,
+# so both are cached for the life of the process (pinned versions until the
+# assessment is deleted)
+_questionnaires = {}
+_assessment_versions = {}
+# Live (unpublished) questionnaire per qtype; cleared by every catalog write,
+# in this process or (through its change tracker) any other
+_live_questionnaires = {}
+# Change tracker per database file (keyed by engine url), see _ChangeTracker
+_change_trackers = {}
+_tracker_lock = threading.Lock()
+# Trackers inherited over a fork; never closed, as their connections belong to the parent
+_forked_trackers = []
+# Name of the table_versions row holding a file's change sequence
+CHANGE_SEQUENCE = "*"
+
+def _set_sqlite_pragmas(dbapi_conn, connection_record):
+    """Apply per-connection SQLite settings when the pool opens a connection."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA busy_timeout = 5000")
+    cursor.execute(f"PRAGMA cache_size = -{CACHE_KB}")
+    cursor.close()
+
+def _enable_foreign_keys(dbapi_conn, connection_record):
+    """Enforce foreign keys, and with them ON DELETE CASCADE, on this connection."""
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA foreign_keys = ON")
+    cursor.close()
+
+def _set_auto_vacuum(engine):
+    """Put a SQLite file in the configured auto_vacuum mode; existing files need a one-off VACUUM."""
+    mode = _AUTO_VACUUM_MODES[SQLITE_AUTO_VACUUM.upper()]
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == mode:
+            return
+        conn.exec_driver_sql(f"PRAGMA auto_vacuum = {mode}")
+        try:
+            conn.exec_driver_sql("VACUUM")
+        except OperationalError:
+            # Another process holds the database; the next start tries again
+            pass
+
+def _create_engine(url, pool_size=POOL_SIZE, write_pragmas=True, on_connect=None, foreign_keys=False,
+                   **connect_args):
+    """
+    Create a pooled engine with the shared pool and statement cache settings.
+    on_connect, if given, runs on every new DBAPI connection, including the
+    first one opened here. foreign_keys turns on SQLite foreign key enforcement.
+    """
+    if url.startswith("sqlite"):
+        # Pooled connections are handed between Streamlit script threads
+        connect_args["check_same_thread"] = False
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=POOL_MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+        query_cache_size=STATEMENT_CACHE_SIZE,
+        connect_args=connect_args,
+    )
+    if on_connect is not None:
+        event.listen(engine, "connect", on_connect)
+    if engine.dialect.name == "sqlite" and write_pragmas:
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        if foreign_keys:
+            event.listen(engine, "connect", _enable_foreign_keys)
+        # The journal and vacuum modes are persistent, so set them once up front
+        # rather than on every pooled connect where they would need an exclusive lock
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}")
+        _set_auto_vacuum(engine)
+    return engine
+
+def memory_database_url(name="rudi"):
+    """
+    URL of a named in-memory SQLite database shared by every connection of
+    this process, for tests and benchmarks. It lives until the process exits.
+    """
+    return f"sqlite:///file:{name}?mode=memory&cache=shared&uri=true"
+
+def _is_memory(url):
+    """Whether a SQLite URL names an in-memory database."""
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and (
+        url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+    )
+
+def _clone_template(target):
+    """Copy RUDI_TEMPLATE_DB into an open sqlite3 connection with the backup API, page by page."""
+    source = sqlite3.connect(f"file:{Path(TEMPLATE_DB).resolve()}?mode=ro", uri=True)
+    try:
+        source.backup(target)
+    finally:
+        source.close()
+
+def _prepare_storage(url):
+    """
+    Get a SQLite database ready before its engine connects: hold an in-memory
+    database open, and clone RUDI_TEMPLATE_DB into a database that is new.
+    """
+    global _memory_anchor
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite":
+        return
+    if _is_memory(url):
+        if url.query.get("cache") != "shared":
+            raise RuntimeError(f"An in-memory database must use a shared cache, e.g. {memory_database_url()}")
+        if SHARD_DIR:
+            raise RuntimeError("Sharding needs the main database in a file, not in memory.")
+        if _memory_anchor is None:
+            query = "&".join(f"{key}={value}" for key, value in url.query.items() if key != "uri")
+            _memory_anchor = sqlite3.connect(f"{url.database}?{query}", uri=True, check_same_thread=False)
+            if TEMPLATE_DB:
+                _clone_template(_memory_anchor)
+        return
+    path = Path(url.database)
+    if TEMPLATE_DB and (not path.exists() or path.stat().st_size == 0):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        target = sqlite3.connect(tmp_path)
+        try:
+            _clone_template(target)
+        finally:
+            target.close()
+        # An empty file is what a bare sqlite3.connect() leaves behind
+        path.unlink(missing_ok=True)
+        try:
+            # Only succeeds if no other process created the database in the meantime
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            tmp_path.unlink()
+
+def get_engine():
+    """
+    Return the process-wide engine, creating it on first use. A new database
+    is cloned from RUDI_TEMPLATE_DB when that is set; either way, missing
+    tables, columns and indexes are then added from app/schema.py.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _prepare_storage(DATABASE_URL)
+                engine = _create_engine(DATABASE_URL, foreign_keys=True)
+                # Create any tables missing from an older database (e.g. jobs, assessment_shards)
+                _create_tables(engine, metadata.sorted_tables)
+                _add_missing_columns(engine, metadata.sorted_tables)
+                _add_missing_indexes(engine, metadata.sorted_tables)
+                _rebuild_foreign_keys(engine, metadata.sorted_tables)
+                _backfill_choice_events(engine)
+                _seed_table_versions(engine, metadata.sorted_tables)
+                _engine = engine
+    return _engine
+
+def _create_tables(engine, tables):
+    """
+    Create whichever of the tables are missing. On SQLite the check and the
+    CREATEs run under the write lock, so processes opening a new file at the
+    same time do not both try to create its tables.
+    """
+    if engine.dialect.name != "sqlite":
+        metadata.create_all(engine, tables=tables)
+        return
+    with engine.connect() as conn:
+        # pysqlite does not open a transaction for DDL itself
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        try:
+            metadata.create_all(conn, tables=tables)
+        except BaseException:
+            conn.exec_driver_sql("ROLLBACK")
+            raise
+        conn.exec_driver_sql("COMMIT")
+
+def _add_missing_columns(engine, tables):
+    """Add columns defined in app/schema.py but missing from an older database file."""
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+def _add_missing_indexes(engine, tables):
+    """Create indexes defined in app/schema.py but missing from an older database file."""
+    with engine.begin() as conn:
+        for table in tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+def _foreign_key_signature(fks):
+    """Comparable (columns, referred table, ON DELETE action) set for a table's foreign keys."""
+    return {
+        (tuple(fk["constrained_columns"]), fk["referred_table"], (fk["options"].get("ondelete") or "").upper())
+        for fk in fks
+    }
+
+def _rebuild_foreign_keys(engine, tables):
+    """
+    Rebuild SQLite tables whose foreign keys differ from app/schema.py (e.g. a
+    missing ON DELETE CASCADE), since SQLite cannot alter constraints in place.
+    Follows the create-copy-drop-rename procedure from the SQLite docs in one
+    transaction, with enforcement off, and drops rows orphaned by earlier
+    unenforced deletes so that enforcement can be switched on.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.connect() as conn:
+        inspector = inspect(conn)
+        rebuild = []
+        for table in tables:
+            if not inspector.has_table(table.name):
+                continue
+            wanted = _foreign_key_signature(
+                {"constrained_columns": [c.name for c in fk.columns], "referred_table": fk.referred_table.name,
+                 "options": {"ondelete": fk.ondelete}}
+                for fk in table.foreign_key_constraints
+            )
+            if _foreign_key_signature(inspector.get_foreign_keys(table.name)) != wanted:
+                existing = {column["name"] for column in inspector.get_columns(table.name)}
+                rebuild.append((table, [c.name for c in table.columns if c.name in existing]))
+    if not rebuild:
+        return
+
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        # Has no effect inside a transaction, so it is switched before BEGIN
+        cursor.execute("PRAGMA foreign_keys = OFF")
+        cursor.execute("BEGIN IMMEDIATE")
+        for table, columns in rebuild:
+            sequence = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table.name,)).fetchone() \
+                if table.dialect_options["sqlite"]["autoincrement"] else None
+            ddl = str(CreateTable(table).compile(dialect=engine.dialect))
+            cursor.execute(ddl.replace(f"CREATE TABLE {table.name} ", f"CREATE TABLE _new_{table.name} ", 1))
+            column_list = ", ".join(columns)
+            cursor.execute(f"INSERT INTO _new_{table.name} ({column_list}) SELECT {column_list} FROM {table.name}")
+            cursor.execute(f"DROP TABLE {table.name}")
+            cursor.execute(f"ALTER TABLE _new_{table.name} RENAME TO {table.name}")
+            for index in table.indexes:
+                cursor.execute(str(CreateIndex(index).compile(dialect=engine.dialect)))
+            if sequence is not None:
+                # Keep AUTOINCREMENT from reusing ids of rows deleted before the rebuild
+                cursor.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+                cursor.execute(
+                    f"INSERT INTO sqlite_sequence (name, seq) SELECT ?, max(?, coalesce(max(id), 0)) FROM {table.name}",
+                    (table.name, sequence[0]),
+                )
+        for table_name, rowid, _, _ in cursor.execute("PRAGMA foreign_key_check").fetchall():
+            cursor.execute(f"DELETE FROM {table_name} WHERE rowid = ?", (rowid,))
+        cursor.execute("COMMIT")
+    except Exception:
+        cursor.execute("ROLLBACK")
+        raise
+    finally:
+        cursor.execute("PRAGMA foreign_keys = ON")
+        raw.close()
+
+def _cascades(engine):
+    """Whether deletes on this engine cascade through enforced foreign keys (the main SQLite database)."""
+    return engine is _engine and engine.dialect.name == "sqlite"
+
+def _backfill_choice_events(engine):
+    """Seed the choice history with the current choices when the log is first created."""
+    with engine.begin() as conn:
+        if conn.execute(select(choice_events.c.id).limit(1)).first() is None:
+            conn.execute(insert(choice_events).from_select(
+                ["assessment_id", "question_id", "answer_id_desired", "answer_id_actual", "recorded_at"],
+                select(
+                    choices.c.assessment_id, choices.c.question_id,
+                    choices.c.answer_id_desired, choices.c.answer_id_actual,
+                    literal(int(time.time())),
+                ).order_by(choices.c.id),
+            ))
+
+def _seed_table_versions(engine, tables):
+    """Give the change sequence and each table a counter row, so recording a change only needs UPDATEs."""
+    names = [CHANGE_SEQUENCE, *(table.name for table in tables)]
+    try:
+        with engine.begin() as conn:
+            existing = set(conn.execute(select(table_versions.c.name)).scalars())
+            missing = [{"name": name, "version": 0} for name in names if name not in existing]
+            if missing:
+                conn.execute(insert(table_versions), missing)
+    except IntegrityError:
+        # Another process seeded them at the same time
+        pass
+
+def sharding_enabled():
+    """Whether assessments and choices are routed to per-client shard files."""
+    return bool(SHARD_DIR)
+
+def shard_path(client_id):
+    """Path of the SQLite file holding a client's assessments and choices."""
+    return Path(SHARD_DIR) / f"client_{int(client_id)}.db"
+
+def get_shard_engine(client_id):
+    """Return the engine for a client's shard, creating the file and its tables on first use."""
+    client_id = int(client_id)
+    engine = _shard_engines.get(client_id)
+    if engine is not None:
+        return engine
+    with _shard_lock:
+        if client_id not in _shard_engines:
+            catalog_path = make_url(DATABASE_URL).database
+            path = shard_path(client_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+
+            def _attach_catalog(dbapi_conn, connection_record):
+                # Unqualified catalog tables (clients, questions, answers) resolve
+                # through the attachment, so the same statements run on every shard.
+                # Only the shard file is written by choice saves, so tenants never
+                # contend on one lock.
+                cursor = dbapi_conn.cursor()
+                cursor.execute("ATTACH DATABASE ? AS catalog", (catalog_path,))
+                cursor.close()
+
+            engine = _create_engine(f"sqlite:///{path}", pool_size=SHARD_POOL_SIZE, on_connect=_attach_catalog)
+            # A shard tracks its own changes, so its counters are written in the same file as its rows
+            shard_tables = [*SHARD_TABLES, *CHANGE_TABLES]
+            _create_tables(engine, shard_tables)
+            _add_missing_columns(engine, shard_tables)
+            _add_missing_indexes(engine, shard_tables)
+            _backfill_choice_events(engine)
+            _seed_table_versions(engine, shard_tables)
+            _shard_engines[client_id] = engine
+    return _shard_engines[client_id]
+
+def drop_shard(client_id):
+    """Close a client's shard engines and delete its file; its catalog rows must already be gone."""
+    client_id = int(client_id)
+    path = shard_path(client_id)
+    with _shard_lock:
+        engine = _shard_engines.pop(client_id, None)
+        read_engine = _read_engines.pop(str(engine.url), None) if engine is not None else None
+    with _tracker_lock:
+        tracker = _change_trackers.pop(str(engine.url), None) if engine is not None else None
+    if tracker is not None:
+        tracker.close()
+    for e in (read_engine, engine):
+        if e is not None:
+            e.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        Path(f"{path}{suffix}").unlink(missing_ok=True)
+
+def get_read_engine(engine=None):
+    """
+    Return the read-only counterpart of an engine (the main database by default).
+    SQLite files are opened with mode=ro and query_only, each SQLAlchemy
+    transaction is a real BEGIN so it reads one consistent snapshot, and the
+    page cache is sized by RUDI_READ_CACHE_KB. Other backends and in-memory
+    databases share the write engine.
+    """
+    engine = engine or get_engine()
+    path = engine.url.database
+    if engine.dialect.name != "sqlite" or not path or path == ":memory:" or engine.url.query.get("mode") == "memory":
+        return engine
+    key = str(engine.url)
+    read_engine = _read_engines.get(key)
+    if read_engine is not None:
+        return read_engine
+    with _shard_lock:
+        if key not in _read_engines:
+            catalog_path = make_url(DATABASE_URL).database if engine is not get_engine() else None
+            read_engine = _create_engine(
+                f"sqlite:///file:{Path(path).resolve()}?mode=ro&uri=true",
+                pool_size=READ_POOL_SIZE,
+                write_pragmas=False,
+                isolation_level=None,
+            )
+
+            @event.listens_for(read_engine, "connect")
+            def _set_read_pragmas(dbapi_conn, connection_record):
+                cursor = dbapi_conn.cursor()
+                cursor.execute("PRAGMA busy_timeout = 5000")
+                cursor.execute("PRAGMA query_only = 1")
+                cursor.execute(f"PRAGMA cache_size = -{READ_CACHE_KB}")
+                if catalog_path:
+                    cursor.execute("ATTACH DATABASE ? AS catalog",
+                                   (f"file:{Path(catalog_path).resolve()}?mode=ro",))
+                cursor.close()
+
+            @event.listens_for(read_engine, "begin")
+            def _begin_snapshot(conn):
+                # The driver only opens transactions for writes; start one explicitly
+                # so every read in the transaction sees the same snapshot.
+                conn.exec_driver_sql("BEGIN")
+
+            _read_engines[key] = read_engine
+    return _read_engines[key]
+
+@contextmanager
+def read_snapshot(fresh=False):
+    """
+    Route reads made inside the block to read-only connections, reusing one
+    connection (and so one consistent snapshot) per database for the whole
+    block. Used around dashboard renders, exports and reports. A block nested
+    in another shares the outer snapshot, unless fresh is set: then it reads
+    from a new snapshot of its own, taken when it first reads.
+    """
+    if _snapshot.get() is not None and not fresh:
+        yield
+        return
+    connections = {}
+    token = _snapshot.set(connections)
+    try:
+        yield
+    finally:
+        _snapshot.reset(token)
+        for conn in connections.values():
+            conn.close()
+
+def _snapshot_connection(engine):
+    """Return this block's snapshot connection for an engine, opening it on first use."""
+    connections = _snapshot.get()
+    key = str(engine.url)
+    if key not in connections:
+        connections[key] = get_read_engine(engine).connect()
+    return connections[key]
+
+def dispose_engines():
+    """Drop all pooled connections, e.g. in a freshly forked worker process."""
+    for engine in [_engine, *_shard_engines.values(), *_read_engines.values()]:
+        if engine is not None:
+            engine.dispose(close=False)
+    with _tracker_lock:
+        _forked_trackers.extend(_change_trackers.values())
+        _change_trackers.clear()
+
+def client_id_for_assessment(assessment_id):
+    """Look up which client's shard an assessment lives in, or None if it is unsharded."""
+    _sync_caches()
+    if assessment_id not in _assessment_clients:
+        row = _fetch_one(_SELECT_ASSESSMENT_SHARD, {"assessment_id": assessment_id})
+        if row is None:
+            return None
+        _assessment_clients[assessment_id] = row["client_id"]
+    return _assessment_clients[assessment_id]
+
+def shard_client_ids():
+    """Fetch the ids of all clients that have a shard."""
+    return [row["client_id"] for row in _fetch_all(_SELECT_SHARD_CLIENTS)]
+
+def engine_for_client(client_id):
+    """Route to the client's shard when sharding is enabled, else the main database."""
+    if SHARD_DIR:
+        return get_shard_engine(client_id)
+    return get_engine()
+
+def engine_for_assessment(assessment_id):
+    """Route to the shard owning an assessment; unknown ids fall back to the main database."""
+    if SHARD_DIR:
+        client_id = client_id_for_assessment(assessment_id)
+        if client_id is not None:
+            return get_shard_engine(client_id)
+    return get_engine()
+
+def _all_engines():
+    """The main database plus every client shard."""
+    if SHARD_DIR:
+        return [get_engine(), *(get_shard_engine(client_id) for client_id in shard_client_ids())]
+    return [get_engine()]
+
 def get_db_connection():
-    """Create a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Check out a pooled connection to the database."""
+    return get_engine().connect()
+
+def _fetch_all(stmt, params=None, engine=None):
+    """Run a read statement and return all rows as mappings."""
+    engine = engine or get_engine()
+    if _snapshot.get() is not None:
+        return _snapshot_connection(engine).execute(stmt, params or {}).mappings().all()
+    with engine.connect() as conn:
+        return conn.execute(stmt, params or {}).mappings().all()
+
+def _fetch_one(stmt, params=None, engine=None):
+    """Run a read statement and return the first row as a mapping, or None."""
+    engine = engine or get_engine()
+    if _snapshot.get() is not None:
+        return _snapshot_connection(engine).execute(stmt, params or {}).mappings().first()
+    with engine.connect() as conn:
+        return conn.execute(stmt, params or {}).mappings().first()
+
+def _fetch_all_committed(stmt, params=None, engine=None):
+    """
+    Like _fetch_all, but always reading the latest committed rows, never a
+    read_snapshot() block's snapshot. Used to fill process-wide caches, which
+    must not be older than the change counters they were checked against.
+    """
+    with (engine or get_engine()).connect() as conn:
+        return conn.execute(stmt, params or {}).mappings().all()
+
+def record_changes(conn, tables, assessment_ids=()):
+    """
+    Stamp a write made outside this module (the job queue's) on the change
+    counters, inside its transaction, as this module's own writes do.
+    """
+    _record_changes(conn, tables, assessment_ids)
+
+def _execute(stmt, params=None, engine=None, assessment_ids=()):
+    """
+    Run a write statement in its own transaction, recording the change to its
+    table (and to assessment_ids, if given), and return the result.
+    """
+    with (engine or get_engine()).begin() as conn:
+        result = conn.execute(stmt, params or {})
+        _record_changes(conn, [stmt.table], assessment_ids)
+        return result
+
+# Statements are built once at import time so SQLAlchemy's compiled cache
+# only ever sees a fixed set of constructs; values are bound per call.
+_answer_actual = answers.alias("a_actual")
+_answer_desired = answers.alias("a_desired")
+
+_SELECT_CLIENTS = select(clients.c.id, clients.c.name)
+_SELECT_CLIENT_BY_ID = _SELECT_CLIENTS.where(clients.c.id == bindparam("client_id"))
+_INSERT_CLIENT = insert(clients).values(name=bindparam("name"))
+
+_SELECT_QUESTIONS = select(
+    questions.c.id, questions.c.csequence, questions.c.category,
+    questions.c.qtype, questions.c.qsequence, questions.c.question, questions.c.scale_id,
+)
+_SELECT_QUESTIONS_BY_TYPE = (
+    _SELECT_QUESTIONS
+    .where(questions.c.qtype == bindparam("qtype"))
+    .order_by(questions.c.csequence, questions.c.qsequence)
+)
+_SELECT_ALL_QUESTIONS = _SELECT_QUESTIONS.order_by(
+    questions.c.qtype, questions.c.category, questions.c.csequence, questions.c.qsequence
+)
+_SELECT_CATEGORIES = select(questions.c.category).distinct().order_by(questions.c.category)
+
+# Every column of answers, as the guarded updates of the admin grids compare them all
+_SELECT_ANSWERS_BY_QUESTION = (
+    select(answers.c.id, answers.c.question_id, answers.c.scale_id, answers.c.score, answers.c.answer)
+    .where(answers.c.question_id == bindparam("question_id"))
+    .order_by(answers.c.score)
+)
+
+_SELECT_ANSWER_SCALES = select(answer_scales.c.id, answer_scales.c.name).order_by(answer_scales.c.name)
+_SELECT_SCALE_ANSWERS = (
+    select(answers.c.id, answers.c.question_id, answers.c.scale_id, answers.c.score, answers.c.answer)
+    .where(answers.c.scale_id.is_not(None))
+    .order_by(answers.c.scale_id, answers.c.score)
+)
+
+_INSERT_ASSESSMENT = insert(assessments).values(
+    client_id=bindparam("client_id"), qtype=bindparam("qtype"), name=bindparam("name"),
+    questionnaire_version_id=bindparam("questionnaire_version_id"), created_at=bindparam("created_at"),
+)
+_INSERT_SHARDED_ASSESSMENT = insert(assessments).values(
+    id=bindparam("assessment_id"), client_id=bindparam("client_id"),
+    qtype=bindparam("qtype"), name=bindparam("name"),
+    questionnaire_version_id=bindparam("questionnaire_version_id"), created_at=bindparam("created_at"),
+)
+_INSERT_ASSESSMENT_SHARD = insert(assessment_shards).values(client_id=bindparam("client_id"))
+_SELECT_ASSESSMENT_SHARD = select(assessment_shards.c.client_id).where(
+    assessment_shards.c.assessment_id == bindparam("assessment_id")
+)
+_SELECT_SHARD_CLIENTS = select(assessment_shards.c.client_id).distinct().order_by(assessment_shards.c.client_id)
+_DELETE_ASSESSMENT_SHARD = delete(assessment_shards).where(
+    assessment_shards.c.assessment_id == bindparam("assessment_id")
+)
+_SELECT_ASSESSMENTS = select(
+    assessments.c.id, assessments.c.qtype, assessments.c.name,
+    assessments.c.client_id, clients.c.name.label("client_name"), assessments.c.status, assessments.c.completed_at,
+).join(clients, assessments.c.client_id == clients.c.id)
+_SELECT_ASSESSMENTS_BY_CLIENT = _SELECT_ASSESSMENTS.where(
+    assessments.c.client_id == bindparam("client_id")
+)
+_SELECT_ASSESSMENT_BY_ID = (
+    select(
+        assessments.c.id, assessments.c.qtype, assessments.c.name,
+        assessments.c.client_id, clients.c.name.label("client_name"),
+        assessments.c.questionnaire_version_id, assessments.c.status, assessments.c.completed_at,
+    )
+    .join(clients, assessments.c.client_id == clients.c.id)
+    .where(assessments.c.id == bindparam("assessment_id"))
+)
+
+_SELECT_ASSESSMENT_RESULTS = (
+    select(
+        choices.c.question_id, questions.c.category, questions.c.question,
+        _answer_actual.c.answer.label("actual_answer"), _answer_actual.c.score.label("actual_score"),
+        _answer_desired.c.answer.label("desired_answer"), _answer_desired.c.score.label("desired_score"),
+    )
+    .select_from(choices)
+    .join(_answer_actual, choices.c.answer_id_actual == _answer_actual.c.id)
+    .join(_answer_desired, choices.c.answer_id_desired == _answer_desired.c.id)
+    .join(questions, choices.c.question_id == questions.c.id)
+    .where(choices.c.assessment_id == bindparam("assessment_id"))
+    .order_by(questions.c.csequence, questions.c.qsequence)
+)
+_SELECT_CHOICES_BY_ASSESSMENT = (
+    select(
+        choices.c.id, choices.c.assessment_id, choices.c.answer_id_desired, choices.c.answer_id_actual,
+        choices.c.question_id,
+        _answer_actual.c.score.label("actual_score"), _answer_desired.c.score.label("desired_score"),
+    )
+    .select_from(choices)
+    .join(_answer_actual, choices.c.answer_id_actual == _answer_actual.c.id)
+    .join(_answer_desired, choices.c.answer_id_desired == _answer_desired.c.id)
+    .where(choices.c.assessment_id == bindparam("assessment_id"))
+)
+
+# Retention: bulk reads and deletes of whole assessments, keyed by a list of ids
+def _assessment_key(table):
+    return table.c.id if table is assessments else table.c.assessment_id
+
+_SELECT_ASSESSMENT_ROWS = {
+    table: select(table).where(_assessment_key(table).in_(bindparam("assessment_ids", expanding=True)))
+    for table in SHARD_TABLES
+}
+_DELETE_ASSESSMENT_ROWS = {
+    table: delete(table).where(_assessment_key(table).in_(bindparam("assessment_ids", expanding=True)))
+    for table in SHARD_TABLES
+}
+_DELETE_ASSESSMENT_SHARDS = delete(assessment_shards).where(
+    assessment_shards.c.assessment_id.in_(bindparam("assessment_ids", expanding=True))
+)
+_SELECT_CLIENT_ASSESSMENT_IDS = select(assessments.c.id).where(assessments.c.client_id == bindparam("client_id"))
+_DELETE_CLIENT = delete(clients).where(clients.c.id == bindparam("client_id"))
+_DELETE_CLIENT_SHARDS = delete(assessment_shards).where(assessment_shards.c.client_id == bindparam("client_id"))
+_last_activity = (
+    select(choice_events.c.assessment_id, func.max(choice_events.c.recorded_at).label("recorded_at"))
+    .group_by(choice_events.c.assessment_id)
+    .subquery()
+)
+_SELECT_ASSESSMENT_ACTIVITY = (
+    select(
+        assessments.c.id, assessments.c.client_id, assessments.c.name,
+        func.coalesce(_last_activity.c.recorded_at, assessments.c.created_at).label("last_activity"),
+    )
+    .outerjoin(_last_activity, assessments.c.id == _last_activity.c.assessment_id)
+    .order_by(assessments.c.id)
+)
+# Each assessment's latest choice event: new event ids only grow, so a changed id means changed choices
+_SELECT_LATEST_CHOICE_EVENTS = (
+    select(choice_events.c.assessment_id, func.max(choice_events.c.id).label("event_id"))
+    .group_by(choice_events.c.assessment_id)
+)
+
+# Questionnaire versions
+_SELECT_ANSWERS_BY_QTYPE = (
+    select(answers.c.id, answers.c.question_id, answers.c.score, answers.c.answer, answers.c.scale_id)
+    .join(questions, answers.c.question_id == questions.c.id)
+    .where(questions.c.qtype == bindparam("qtype"))
+    .order_by(answers.c.question_id, answers.c.score)
+)
+# Each scale used by a type's questions once, however many questions share it
+_SELECT_SCALE_ANSWERS_BY_QTYPE = (
+    select(answers.c.id, answers.c.question_id, answers.c.score, answers.c.answer, answers.c.scale_id)
+    .where(answers.c.scale_id.in_(
+        select(questions.c.scale_id).where(questions.c.qtype == bindparam("qtype")).scalar_subquery()
+    ))
+    .order_by(answers.c.scale_id, answers.c.score)
+)
+_INSERT_QUESTIONNAIRE_VERSION = insert(questionnaire_versions).values(
+    qtype=bindparam("qtype"), published_at=bindparam("published_at"), snapshot=bindparam("snapshot")
+)
+_SELECT_QUESTIONNAIRE_SNAPSHOT = select(questionnaire_versions.c.snapshot).where(
+    questionnaire_versions.c.id == bindparam("version_id")
+)
+_SELECT_QUESTIONNAIRE_VERSIONS = select(
+    questionnaire_versions.c.id, questionnaire_versions.c.qtype, questionnaire_versions.c.published_at
+).order_by(questionnaire_versions.c.id.desc())
+_SELECT_LATEST_QUESTIONNAIRE_VERSION = (
+    select(questionnaire_versions.c.id)
+    .where(questionnaire_versions.c.qtype == bindparam("qtype"))
+    .order_by(questionnaire_versions.c.id.desc())
+    .limit(1)
+)
+_SELECT_ASSESSMENT_VERSION = select(assessments.c.questionnaire_version_id).where(
+    assessments.c.id == bindparam("assessment_id")
+)
+# Raw choice ids, resolved against a pinned snapshot in Python
+_SELECT_RAW_CHOICES = select(
+    choices.c.id, choices.c.assessment_id, choices.c.question_id,
+    choices.c.answer_id_desired, choices.c.answer_id_actual,
+).where(choices.c.assessment_id == bindparam("assessment_id"))
+_SELECT_CATEGORY_CHOICES = select(
+    choices.c.question_id, choices.c.answer_id_desired, choices.c.answer_id_actual,
+).where(
+    choices.c.assessment_id == bindparam("assessment_id"),
+    choices.c.question_id.in_(bindparam("question_ids", expanding=True)),
+)
+_SELECT_RAW_CHOICES_FOR = select(
+    choices.c.assessment_id, choices.c.question_id, choices.c.answer_id_desired, choices.c.answer_id_actual,
+).where(choices.c.assessment_id.in_(bindparam("assessment_ids", expanding=True)))
+
+_INSERT_QUESTION = insert(questions).values(
+    category=bindparam("category"), qtype=bindparam("qtype"), qsequence=bindparam("qsequence"),
+    csequence=bindparam("csequence"), question=bindparam("question"), scale_id=bindparam("scale_id"),
+)
+_UPDATE_QUESTION = (
+    update(questions)
+    .where(questions.c.id == bindparam("question_id"))
+    .values(
+        category=bindparam("category"), qtype=bindparam("qtype"), qsequence=bindparam("qsequence"),
+        csequence=bindparam("csequence"), question=bindparam("question"),
+    )
+)
+_DELETE_ANSWERS_BY_QUESTION = delete(answers).where(answers.c.question_id == bindparam("question_id"))
+_DELETE_QUESTION = delete(questions).where(questions.c.id == bindparam("question_id"))
+
+_INSERT_ANSWER = insert(answers).values(
+    question_id=bindparam("question_id"), score=bindparam("score"), answer=bindparam("answer")
+)
+_UPDATE_ANSWER = (
+    update(answers)
+    .where(answers.c.id == bindparam("answer_id"))
+    .values(score=bindparam("score"), answer=bindparam("answer"))
+)
+_DELETE_ANSWER = delete(answers).where(answers.c.id == bindparam("answer_id"))
+_INSERT_ANSWER_SCALE = insert(answer_scales).values(name=bindparam("name"))
+_INSERT_SCALE_ANSWER = insert(answers).values(
+    scale_id=bindparam("scale_id"), score=bindparam("score"), answer=bindparam("answer")
+)
+
+def _checked_update(table):
+    """UPDATE of every column of a row, matching only if it still holds the values it was loaded with."""
+    columns = [c for c in table.columns if not c.primary_key]
+    return (
+        update(table)
+        .where(table.c.id == bindparam("row_id"))
+        .where(*[c.is_not_distinct_from(bindparam(f"old_{c.name}")) for c in columns])
+        .values({c.name: bindparam(f"new_{c.name}") for c in columns})
+    )
+
+# Batch edits from the admin grids
+_INSERT_QUESTIONS = insert(questions)
+_INSERT_ANSWERS = insert(answers)
+_UPDATE_QUESTION_CHECKED = _checked_update(questions)
+_UPDATE_ANSWER_CHECKED = _checked_update(answers)
+_UPDATE_ANSWER_SCALE_CHECKED = _checked_update(answer_scales)
+_DELETE_QUESTIONS = delete(questions).where(questions.c.id.in_(bindparam("ids", expanding=True)))
+_DELETE_ANSWERS = delete(answers).where(answers.c.id.in_(bindparam("ids", expanding=True)))
+_DELETE_ANSWERS_BY_QUESTIONS = delete(answers).where(answers.c.question_id.in_(bindparam("ids", expanding=True)))
+_DELETE_ANSWER_SCALES = delete(answer_scales).where(answer_scales.c.id.in_(bindparam("ids", expanding=True)))
+_DELETE_ANSWERS_BY_SCALES = delete(answers).where(answers.c.scale_id.in_(bindparam("ids", expanding=True)))
+_CLEAR_QUESTION_SCALES = (
+    update(questions)
+    .where(questions.c.scale_id.in_(bindparam("ids", expanding=True)))
+    .values(scale_id=None)
+)
+
+# Moving questions onto shared scales (see app/scales.py)
+_SET_QUESTION_SCALES = (
+    update(questions)
+    .where(questions.c.id.in_(bindparam("ids", expanding=True)))
+    .values(scale_id=bindparam("scale_id"))
+)
+# Assessments not pinned to a questionnaire version resolve against the live answer ids
+_UNPINNED_ASSESSMENTS = select(assessments.c.id).where(assessments.c.questionnaire_version_id.is_(None))
+_SELECT_UNPINNED_ANSWER_IDS = {
+    table: select(table.c.id, table.c.assessment_id, table.c.answer_id_desired, table.c.answer_id_actual)
+    .where(table.c.assessment_id.in_(_UNPINNED_ASSESSMENTS))
+    for table in (choices, choice_events)
+}
+_UPDATE_ANSWER_IDS = {
+    table: update(table)
+    .where(table.c.id == bindparam("row_id"))
+    .values(answer_id_desired=bindparam("new_desired"), answer_id_actual=bindparam("new_actual"))
+    for table in (choices, choice_events)
+}
+
+
+# Bind names must differ from column names, which UPDATE reserves for its SET clause
+_UPDATE_CHOICE = (
+    update(choices)
+    .where(choices.c.assessment_id == bindparam("choice_assessment_id"))
+    .where(choices.c.question_id == bindparam("choice_question_id"))
+    .values(answer_id_desired=bindparam("answer_id_desired"), answer_id_actual=bindparam("answer_id_actual"))
+)
+_INSERT_CHOICE = insert(choices).values(
+    assessment_id=bindparam("assessment_id"), question_id=bindparam("question_id"),
+    answer_id_desired=bindparam("answer_id_desired"), answer_id_actual=bindparam("answer_id_actual"),
+)
+_upsert_choice_cache = {}
+
+# Records a choice event unless the saved values equal the current choice, so
+# re-saving an unchanged form adds nothing to the history
+_INSERT_CHOICE_EVENT = insert(choice_events).from_select(
+    ["assessment_id", "question_id", "answer_id_desired", "answer_id_actual", "recorded_at"],
+    select(
+        bindparam("assessment_id"), bindparam("question_id"),
+        bindparam("answer_id_desired"), bindparam("answer_id_actual"), bindparam("recorded_at"),
+    ).where(~exists().where(
+        choices.c.assessment_id == bindparam("assessment_id"),
+        choices.c.question_id == bindparam("question_id"),
+        choices.c.answer_id_desired == bindparam("answer_id_desired"),
+        choices.c.answer_id_actual == bindparam("answer_id_actual"),
+    )),
+)
+_DELETE_TREND_CHECKPOINT = delete(trend_checkpoints).where(
+    trend_checkpoints.c.assessment_id == bindparam("assessment_id")
+)
+_DELETE_CATEGORY_TRENDS = delete(category_trends).where(
+    category_trends.c.assessment_id == bindparam("assessment_id")
+)
+
+# Latest event per question at or before a point in time
+_latest_events = (
+    select(func.max(choice_events.c.id).label("id"))
+    .where(choice_events.c.assessment_id == bindparam("assessment_id"))
+    .where(choice_events.c.recorded_at <= bindparam("as_of"))
+    .group_by(choice_events.c.question_id)
+    .subquery("latest")
+)
+_SELECT_ASSESSMENT_RESULTS_AS_OF = (
+    select(
+        choice_events.c.question_id, questions.c.category, questions.c.question,
+        _answer_actual.c.answer.label("actual_answer"), _answer_actual.c.score.label("actual_score"),
+        _answer_desired.c.answer.label("desired_answer"), _answer_desired.c.score.label("desired_score"),
+    )
+    .select_from(choice_events)
+    .join(_latest_events, choice_events.c.id == _latest_events.c.id)
+    .join(_answer_actual, choice_events.c.answer_id_actual == _answer_actual.c.id)
+    .join(_answer_desired, choice_events.c.answer_id_desired == _answer_desired.c.id)
+    .join(questions, choice_events.c.question_id == questions.c.id)
+    .order_by(questions.c.csequence, questions.c.qsequence)
+)
+_SELECT_RAW_CHOICE_EVENTS_AS_OF = (
+    select(choice_events.c.question_id, choice_events.c.answer_id_desired, choice_events.c.answer_id_actual)
+    .join(_latest_events, choice_events.c.id == _latest_events.c.id)
+)
+_SELECT_RAW_CHOICE_EVENTS = (
+    select(
+        choice_events.c.id, choice_events.c.question_id, choice_events.c.recorded_at,
+        choice_events.c.answer_id_desired, choice_events.c.answer_id_actual,
+    )
+    .where(choice_events.c.assessment_id == bindparam("assessment_id"))
+    .where(choice_events.c.id > bindparam("after_event_id"))
+    .order_by(choice_events.c.id)
+)
+_SELECT_SCORED_CHOICE_EVENTS = (
+    select(
+        choice_events.c.id, choice_events.c.question_id, choice_events.c.recorded_at,
+        questions.c.category,
+        _answer_actual.c.score.label("actual_score"), _answer_desired.c.score.label("desired_score"),
+    )
+    .select_from(choice_events)
+    .join(questions, choice_events.c.question_id == questions.c.id)
+    .join(_answer_actual, choice_events.c.answer_id_actual == _answer_actual.c.id)
+    .join(_answer_desired, choice_events.c.answer_id_desired == _answer_desired.c.id)
+    .where(choice_events.c.assessment_id == bindparam("assessment_id"))
+    .where(choice_events.c.id > bindparam("after_event_id"))
+    .order_by(choice_events.c.id)
+)
+# Completion: the finalized result document and the assessment's status
+_SELECT_LAST_CHOICE_EVENT = select(func.max(choice_events.c.id).label("event_id")).where(
+    choice_events.c.assessment_id == bindparam("assessment_id")
+)
+_SELECT_RESULT_DOCUMENT = select(
+    result_documents.c.last_event_id, result_documents.c.completed_at, result_documents.c.document,
+).where(result_documents.c.assessment_id == bindparam("assessment_id"))
+_INSERT_RESULT_DOCUMENT = insert(result_documents).values(
+    assessment_id=bindparam("assessment_id"), last_event_id=bindparam("last_event_id"),
+    completed_at=bindparam("completed_at"), document=bindparam("document"),
+)
+_DELETE_RESULT_DOCUMENTS = delete(result_documents).where(
+    result_documents.c.assessment_id.in_(bindparam("assessment_ids", expanding=True))
+)
+_COMPLETE_ASSESSMENT = (
+    update(assessments)
+    .where(assessments.c.id == bindparam("assessment_id"))
+    .values(status="completed", completed_at=bindparam("completed_at"))
+)
+_REOPEN_ASSESSMENTS = (
+    update(assessments)
+    .where(assessments.c.id.in_(bindparam("assessment_ids", expanding=True)))
+    .where(assessments.c.status != "open")
+    .values(status="open", completed_at=None)
+)
+
+_SELECT_TREND_CHECKPOINT = select(trend_checkpoints.c.last_event_id, trend_checkpoints.c.state).where(
+    trend_checkpoints.c.assessment_id == bindparam("assessment_id")
+)
+_SELECT_CATEGORY_TRENDS = (
+    select(
+        category_trends.c.bucket_start, category_trends.c.category,
+        category_trends.c.actual_score, category_trends.c.desired_score, category_trends.c.gap,
+    )
+    .where(category_trends.c.assessment_id == bindparam("assessment_id"))
+    .order_by(category_trends.c.bucket_start, category_trends.c.category)
+)
+_DELETE_CATEGORY_TRENDS_FROM = _DELETE_CATEGORY_TRENDS.where(
+    category_trends.c.bucket_start >= bindparam("bucket_start")
+)
+_INSERT_CATEGORY_TREND = insert(category_trends)
+_INSERT_TREND_CHECKPOINT = insert(trend_checkpoints)
+
+# Change tracking
+_NEXT_CHANGE = (
+    update(table_versions)
+    .where(table_versions.c.name == CHANGE_SEQUENCE)
+    .values(version=table_versions.c.version + 1)
+)
+_SELECT_CHANGE_SEQUENCE = select(table_versions.c.version).where(table_versions.c.name == CHANGE_SEQUENCE)
+_UPDATE_TABLE_VERSION = (
+    update(table_versions)
+    .where(table_versions.c.name == bindparam("table_name"))
+    .values(version=bindparam("change"))
+)
+_DELETE_ASSESSMENT_VERSIONS = delete(assessment_versions).where(
+    assessment_versions.c.assessment_id.in_(bindparam("assessment_ids", expanding=True))
+)
+_INSERT_ASSESSMENT_VERSIONS = insert(assessment_versions)
+_SELECT_TABLE_VERSIONS = select(table_versions.c.name, table_versions.c.version)
+_SELECT_CHANGED_ASSESSMENTS = select(assessment_versions.c.assessment_id, assessment_versions.c.version).where(
+    assessment_versions.c.version > bindparam("since")
+)
+
+def _upsert_choice_stmt(dialect_name):
+    """Build (once per dialect) the native upsert for a choice, or None if the dialect has none."""
+    if dialect_name not in _upsert_choice_cache:
+        values = dict(
+            assessment_id=bindparam("assessment_id"), question_id=bindparam("question_id"),
+            answer_id_desired=bindparam("answer_id_desired"), answer_id_actual=bindparam("answer_id_actual"),
+        )
+        stmt = None
+        if dialect_name in ("sqlite", "postgresql"):
+            if dialect_name == "sqlite":
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            stmt = dialect_insert(choices).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[choices.c.assessment_id, choices.c.question_id],
+                set_={
+                    "answer_id_desired": stmt.excluded.answer_id_desired,
+                    "answer_id_actual": stmt.excluded.answer_id_actual,
+                },
+            )
+        elif dialect_name in ("mysql", "mariadb"):
+            from sqlalchemy.dialects.mysql import insert as dialect_insert
+            stmt = dialect_insert(choices).values(**values)
+            stmt = stmt.on_duplicate_key_update(
+                answer_id_desired=stmt.inserted.answer_id_desired,
+                answer_id_actual=stmt.inserted.answer_id_actual,
+            )
+        _upsert_choice_cache[dialect_name] = stmt
+    return _upsert_choice_cache[dialect_name]
+
+def _record_changes(conn, tables, assessment_ids=()):
+    """
+    Stamp the next change sequence value on tables and assessment_ids, inside
+    the transaction that wrote them. Call it after the writes, so the file's
+    write lock is already held and concurrent writers cannot interleave.
+    """
+    conn.execute(_NEXT_CHANGE)
+    change = conn.execute(_SELECT_CHANGE_SEQUENCE).scalar()
+    conn.execute(_UPDATE_TABLE_VERSION, [{"table_name": table.name, "change": change} for table in tables])
+    if assessment_ids:
+        assessment_ids = sorted(set(assessment_ids))
+        conn.execute(_DELETE_ASSESSMENT_VERSIONS, {"assessment_ids": assessment_ids})
+        conn.execute(_INSERT_ASSESSMENT_VERSIONS, [
+            {"assessment_id": assessment_id, "version": change} for assessment_id in assessment_ids
+        ])
+
+class _ChangeTracker:
+    """
+    This process's view of one database file's change counters. poll() is
+    cheap while nothing has been committed: on SQLite it only runs PRAGMA
+    data_version on a connection of its own, whose value moves whenever any
+    other connection (in this process or another) commits to the file. Only
+    then does it read the counters, and only the assessments changed since the
+    previous poll. Other backends read the table counters on every poll.
+    """
+
+    def __init__(self, engine):
+        self.is_sqlite = engine.dialect.name == "sqlite"
+        # Out of the pool, so no commit is ever made on it
+        self._conn = engine.connect()
+        self._conn.detach()
+        self._lock = threading.Lock()
+        self._data_version = None
+        self.sequence = None
+        self.tables = {}
+        # Assessments changed since the tracker started, with their latest version
+        self.assessments = {}
+
+    def poll(self):
+        """Read any new changes and drop the cached rows they affect."""
+        with self._lock:
+            try:
+                if self.is_sqlite:
+                    data_version = self._conn.exec_driver_sql("PRAGMA data_version").scalar()
+                    if data_version == self._data_version:
+                        return
+                    self._data_version = data_version
+                tables = dict(self._conn.execute(_SELECT_TABLE_VERSIONS).tuples().all())
+                sequence = tables.get(CHANGE_SEQUENCE, 0)
+                if self.sequence is None or sequence == self.sequence:
+                    # The first poll only sets the baseline
+                    self.sequence, self.tables = sequence, tables
+                    return
+                changed = dict(self._conn.execute(
+                    _SELECT_CHANGED_ASSESSMENTS, {"since": self.sequence}
+                ).tuples().all())
+            finally:
+                self._conn.rollback()
+            changed_tables = {name for name, version in tables.items() if version != self.tables.get(name)}
+            self.sequence, self.tables = sequence, tables
+            self.assessments.update(changed)
+        _drop_stale(changed_tables, changed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def _change_tracker(engine):
+    """The change tracker for an engine's database file, started on first use."""
+    key = str(engine.url)
+    tracker = _change_trackers.get(key)
+    if tracker is None:
+        with _tracker_lock:
+            if key not in _change_trackers:
+                tracker = _ChangeTracker(engine)
+                tracker.poll()
+                _change_trackers[key] = tracker
+            tracker = _change_trackers[key]
+    return tracker
+
+def _drop_stale(tables, assessment_ids):
+    """Forget cached rows of changed tables and assessments."""
+    if {questions.name, answers.name, answer_scales.name} & set(tables):
+        _live_questionnaires.clear()
+    for assessment_id in assessment_ids:
+        _assessment_clients.pop(assessment_id, None)
+        _assessment_versions.pop(assessment_id, None)
+
+def _sync_caches(engine=None):
+    """Bring this process's caches up to date with writes to a database file (the main one by default)."""
+    _change_tracker(engine or get_engine()).poll()
+
+def assessment_version(assessment_id):
+    """
+    Version of an assessment's rows, which moves whenever any process saves
+    or deletes them. A cache can keep the value it was filled at and reload
+    once it differs.
+    """
+    tracker = _change_tracker(engine_for_assessment(assessment_id))
+    tracker.poll()
+    return tracker.assessments.get(assessment_id, 0)
 
 def fetch_all_clients():
     """Fetch all clients from the database."""
-    conn = get_db_connection()
-    clients = conn.execute("SELECT id, name FROM clients").fetchall()
-    conn.close()
-    return clients
+    return _fetch_all(_SELECT_CLIENTS)
 
 def fetch_client_by_id(client_id):
     """Fetch a client by ID."""
-    conn = get_db_connection()
-    client = conn.execute("SELECT id, name FROM clients WHERE id = ?", (client_id,)).fetchone()
-    conn.close()
-    return client
+    return _fetch_one(_SELECT_CLIENT_BY_ID, {"client_id": client_id})
 
 def add_client(name):
     """Add a new client to the database."""
-    conn = get_db_connection()
-    cursor = conn.execute("INSERT INTO clients (name) VALUES (?)", (name,))
-    client_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return client_id
+    return _execute(_INSERT_CLIENT, {"name": name}).inserted_primary_key[0]
 
 def fetch_questions_by_type(qtype):
     """Fetch questions by type (org or action)."""
-    conn = get_db_connection()
-    questions = conn.execute("""
-        SELECT id, csequence, category, qtype, qsequence, question
-        FROM questions 
-        WHERE qtype = ?
-        ORDER BY csequence, qsequence
-    """, (qtype,)).fetchall()
-    conn.close()
-    return questions
+    return _fetch_all(_SELECT_QUESTIONS_BY_TYPE, {"qtype": qtype})
 
 def fetch_answers_by_question(question_id):
-    """Fetch answers for a specific question."""
-    conn = get_db_connection()
-    answers = conn.execute("""
-        SELECT id, question_id, score, answer
-        FROM answers
-        WHERE question_id = ?
-        ORDER BY score
-    """, (question_id,)).fetchall()
-    conn.close()
-    return answers
+    """Fetch a question's own answers (which override its scale's, if it has one)."""
+    return _fetch_all(_SELECT_ANSWERS_BY_QUESTION, {"question_id": question_id})
+
+def fetch_answer_scales():
+    """Fetch all answer scales by name."""
+    return _fetch_all(_SELECT_ANSWER_SCALES)
+
+def fetch_scale_answers():
+    """Fetch the answers of every scale, ordered by scale and score."""
+    return _fetch_all(_SELECT_SCALE_ANSWERS)
 
 def create_assessment(client_id, qtype, name):
-    """Create a new assessment."""
-    conn = get_db_connection()
-    cursor = conn.execute(
-        "INSERT INTO assessments (client_id, qtype, name) VALUES (?, ?, ?)",
-        (client_id, qtype, name)
-    )
-    assessment_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    """Create a new assessment, pinned to the latest published questionnaire for its type."""
+    version_id = latest_questionnaire_version_id(qtype)
+    if version_id is None:
+        version_id = publish_questionnaire(qtype)
+    params = {
+        "client_id": client_id, "qtype": qtype, "name": name,
+        "questionnaire_version_id": version_id, "created_at": int(time.time()),
+    }
+    if not SHARD_DIR:
+        with get_engine().begin() as conn:
+            assessment_id = conn.execute(_INSERT_ASSESSMENT, params).inserted_primary_key[0]
+            _record_changes(conn, [assessments], [assessment_id])
+        return assessment_id
+    # Allocate a globally unique id in the catalog, then store the row in the client's shard
+    with get_engine().begin() as conn:
+        assessment_id = conn.execute(_INSERT_ASSESSMENT_SHARD, params).inserted_primary_key[0]
+        _record_changes(conn, [assessment_shards], [assessment_id])
+    with get_shard_engine(client_id).begin() as conn:
+        conn.execute(_INSERT_SHARDED_ASSESSMENT, {**params, "assessment_id": assessment_id})
+        _record_changes(conn, [assessments], [assessment_id])
+    _assessment_clients[assessment_id] = client_id
     return assessment_id
 
+def move_assessment_to_shard(assessment_id):
+    """
+    Move an assessment and every row keyed by it (choices, history, trends,
+    result document) from the main database into its client's shard. Returns
+    False if the main database does not hold it. The shard gets the rows
+    first, so an interrupted move leaves a copy in both and can be repeated.
+    """
+    engine = get_engine()
+    with engine.connect() as conn:
+        records = _assessment_records(conn, [assessment_id])
+    if not records or not records[0].get(assessments.name):
+        return False
+    rows = records[0]
+    client_id = rows[assessments.name][0]['client_id']
+    with get_shard_engine(client_id).begin() as conn:
+        for table in SHARD_TABLES:
+            if rows.get(table.name):
+                conn.execute(insert(table).prefix_with("OR REPLACE"), rows[table.name])
+        _record_changes(conn, SHARD_TABLES, [assessment_id])
+    with engine.begin() as conn:
+        conn.execute(insert(assessment_shards).prefix_with("OR IGNORE"),
+                     [{"assessment_id": assessment_id, "client_id": client_id}])
+        _delete_assessments(conn, engine, [assessment_id])
+        # Other processes drop their routing of this assessment to the main database
+        _record_changes(conn, [assessment_shards, *SHARD_TABLES], [assessment_id])
+    _assessment_clients[assessment_id] = client_id
+    return True
+
+def _update_choice_params(params):
+    """_UPDATE_CHOICE parameters for a choice; passing assessment_id or question_id would add them to SET."""
+    return {
+        "choice_assessment_id": params["assessment_id"],
+        "choice_question_id": params["question_id"],
+        "answer_id_desired": params["answer_id_desired"],
+        "answer_id_actual": params["answer_id_actual"],
+    }
+
 def save_choice(assessment_id, question_id, answer_id_desired, answer_id_actual):
     """Save a choice for an assessment. Updates existing choice if one exists for the assessment and question."""
-    conn = get_db_connection()
-    conn.execute("""
-        INSERT INTO choices (assessment_id, question_id, answer_id_desired, answer_id_actual)
-        VALUES (?, ?, ?, ?)
-        ON CONFLICT(assessment_id, question_id) DO UPDATE SET
-        answer_id_desired = excluded.answer_id_desired,
-        answer_id_actual = excluded.answer_id_actual
-    """, (assessment_id, question_id, answer_id_desired, answer_id_actual))
-    conn.commit()
-    conn.close()
+    params = {
+        "assessment_id": assessment_id,
+        "question_id": question_id,
+        "answer_id_desired": answer_id_desired,
+        "answer_id_actual": answer_id_actual,
+    }
+    engine = engine_for_assessment(assessment_id)
+    with engine.begin() as conn:
+        # The history event must be written before the upsert it compares against
+        changed = conn.execute(_INSERT_CHOICE_EVENT, {**params, "recorded_at": int(time.time())}).rowcount
+        stmt = _upsert_choice_stmt(engine.dialect.name)
+        if stmt is not None:
+            conn.execute(stmt, params)
+        elif conn.execute(_UPDATE_CHOICE, _update_choice_params(params)).rowcount == 0:
+            conn.execute(_INSERT_CHOICE, params)
+        _record_changes(conn, [choices, choice_events, *(_reopen(conn, [assessment_id]) if changed else [])],
+                        [assessment_id])
+
+def merge_choices(rows, resolve=None, dry_run=False):
+    """
+    Save many choices at once, one transaction per database file (so a single
+    transaction without sharding). rows are dicts with assessment_id,
+    question_id, answer_id_desired and answer_id_actual. resolve, if given,
+    is called inside each transaction with that file's rows and the current
+    choices {(assessment_id, question_id): (answer_id_desired, answer_id_actual)}
+    and returns the rows to write; raising aborts the transaction. With
+    dry_run nothing is committed. Returns the rows written.
+    """
+    by_engine = {}
+    for row in rows:
+        by_engine.setdefault(engine_for_assessment(row["assessment_id"]), []).append(row)
+    written = []
+    now = int(time.time())
+    for engine, engine_rows in by_engine.items():
+        with engine.connect() as conn:
+            with conn.begin() as transaction:
+                assessment_ids = sorted({row["assessment_id"] for row in engine_rows})
+                current = {
+                    (c["assessment_id"], c["question_id"]): (c["answer_id_desired"], c["answer_id_actual"])
+                    for c in conn.execute(_SELECT_RAW_CHOICES_FOR, {"assessment_ids": assessment_ids}).mappings()
+                }
+                to_write = resolve(engine_rows, current) if resolve else engine_rows
+                params = [
+                    {key: row[key] for key in ("assessment_id", "question_id", "answer_id_desired", "answer_id_actual")}
+                    for row in to_write
+                ]
+                if params:
+                    # History events first, as in save_choice, so they compare against the old choices
+                    conn.execute(_INSERT_CHOICE_EVENT, [{**p, "recorded_at": now} for p in params])
+                    stmt = _upsert_choice_stmt(engine.dialect.name)
+                    if stmt is not None:
+                        conn.execute(stmt, params)
+                    else:
+                        for p in params:
+                            if conn.execute(_UPDATE_CHOICE, _update_choice_params(p)).rowcount == 0:
+                                conn.execute(_INSERT_CHOICE, p)
+                    # Only assessments whose answers actually changed are reopened
+                    changed = sorted({
+                        p["assessment_id"] for p in params
+                        if current.get((p["assessment_id"], p["question_id"]))
+                        != (p["answer_id_desired"], p["answer_id_actual"])
+                    })
+                    # An identical re-upload leaves every assessment's version, and so its cached results, alone
+                    _record_changes(conn, [choices, choice_events, *(_reopen(conn, changed) if changed else [])],
+                                    changed)
+                if dry_run:
+                    transaction.rollback()
+        written.extend(to_write)
+    return written
+
+def _reopen(conn, assessment_ids):
+    """Reopen completed assessments whose answers changed, dropping their result documents; returns the tables written."""
+    params = {"assessment_ids": list(assessment_ids)}
+    conn.execute(_REOPEN_ASSESSMENTS, params)
+    conn.execute(_DELETE_RESULT_DOCUMENTS, params)
+    return [assessments, result_documents]
 
 def fetch_assessments(client_id=None):
     """Fetch assessments, optionally filtered by client_id."""
-    conn = get_db_connection()
     if client_id:
-        assessments = conn.execute("""
-            SELECT a.id, a.qtype, a.name, c.name as client_name
-            FROM assessments a
-            JOIN clients c ON a.client_id = c.id
-            WHERE a.client_id = ?
-        """, (client_id,)).fetchall()
-    else:
-        assessments = conn.execute("""
-            SELECT a.id, a.qtype, a.name, c.name as client_name
-            FROM assessments a
-            JOIN clients c ON a.client_id = c.id
-        """).fetchall()
-    conn.close()
-    return assessments
+        return _fetch_all(_SELECT_ASSESSMENTS_BY_CLIENT, {"client_id": client_id},
+                          engine=engine_for_client(client_id))
+    if SHARD_DIR:
+        return [row for shard_client_id in shard_client_ids()
+                for row in _fetch_all(_SELECT_ASSESSMENTS, engine=get_shard_engine(shard_client_id))]
+    return _fetch_all(_SELECT_ASSESSMENTS)
 
 def fetch_assessment_results(assessment_id):
     """Fetch results for a specific assessment."""
-    conn = get_db_connection()
-    results = conn.execute("""
-        SELECT 
-            q.category, q.question, 
-            a_actual.answer as actual_answer, a_actual.score as actual_score,
-            a_desired.answer as desired_answer, a_desired.score as desired_score
-        FROM choices c
-        JOIN answers a_actual ON c.answer_id_actual = a_actual.id
-        JOIN answers a_desired ON c.answer_id_desired = a_desired.id
-        JOIN questions q ON a_actual.question_id = q.id
-        WHERE c.assessment_id = ?
-        ORDER BY q.csequence, q.qsequence
-    """, (assessment_id,)).fetchall()
-    conn.close()
-    return results
+    questionnaire = fetch_pinned_questionnaire(assessment_id)
+    if questionnaire is not None:
+        rows = _fetch_all(_SELECT_RAW_CHOICES, {"assessment_id": assessment_id},
+                          engine=engine_for_assessment(assessment_id))
+        return _resolve_results(rows, questionnaire)
+    return _fetch_all(_SELECT_ASSESSMENT_RESULTS, {"assessment_id": assessment_id},
+                      engine=engine_for_assessment(assessment_id))
 
 # Admin functions
-def add_question(category, qtype, qsequence, csequence, question):
-    """Add a new question."""
-    conn = get_db_connection()
-    cursor = conn.execute(
-        "INSERT INTO questions (category, qtype, qsequence, csequence, question) VALUES (?, ?, ?, ?, ?)",
-        (category, qtype, qsequence, csequence, question)
-    )
-    question_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+def _invalidate_catalog():
+    """
+    Drop cached views of the live questions and answers after a catalog write
+    in this process. Other processes notice it through their change trackers.
+    """
+    _live_questionnaires.clear()
+
+def add_question(category, qtype, qsequence, csequence, question, scale_id=None):
+    """Add a new question, optionally answered from a shared scale."""
+    params = {
+        "category": category, "qtype": qtype, "qsequence": qsequence,
+        "csequence": csequence, "question": question, "scale_id": scale_id,
+    }
+    question_id = _execute(_INSERT_QUESTION, params).inserted_primary_key[0]
+    _invalidate_catalog()
     return question_id
 
 def update_question(question_id, category, qtype, qsequence, csequence, question):
     """Update an existing question."""
-    conn = get_db_connection()
-    conn.execute(
-        "UPDATE questions SET category=?, qtype=?, qsequence=?, csequence=?, question=? WHERE id=?",
-        (category, qtype, qsequence, csequence, question, question_id)
-    )
-    conn.commit()
-    conn.close()
+    _execute(_UPDATE_QUESTION, {
+        "question_id": question_id, "category": category, "qtype": qtype,
+        "qsequence": qsequence, "csequence": csequence, "question": question,
+    })
+    _invalidate_catalog()
 
 def delete_question(question_id):
     """Delete a question and its associated answers."""
-    conn = get_db_connection()
-    # First delete associated answers
-    conn.execute("DELETE FROM answers WHERE question_id=?", (question_id,))
-    # Then delete the question
-    conn.execute("DELETE FROM questions WHERE id=?", (question_id,))
-    conn.commit()
-    conn.close()
+    engine = get_engine()
+    with engine.begin() as conn:
+        if not _cascades(engine):
+            conn.execute(_DELETE_ANSWERS_BY_QUESTION, {"question_id": question_id})
+        conn.execute(_DELETE_QUESTION, {"question_id": question_id})
+        _record_changes(conn, [questions, answers])
+    _invalidate_catalog()
 
 def add_answer(question_id, score, answer):
     """Add a new answer."""
-    conn = get_db_connection()
-    cursor = conn.execute(
-        "INSERT INTO answers (question_id, score, answer) VALUES (?, ?, ?)",
-        (question_id, score, answer)
-    )
-    answer_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    params = {"question_id": question_id, "score": score, "answer": answer}
+    answer_id = _execute(_INSERT_ANSWER, params).inserted_primary_key[0]
+    _invalidate_catalog()
     return answer_id
 
 def update_answer(answer_id, score, answer):
     """Update an existing answer."""
-    conn = get_db_connection()
-    conn.execute(
-        "UPDATE answers SET score=?, answer=? WHERE id=?",
-        (score, answer, answer_id)
-    )
-    conn.commit()
-    conn.close()
+    _execute(_UPDATE_ANSWER, {"answer_id": answer_id, "score": score, "answer": answer})
+    _invalidate_catalog()
 
 def delete_answer(answer_id):
     """Delete an answer."""
-    conn = get_db_connection()
-    conn.execute("DELETE FROM answers WHERE id=?", (answer_id,))
-    conn.commit()
-    conn.close()
+    _execute(_DELETE_ANSWER, {"answer_id": answer_id})
+    _invalidate_catalog()
+
+def _apply_changes(conn, table, checked_update, inserts, updates):
+    """Run a batch's inserts and guarded updates; raises ValueError if a row changed since it was loaded."""
+    for old, new in updates:
+        params = {"row_id": old["id"]}
+        for column in table.columns:
+            if not column.primary_key:
+                params[f"old_{column.name}"] = old[column.name]
+                params[f"new_{column.name}"] = new.get(column.name, old[column.name])
+        if conn.execute(checked_update, params).rowcount != 1:
+            raise ValueError(f"Row {old['id']} was changed or deleted by someone else; reload and try again.")
+    if inserts:
+        conn.execute(insert(table), list(inserts))
+
+def apply_question_changes(inserts=(), updates=(), deletes=()):
+    """
+    Apply a batch of question edits in one transaction: inserts are dicts of
+    column values, updates are (loaded row, new values) pairs and deletes are
+    ids (their answers go too). Any update whose row no longer matches what was
+    loaded rolls the whole batch back with a ValueError.
+    """
+    engine = get_engine()
+    with engine.begin() as conn:
+        if deletes:
+            if not _cascades(engine):
+                conn.execute(_DELETE_ANSWERS_BY_QUESTIONS, {"ids": list(deletes)})
+            conn.execute(_DELETE_QUESTIONS, {"ids": list(deletes)})
+        _apply_changes(conn, questions, _UPDATE_QUESTION_CHECKED, inserts, updates)
+        _record_changes(conn, [questions, answers])
+    _invalidate_catalog()
+
+def apply_answer_changes(inserts=(), updates=(), deletes=()):
+    """Apply a batch of answer edits (to questions' or scales' answers) in one transaction; see apply_question_changes."""
+    with get_engine().begin() as conn:
+        if deletes:
+            conn.execute(_DELETE_ANSWERS, {"ids": list(deletes)})
+        _apply_changes(conn, answers, _UPDATE_ANSWER_CHECKED, inserts, updates)
+        _record_changes(conn, [answers])
+    _invalidate_catalog()
+
+def add_answer_scale(name, scale_answers):
+    """Add a scale with its answers, given as (score, answer) pairs; returns the scale's id."""
+    with get_engine().begin() as conn:
+        scale_id = conn.execute(_INSERT_ANSWER_SCALE, {"name": name}).inserted_primary_key[0]
+        conn.execute(_INSERT_SCALE_ANSWER, [
+            {"scale_id": scale_id, "score": score, "answer": answer} for score, answer in scale_answers
+        ])
+        _record_changes(conn, [answer_scales, answers])
+    _invalidate_catalog()
+    return scale_id
+
+def apply_scale_changes(inserts=(), updates=(), deletes=()):
+    """
+    Apply a batch of answer scale edits in one transaction; see
+    apply_question_changes. Deleting a scale deletes its answers, and its
+    questions are left with only their own answers.
+    """
+    engine = get_engine()
+    with engine.begin() as conn:
+        if deletes:
+            if not _cascades(engine):
+                conn.execute(_DELETE_ANSWERS_BY_SCALES, {"ids": list(deletes)})
+                conn.execute(_CLEAR_QUESTION_SCALES, {"ids": list(deletes)})
+            conn.execute(_DELETE_ANSWER_SCALES, {"ids": list(deletes)})
+        _apply_changes(conn, answer_scales, _UPDATE_ANSWER_SCALE_CHECKED, inserts, updates)
+        _record_changes(conn, [answer_scales, answers, questions])
+    _invalidate_catalog()
+
+def _remap_answer_ids(conn, remap):
+    """Move unpinned assessments' choices and history to new answer ids; returns the assessment ids changed."""
+    changed = set()
+    for table, stmt in _SELECT_UNPINNED_ANSWER_IDS.items():
+        rows = [row for row in conn.execute(stmt).mappings()
+                if row['answer_id_desired'] in remap or row['answer_id_actual'] in remap]
+        if rows:
+            conn.execute(_UPDATE_ANSWER_IDS[table], [
+                {"row_id": row['id'],
+                 "new_desired": remap.get(row['answer_id_desired'], row['answer_id_desired']),
+                 "new_actual": remap.get(row['answer_id_actual'], row['answer_id_actual'])}
+                for row in rows
+            ])
+            changed.update(row['assessment_id'] for row in rows)
+    return changed
+
+def apply_scale_migration(plan):
+    """
+    Move questions that repeat an answer set onto one shared scale each, in
+    one transaction on the main database. plan(conn) is called inside it and
+    returns the merges, dicts with 'answers' ((score, answer) pairs),
+    'question_answer_ids' ({question_id: its answer ids, in the same order}),
+    and either 'scale_id' and 'scale_answer_ids' of an existing scale with
+    those answers or the 'name' of a new one. The questions' own answers are
+    deleted. Choices and history of unpinned assessments follow to the
+    scale's answer ids, here and then in every shard. Returns (scales used,
+    questions moved, answer rows removed).
+    """
+    engine = get_engine()
+    remap = {}
+    scales_used = set()
+    moved = added = 0
+    with engine.begin() as conn:
+        for merge in plan(conn):
+            scale_id, scale_answer_ids = merge.get('scale_id'), merge.get('scale_answer_ids')
+            if scale_id is None:
+                scale_id = conn.execute(_INSERT_ANSWER_SCALE, {"name": merge['name']}).inserted_primary_key[0]
+                scale_answer_ids = [
+                    conn.execute(_INSERT_SCALE_ANSWER, {"scale_id": scale_id, "score": score, "answer": answer})
+                    .inserted_primary_key[0]
+                    for score, answer in merge['answers']
+                ]
+                added += len(scale_answer_ids)
+            for answer_ids in merge['question_answer_ids'].values():
+                remap.update(zip(answer_ids, scale_answer_ids))
+            question_ids = list(merge['question_answer_ids'])
+            conn.execute(_SET_QUESTION_SCALES, {"ids": question_ids, "scale_id": scale_id})
+            conn.execute(_DELETE_ANSWERS_BY_QUESTIONS, {"ids": question_ids})
+            scales_used.add(scale_id)
+            moved += len(question_ids)
+        _record_changes(conn, [answer_scales, answers, questions])
+        # Assessments in the main database switch over in the same transaction
+        changed = _remap_answer_ids(conn, remap) if remap else set()
+        if changed:
+            _record_changes(conn, [choices, choice_events], changed)
+    if remap and SHARD_DIR:
+        for client_id in shard_client_ids():
+            with get_shard_engine(client_id).begin() as conn:
+                changed = _remap_answer_ids(conn, remap)
+                if changed:
+                    _record_changes(conn, [choices, choice_events], changed)
+    _invalidate_catalog()
+    return len(scales_used), moved, len(remap) - added
 
 def fetch_categories():
     """Fetch all unique categories."""
-    conn = get_db_connection()
-    categories = conn.execute("SELECT DISTINCT category FROM questions ORDER BY category").fetchall()
-    conn.close()
-    return [cat['category'] for cat in categories]
+    return [cat['category'] for cat in _fetch_all(_SELECT_CATEGORIES)]
 
 def fetch_all_questions():
     """Fetch all questions with their type and category."""
-    conn = get_db_connection()
-    questions = conn.execute("""
-        SELECT id, csequence, category, qtype, qsequence, question
-        FROM questions
-        ORDER BY qtype, category, csequence, qsequence
-    """).fetchall()
-    conn.close()
-    return questions
+    return _fetch_all(_SELECT_ALL_QUESTIONS)
 
 def delete_assessment(assessment_id):
     """Delete an assessment and its associated choices."""
-    conn = get_db_connection()
-    # First delete associated choices
-    conn.execute("DELETE FROM choices WHERE assessment_id=?", (assessment_id,))
-    # Then delete the assessment
-    conn.execute("DELETE FROM assessments WHERE id=?", (assessment_id,))
-    conn.commit()
-    conn.close()
+    engine = engine_for_assessment(assessment_id)
+    with engine.begin() as conn:
+        _delete_assessments(conn, engine, [assessment_id])
+        _record_changes(conn, SHARD_TABLES, [assessment_id])
+    if SHARD_DIR:
+        _execute(_DELETE_ASSESSMENT_SHARD, {"assessment_id": assessment_id}, assessment_ids=[assessment_id])
+        _assessment_clients.pop(assessment_id, None)
 
 def fetch_assessment_by_id(assessment_id):
     """Fetch assessment details by ID."""
-    conn = get_db_connection()
-    assessment = conn.execute("""
-        SELECT a.id, a.qtype, a.name, a.client_id, c.name as client_name
-        FROM assessments a
-        JOIN clients c ON a.client_id = c.id
-        WHERE a.id = ?
-    """, (assessment_id,)).fetchone()
-    conn.close()
-    return assessment
+    return _fetch_one(_SELECT_ASSESSMENT_BY_ID, {"assessment_id": assessment_id},
+                      engine=engine_for_assessment(assessment_id))
 
 def fetch_choices_by_assessment(assessment_id):
     """Fetch choices for a specific assessment."""
-    conn = get_db_connection()
-    choices = conn.execute("""
-        SELECT 
-            c.id, c.assessment_id, c.answer_id_desired, c.answer_id_actual,
-            a_actual.question_id,
-            a_actual.score as actual_score, a_desired.score as desired_score
-        FROM choices c
-        JOIN answers a_actual ON c.answer_id_actual = a_actual.id
-        JOIN answers a_desired ON c.answer_id_desired = a_desired.id
-        WHERE c.assessment_id = ?
-    """, (assessment_id,)).fetchall()
-    conn.close()
-    return choices
+    questionnaire = fetch_pinned_questionnaire(assessment_id)
+    if questionnaire is not None:
+        rows = _fetch_all(_SELECT_RAW_CHOICES, {"assessment_id": assessment_id},
+                          engine=engine_for_assessment(assessment_id))
+        answers_by_id = questionnaire['answers_by_id']
+        return [
+            {**row, 'actual_score': answers_by_id[row['answer_id_actual']]['score'],
+             'desired_score': answers_by_id[row['answer_id_desired']]['score']}
+            for row in rows
+            if row['answer_id_actual'] in answers_by_id and row['answer_id_desired'] in answers_by_id
+        ]
+    return _fetch_all(_SELECT_CHOICES_BY_ASSESSMENT, {"assessment_id": assessment_id},
+                      engine=engine_for_assessment(assessment_id))
+
+def fetch_choices_for_questions(assessment_id, question_ids):
+    """Raw choice ids (question_id, answer_id_desired, answer_id_actual) for some of an assessment's questions."""
+    return _fetch_all(_SELECT_CATEGORY_CHOICES, {"assessment_id": assessment_id, "question_ids": list(question_ids)},
+                      engine=engine_for_assessment(assessment_id))
+
+# Choice history
+def fetch_assessment_results_as_of(assessment_id, as_of):
+    """Fetch results for an assessment as they stood at epoch time as_of, from the choice history."""
+    questionnaire = fetch_pinned_questionnaire(assessment_id)
+    if questionnaire is not None:
+        rows = _fetch_all(_SELECT_RAW_CHOICE_EVENTS_AS_OF, {"assessment_id": assessment_id, "as_of": int(as_of)},
+                          engine=engine_for_assessment(assessment_id))
+        return _resolve_results(rows, questionnaire)
+    return _fetch_all(_SELECT_ASSESSMENT_RESULTS_AS_OF, {"assessment_id": assessment_id, "as_of": int(as_of)},
+                      engine=engine_for_assessment(assessment_id))
+
+def fetch_scored_choice_events(assessment_id, after_event_id=0):
+    """Fetch an assessment's choice events after a given event id, with category and scores."""
+    questionnaire = fetch_pinned_questionnaire(assessment_id)
+    if questionnaire is not None:
+        rows = _fetch_all(_SELECT_RAW_CHOICE_EVENTS, {"assessment_id": assessment_id, "after_event_id": after_event_id},
+                          engine=engine_for_assessment(assessment_id))
+        questions_by_id, answers_by_id = questionnaire['questions_by_id'], questionnaire['answers_by_id']
+        return [
+            {'id': row['id'], 'question_id': row['question_id'], 'recorded_at': row['recorded_at'],
+             'category': questions_by_id[row['question_id']]['category'],
+             'actual_score': answers_by_id[row['answer_id_actual']]['score'],
+             'desired_score': answers_by_id[row['answer_id_desired']]['score']}
+            for row in rows
+            if row['question_id'] in questions_by_id
+            and row['answer_id_actual'] in answers_by_id and row['answer_id_desired'] in answers_by_id
+        ]
+    return _fetch_all(_SELECT_SCORED_CHOICE_EVENTS, {"assessment_id": assessment_id, "after_event_id": after_event_id},
+                      engine=engine_for_assessment(assessment_id))
+
+def fetch_trend_checkpoint(assessment_id):
+    """Fetch the trend replay checkpoint for an assessment, or None."""
+    return _fetch_one(_SELECT_TREND_CHECKPOINT, {"assessment_id": assessment_id},
+                      engine=engine_for_assessment(assessment_id))
+
+def fetch_category_trends(assessment_id):
+    """Fetch the materialised per-category trend series for an assessment."""
+    return _fetch_all(_SELECT_CATEGORY_TRENDS, {"assessment_id": assessment_id},
+                      engine=engine_for_assessment(assessment_id))
+
+def save_category_trends(assessment_id, last_event_id, state, from_bucket, points):
+    """Replace trend points from from_bucket onwards and move the checkpoint, in one transaction."""
+    with engine_for_assessment(assessment_id).begin() as conn:
+        conn.execute(_DELETE_CATEGORY_TRENDS_FROM, {"assessment_id": assessment_id, "bucket_start": from_bucket})
+        if points:
+            conn.execute(_INSERT_CATEGORY_TREND, [{**point, "assessment_id": assessment_id} for point in points])
+        conn.execute(_DELETE_TREND_CHECKPOINT, {"assessment_id": assessment_id})
+        conn.execute(_INSERT_TREND_CHECKPOINT, [{
+            "assessment_id": assessment_id, "last_event_id": last_event_id, "state": state,
+        }])
+        _record_changes(conn, [category_trends, trend_checkpoints])
+
+# Completion
+def last_choice_event_id(assessment_id):
+    """Id of the assessment's latest choice event (0 if none), which moves with every changed answer."""
+    row = _fetch_one(_SELECT_LAST_CHOICE_EVENT, {"assessment_id": assessment_id},
+                     engine=engine_for_assessment(assessment_id))
+    return (row['event_id'] if row else None) or 0
+
+def save_result_document(assessment_id, last_event_id, document):
+    """
+    Mark an assessment completed with its finalized result document (a
+    JSON-serialisable dict), built from its choices as of last_event_id.
+    Raises ValueError, saving nothing, if an answer has changed since.
+    """
+    completed_at = int(time.time())
+    with engine_for_assessment(assessment_id).begin() as conn:
+        current = conn.execute(_SELECT_LAST_CHOICE_EVENT, {"assessment_id": assessment_id}).scalar() or 0
+        if current != last_event_id:
+            raise ValueError("Answers were changed while the results were being finalized; try again.")
+        conn.execute(_DELETE_RESULT_DOCUMENTS, {"assessment_ids": [assessment_id]})
+        conn.execute(_INSERT_RESULT_DOCUMENT, {
+            "assessment_id": assessment_id, "last_event_id": last_event_id, "completed_at": completed_at,
+            "document": json.dumps(document, separators=(',', ':')),
+        })
+        conn.execute(_COMPLETE_ASSESSMENT, {"assessment_id": assessment_id, "completed_at": completed_at})
+        _record_changes(conn, [assessments, result_documents], [assessment_id])
+    return completed_at
+
+def fetch_result_document(assessment_id):
+    """The finalized result document of a completed assessment as a dict, or None while it is open."""
+    row = _fetch_one(_SELECT_RESULT_DOCUMENT, {"assessment_id": assessment_id},
+                     engine=engine_for_assessment(assessment_id))
+    return json.loads(row['document']) if row else None
+
+# Questionnaire versions
+def _build_questionnaire(question_rows, answer_rows, version_id=None):
+    """
+    Index questions and answers for lookups by id and by question. Scale
+    answers are held once under 'scales'; every question using a scale (and
+    without answers of its own) shares the scale's list in 'answers_by_question'.
+    """
+    questionnaire = {
+        'version_id': version_id,
+        'questions': [dict(q) for q in question_rows],
+        'scales': {},
+        'answers_by_question': {},
+        'answers_by_id': {},
+    }
+    questionnaire['questions_by_id'] = {q['id']: q for q in questionnaire['questions']}
+    for a in answer_rows:
+        a = dict(a)
+        questionnaire['answers_by_id'][a['id']] = a
+        if a.get('question_id') is not None:
+            questionnaire['answers_by_question'].setdefault(a['question_id'], []).append(a)
+        else:
+            questionnaire['scales'].setdefault(a['scale_id'], []).append(a)
+    for q in questionnaire['questions']:
+        # Snapshots published before scales existed have no scale_id
+        scale = questionnaire['scales'].get(q.get('scale_id'))
+        if scale and q['id'] not in questionnaire['answers_by_question']:
+            questionnaire['answers_by_question'][q['id']] = scale
+    return questionnaire
+
+def fetch_live_questionnaire(qtype):
+    """Fetch the current (unpublished) questions and answers for a type as a questionnaire."""
+    _sync_caches()
+    if qtype not in _live_questionnaires:
+        params = {"qtype": qtype}
+        _live_questionnaires[qtype] = _build_questionnaire(
+            _fetch_all_committed(_SELECT_QUESTIONS_BY_TYPE, params),
+            _fetch_all_committed(_SELECT_ANSWERS_BY_QTYPE, params)
+            + _fetch_all_committed(_SELECT_SCALE_ANSWERS_BY_QTYPE, params),
+        )
+    return _live_questionnaires[qtype]
+
+def publish_questionnaire(qtype):
+    """Freeze the current questions and answers for a type as a new immutable version."""
+    live = fetch_live_questionnaire(qtype)
+    snapshot = json.dumps({
+        'questions': live['questions'],
+        'answers': list(live['answers_by_id'].values()),
+    }, separators=(',', ':'))
+    params = {"qtype": qtype, "published_at": time.time(), "snapshot": snapshot}
+    return _execute(_INSERT_QUESTIONNAIRE_VERSION, params).inserted_primary_key[0]
+
+def fetch_questionnaire_versions():
+    """Fetch all published questionnaire versions, newest first."""
+    return _fetch_all(_SELECT_QUESTIONNAIRE_VERSIONS)
+
+def latest_questionnaire_version_id(qtype):
+    """ID of the most recently published questionnaire for a type, or None."""
+    row = _fetch_one(_SELECT_LATEST_QUESTIONNAIRE_VERSION, {"qtype": qtype})
+    return row['id'] if row else None
+
+def fetch_questionnaire(version_id):
+    """Fetch a published questionnaire; cached indefinitely since versions never change."""
+    if version_id not in _questionnaires:
+        row = _fetch_one(_SELECT_QUESTIONNAIRE_SNAPSHOT, {"version_id": version_id})
+        if row is None:
+            return None
+        snapshot = json.loads(row['snapshot'])
+        _questionnaires[version_id] = _build_questionnaire(snapshot['questions'], snapshot['answers'], version_id)
+    return _questionnaires[version_id]
+
+def fetch_pinned_questionnaire(assessment_id):
+    """Fetch the questionnaire an assessment was taken against, or None if it predates versioning."""
+    _sync_caches()
+    if assessment_id not in _assessment_versions:
+        row = _fetch_one(_SELECT_ASSESSMENT_VERSION, {"assessment_id": assessment_id},
+                         engine=engine_for_assessment(assessment_id))
+        if row is None:
+            return None
+        _assessment_versions[assessment_id] = row['questionnaire_version_id']
+    version_id = _assessment_versions[assessment_id]
+    return fetch_questionnaire(version_id) if version_id is not None else None
+
+def fetch_assessment_questionnaire(assessment_id, qtype):
+    """Questions and answers to present for an assessment: its pinned version, else the live catalog."""
+    return fetch_pinned_questionnaire(assessment_id) or fetch_live_questionnaire(qtype)
+
+def _resolve_results(rows, questionnaire):
+    """Turn raw choice ids into result rows using a questionnaire snapshot."""
+    questions_by_id, answers_by_id = questionnaire['questions_by_id'], questionnaire['answers_by_id']
+    results = []
+    for row in rows:
+        question = questions_by_id.get(row['question_id'])
+        actual = answers_by_id.get(row['answer_id_actual'])
+        desired = answers_by_id.get(row['answer_id_desired'])
+        if question is None or actual is None or desired is None:
+            continue
+        results.append({
+            'question_id': row['question_id'],
+            'category': question['category'],
+            'question': question['question'],
+            'actual_answer': actual['answer'],
+            'actual_score': actual['score'],
+            'desired_answer': desired['answer'],
+            'desired_score': desired['score'],
+            '_order': (question['csequence'], question['qsequence']),
+        })
+    results.sort(key=lambda r: r['_order'])
+    for r in results:
+        del r['_order']
+    return results
+
+# Retention
+def _assessment_records(conn, assessment_ids):
+    """All rows belonging to the given assessments, one dict of table name -> rows per assessment."""
+    params = {"assessment_ids": list(assessment_ids)}
+    records = {}
+    for table, stmt in _SELECT_ASSESSMENT_ROWS.items():
+        for row in conn.execute(stmt, params).mappings():
+            assessment_id = row['id'] if table is assessments else row['assessment_id']
+            records.setdefault(assessment_id, {}).setdefault(table.name, []).append(dict(row))
+    return list(records.values())
+
+def _delete_assessments(conn, engine, assessment_ids):
+    """Delete assessments; their choices and history follow by cascade or, where not enforced, explicitly."""
+    params = {"assessment_ids": list(assessment_ids)}
+    if not _cascades(engine):
+        for table in reversed(SHARD_TABLES):
+            conn.execute(_DELETE_ASSESSMENT_ROWS[table], params)
+    else:
+        conn.execute(_DELETE_ASSESSMENT_ROWS[assessments], params)
+
+def fetch_assessment_activity(client_id=None):
+    """
+    Fetch every assessment (optionally one client's) with the epoch time of its
+    last recorded change, or its creation time if it has no choices. Either may
+    be None for assessments created before they were tracked.
+    """
+    engines = [engine_for_client(client_id)] if client_id else _all_engines()
+    rows = []
+    for engine in engines:
+        rows.extend(_fetch_all(_SELECT_ASSESSMENT_ACTIVITY, engine=engine))
+    if client_id:
+        rows = [row for row in rows if row['client_id'] == client_id]
+    return rows
+
+def fetch_latest_choice_events():
+    """Map every assessment with saved choices (in any shard) to the id of its latest choice event."""
+    latest = {}
+    for engine in _all_engines():
+        latest.update(
+            (row['assessment_id'], row['event_id']) for row in _fetch_all(_SELECT_LATEST_CHOICE_EVENTS, engine=engine)
+        )
+    return latest
+
+def purge_assessments(assessment_ids, archive=None):
+    """
+    Delete assessments with all their choices and history, one transaction per
+    database file. archive, if given, is called inside each transaction with
+    the rows about to be deleted (see _assessment_records) so they can be saved
+    first; if it raises, nothing in that file is deleted. Returns the number
+    of assessments deleted.
+    """
+    by_engine = {}
+    for assessment_id in assessment_ids:
+        by_engine.setdefault(engine_for_assessment(assessment_id), []).append(assessment_id)
+    deleted = 0
+    for engine, ids in by_engine.items():
+        with engine.begin() as conn:
+            if archive is not None:
+                archive(_assessment_records(conn, ids))
+            _delete_assessments(conn, engine, ids)
+            _record_changes(conn, SHARD_TABLES, ids)
+        deleted += len(ids)
+    if SHARD_DIR and deleted:
+        _execute(_DELETE_ASSESSMENT_SHARDS, {"assessment_ids": list(assessment_ids)}, assessment_ids=assessment_ids)
+    for assessment_id in assessment_ids:
+        _assessment_clients.pop(assessment_id, None)
+    return deleted
+
+def purge_client(client_id, archive=None):
+    """
+    Delete a client with all its assessments, choices and history. archive, if
+    given, is called with {'client': row, 'assessments': [...]} before anything
+    is deleted. Without sharding this is one transaction; with sharding the
+    catalog rows go in one transaction and the client's shard file after it.
+    Returns False if the client does not exist.
+    """
+    engine = get_engine()
+    client_engine = engine_for_client(client_id)
+    with engine.begin() as conn:
+        client = conn.execute(_SELECT_CLIENT_BY_ID, {"client_id": client_id}).mappings().first()
+        if client is None:
+            return False
+        if client_engine is engine:
+            ids = list(conn.execute(_SELECT_CLIENT_ASSESSMENT_IDS, {"client_id": client_id}).scalars())
+            records = _assessment_records(conn, ids)
+        else:
+            with client_engine.connect() as shard_conn:
+                ids = list(shard_conn.execute(_SELECT_CLIENT_ASSESSMENT_IDS, {"client_id": client_id}).scalars())
+                records = _assessment_records(shard_conn, ids)
+        if archive is not None:
+            archive({'client': dict(client), 'assessments': records})
+        if not _cascades(engine):
+            if client_engine is engine:
+                _delete_assessments(conn, engine, ids)
+            conn.execute(_DELETE_CLIENT_SHARDS, {"client_id": client_id})
+        conn.execute(_DELETE_CLIENT, {"client_id": client_id})
+        _record_changes(conn, [clients, assessment_shards, *(SHARD_TABLES if client_engine is engine else [])], ids)
+    if client_engine is not engine:
+        drop_shard(client_id)
+    for assessment_id in ids:
+        _assessment_clients.pop(assessment_id, None)
+    return True
+
+def reclaim_space(max_pages=None):
+    """
+    Return free pages to the filesystem in the main database and every shard
+    (incremental auto_vacuum), at most max_pages per file. Returns the number
+    of pages released.
+    """
+    released = 0
+    for engine in _all_engines():
+        if engine.dialect.name != "sqlite":
+            continue
+        raw = engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            before = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+            cursor.execute(f"PRAGMA incremental_vacuum({int(max_pages or 0)})").fetchall()
+            released += before - cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        finally:
+            raw.close()
+    return released
+
+def storage_stats():
+    """Size, free space and page cache budget of the main database and each shard file."""
+    stats = []
+    for engine in _all_engines():
+        if engine.dialect.name != "sqlite":
+            continue
+        with engine.connect() as conn:
+            page_size = conn.exec_driver_sql("PRAGMA page_size").scalar()
+            stats.append({
+                'database': Path(engine.url.database).name,
+                'size_kb': conn.exec_driver_sql("PRAGMA page_count").scalar() * page_size // 1024,
+                'free_kb': conn.exec_driver_sql("PRAGMA freelist_count").scalar() * page_size // 1024,
+                'cache_kb': CACHE_KB,
+            })
+    return stats
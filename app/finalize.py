@@ -0,0 +1,47 @@
+"""
+Finalized results for completed assessments.
+
+Completing an assessment computes its results once and stores them as a
+result document: one row holding the totals, the question and category
+tables, the questions ranked by gap and the trend points behind the charts.
+The Results Dashboard renders a completed assessment from that row alone,
+instead of joining its choices against the catalog and replaying its history
+on every view.
+
+Saving a changed answer reopens the assessment and deletes its document in
+the same transaction (see app/db.py), so a document never describes answers
+that have since changed. Completing it again builds a new one.
+"""
+
+from app.analysis import category_summary, result_document, results_frame
+from app.db import (
+    fetch_assessment_questionnaire,
+    fetch_assessment_results,
+    last_choice_event_id,
+    read_snapshot,
+    save_result_document,
+)
+from app.history import fold_category_trends, save_trend_update
+from app.scenarios import max_scores
+
+
+def complete_assessment(assessment_id, qtype):
+    """
+    Mark an assessment completed and store its result document. Returns the
+    completion time. Raises ValueError if it has no answers yet, or if an
+    answer is saved while the document is being built.
+    """
+    # The event id and the rows come from one snapshot, so the document matches the id it is saved with
+    with read_snapshot(fresh=True):
+        last_event_id = last_choice_event_id(assessment_id)
+        results = fetch_assessment_results(assessment_id)
+        if not results:
+            raise ValueError("The assessment has no answers yet.")
+        df = results_frame(results)
+        questionnaire = fetch_assessment_questionnaire(assessment_id, qtype)
+        trends, trend_update = fold_category_trends(assessment_id)
+    # Reads stay on the snapshot; the trend points are stored after it is closed
+    save_trend_update(trend_update)
+    df['max_score'] = max_scores(df, questionnaire)
+    document = result_document(df, category_summary(df), trends)
+    return save_result_document(assessment_id, last_event_id, document)
@@ -0,0 +1,88 @@
+"""
+Trend series over an assessment's choice history.
+
+Every save appends to `choice_events`. This module folds those events into
+per-category score totals at the end of each time bucket and stores them in
+`category_trends`, together with a checkpoint of the folded state. A refresh
+only reads events recorded after the checkpoint, so the dashboard never
+rescans the full history.
+
+Folding only reads, so the dashboard folds inside its read snapshot and
+stores nothing. Completing an assessment stores the folded series and moves
+the checkpoint, in a write made after its snapshot is closed, so later folds
+start from there.
+"""
+
+import json
+import os
+
+from app.db import (
+    fetch_category_trends,
+    fetch_scored_choice_events,
+    fetch_trend_checkpoint,
+    save_category_trends,
+)
+
+# Width of a trend bucket; all saves within one bucket become a single point
+TREND_BUCKET_SECONDS = int(os.environ.get("RUDI_TREND_BUCKET_SECONDS", "3600"))
+
+
+def _category_totals(state):
+    """Sum the per-question scores in a folded state into per-category totals."""
+    totals = {}
+    for category, actual, desired in state.values():
+        total = totals.setdefault(category, [0, 0, 0])
+        total[0] += actual
+        total[1] += desired
+        total[2] += max(0, desired - actual)
+    return totals
+
+
+def fold_category_trends(assessment_id):
+    """
+    Fold any new choice events into the assessment's trend series without
+    writing anything. Returns the full series as a list of dicts
+    (bucket_start, category, actual_score, desired_score, gap), ordered by
+    bucket and category, and the update that stores it for save_trend_update()
+    (None if there were no new events).
+    """
+    checkpoint = fetch_trend_checkpoint(assessment_id)
+    last_event_id = checkpoint['last_event_id'] if checkpoint else 0
+    state = json.loads(checkpoint['state']) if checkpoint else {}
+    existing = [dict(row) for row in fetch_category_trends(assessment_id)]
+
+    events = fetch_scored_choice_events(assessment_id, last_event_id)
+    if not events:
+        return existing, None
+
+    # Replay new events, emitting the category totals at the end of each bucket
+    new_points = []
+    first_bucket = None
+    for i, event in enumerate(events):
+        bucket = event['recorded_at'] // TREND_BUCKET_SECONDS * TREND_BUCKET_SECONDS
+        if first_bucket is None:
+            first_bucket = bucket
+        state[str(event['question_id'])] = [event['category'], event['actual_score'], event['desired_score']]
+
+        next_bucket = None
+        if i + 1 < len(events):
+            next_bucket = events[i + 1]['recorded_at'] // TREND_BUCKET_SECONDS * TREND_BUCKET_SECONDS
+        if next_bucket != bucket:
+            for category, (actual, desired, gap) in sorted(_category_totals(state).items()):
+                new_points.append({
+                    'bucket_start': bucket,
+                    'category': category,
+                    'actual_score': actual,
+                    'desired_score': desired,
+                    'gap': gap,
+                })
+
+    update = (assessment_id, events[-1]['id'], json.dumps(state), first_bucket, new_points)
+    return [point for point in existing if point['bucket_start'] < first_bucket] + new_points, update
+
+
+def save_trend_update(update):
+    """Store an update from fold_category_trends(), if there is one; call it outside any read snapshot."""
+    if update is not None:
+        save_category_trends(*update)
+
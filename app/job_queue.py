@@ -0,0 +1,475 @@
+"""
+Persistent background jobs for long-running operations (bulk exports, report
+runs, rebuilds, imports).
+
+Jobs are rows in the `jobs` table, so they survive page reloads and server
+restarts. They run once workers are enabled: worker threads inside the
+Streamlit process (RUDI_JOB_WORKERS, off by default) or standalone worker
+processes:
+
+    python -m app.job_queue worker --processes 4
+
+Register a new kind of job with the @job_handler decorator. The handler gets
+the job's params dict and a progress(fraction, message=None) callback, and
+returns a JSON-serialisable result. Calling progress raises JobCancelled once
+a cancel has been requested. Handlers registered with every=SECONDS are also
+queued automatically by the workers at that interval (e.g. reclaiming space).
+"""
+
+import argparse
+import csv
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import bindparam, func, insert, select, update
+
+from app import db
+from app.analytics_store import ANALYTICS_INTERVAL
+from app.backup import BACKUP_INTERVAL
+from app.retention import PURGE_INTERVAL, RECLAIM_INTERVAL, RETENTION_DAYS
+from app.schema import jobs
+
+# Worker threads started inside a Streamlit server process (0, the default, starts none)
+JOB_WORKERS = int(os.environ.get("RUDI_JOB_WORKERS", "0"))
+POLL_INTERVAL = float(os.environ.get("RUDI_JOB_POLL_INTERVAL", "1.0"))
+# A running job whose worker has not sent a heartbeat for this long is requeued
+STALE_AFTER = float(os.environ.get("RUDI_JOB_STALE_AFTER", "60"))
+# Seconds between checks for stale jobs, in each process
+SWEEP_INTERVAL = float(os.environ.get("RUDI_JOB_SWEEP_INTERVAL", "15"))
+HEARTBEAT_INTERVAL = 15.0
+# Minimum seconds between progress writes for a job
+PROGRESS_INTERVAL = 0.5
+
+EXPORT_DIR = Path(os.environ.get("RUDI_EXPORT_DIR", Path(__file__).parents[1] / "exports"))
+
+ACTIVE_STATUSES = ("queued", "running")
+
+JOB_HANDLERS = {}
+# Kinds queued automatically, with their interval in seconds
+RECURRING_JOBS = {}
+
+_workers_started = False
+_workers_lock = threading.Lock()
+# When this process next looks for stale jobs
+_next_sweep = 0.0
+
+
+class JobCancelled(Exception):
+    """Raised from a job's progress callback once cancellation has been requested."""
+
+
+def job_handler(kind, every=None):
+    """Register a function as the handler for a kind of job, optionally queued every N seconds."""
+    def register(handler):
+        JOB_HANDLERS[kind] = handler
+        if every:
+            RECURRING_JOBS[kind] = every
+        return handler
+    return register
+
+
+_SELECT_JOBS = select(jobs).order_by(jobs.c.id.desc()).limit(bindparam("limit"))
+_SELECT_JOB = select(jobs).where(jobs.c.id == bindparam("job_id"))
+_SELECT_NEXT_QUEUED = (
+    select(jobs.c.id)
+    .where(jobs.c.status == "queued")
+    .order_by(jobs.c.id)
+    .limit(1)
+)
+_SELECT_STALE = (
+    select(jobs.c.id)
+    .where(jobs.c.status == "running")
+    .where(jobs.c.heartbeat_at < bindparam("cutoff"))
+    .limit(1)
+)
+_REQUEUE_STALE = (
+    update(jobs)
+    .where(jobs.c.status == "running")
+    .where(jobs.c.heartbeat_at < bindparam("cutoff"))
+    .values(status="queued", worker=None, message="Requeued after worker stopped responding")
+)
+_FAIL_EXHAUSTED = (
+    update(jobs)
+    .where(jobs.c.status == "queued")
+    .where(jobs.c.attempts >= jobs.c.max_attempts)
+    .values(status="failed", finished_at=bindparam("now"),
+            error=func.coalesce(jobs.c.error, "Worker stopped responding"))
+)
+_SELECT_LAST_CREATED = select(func.max(jobs.c.created_at)).where(jobs.c.kind == bindparam("kind"))
+_SELECT_ACTIVE_KINDS = select(jobs.c.kind).where(jobs.c.status.in_(ACTIVE_STATUSES))
+_CLAIM_JOB = (
+    update(jobs)
+    .where(jobs.c.id == bindparam("job_id"))
+    .where(jobs.c.status == "queued")
+    .values(
+        status="running",
+        worker=bindparam("worker"),
+        attempts=jobs.c.attempts + 1,
+        started_at=bindparam("now"),
+        heartbeat_at=bindparam("now"),
+        progress=0,
+        error=None,
+    )
+)
+_HEARTBEAT = update(jobs).where(jobs.c.id == bindparam("job_id")).values(heartbeat_at=bindparam("now"))
+_UPDATE_PROGRESS = (
+    update(jobs)
+    .where(jobs.c.id == bindparam("job_id"))
+    .values(progress=bindparam("progress"), message=bindparam("message"), heartbeat_at=bindparam("now"))
+)
+_SELECT_CANCEL_REQUESTED = select(jobs.c.cancel_requested).where(jobs.c.id == bindparam("job_id"))
+_FINISH_JOB = (
+    update(jobs)
+    .where(jobs.c.id == bindparam("job_id"))
+    .values(
+        status=bindparam("status"),
+        result=bindparam("result"),
+        error=bindparam("error"),
+        progress=bindparam("progress"),
+        finished_at=bindparam("finished_at"),
+    )
+)
+
+
+def enqueue_job(kind, params=None, max_attempts=3):
+    """Queue a job and return its id."""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    with db.get_engine().begin() as conn:
+        result = conn.execute(insert(jobs).values(
+            kind=kind,
+            params=json.dumps(params or {}),
+            max_attempts=max_attempts,
+            created_at=time.time(),
+        ))
+        db.record_changes(conn, [jobs])
+    return result.inserted_primary_key[0]
+
+
+def fetch_jobs(limit=50):
+    """Fetch the most recent jobs, newest first."""
+    with db.get_engine().connect() as conn:
+        return conn.execute(_SELECT_JOBS, {"limit": limit}).mappings().all()
+
+
+def fetch_job(job_id):
+    """Fetch a job by ID."""
+    with db.get_engine().connect() as conn:
+        return conn.execute(_SELECT_JOB, {"job_id": job_id}).mappings().first()
+
+
+def cancel_job(job_id):
+    """Cancel a queued job immediately, or ask a running job to stop at its next progress update."""
+    now = time.time()
+    with db.get_engine().begin() as conn:
+        conn.execute(
+            update(jobs)
+            .where(jobs.c.id == job_id)
+            .where(jobs.c.status == "queued")
+            .values(status="cancelled", finished_at=now, message="Cancelled before it started")
+        )
+        conn.execute(
+            update(jobs)
+            .where(jobs.c.id == job_id)
+            .where(jobs.c.status == "running")
+            .values(cancel_requested=1, message="Cancelling...")
+        )
+        db.record_changes(conn, [jobs])
+
+
+def retry_job(job_id):
+    """Put a failed or cancelled job back in the queue with a fresh attempt budget."""
+    with db.get_engine().begin() as conn:
+        conn.execute(
+            update(jobs)
+            .where(jobs.c.id == job_id)
+            .where(jobs.c.status.in_(["failed", "cancelled"]))
+            .values(status="queued", attempts=0, cancel_requested=0, progress=0,
+                    error=None, message=None, finished_at=None)
+        )
+        db.record_changes(conn, [jobs])
+
+
+def _due_recurring(conn, now):
+    """
+    Recurring kinds whose interval has passed since their last job was
+    created, leaving out kinds with a job still queued or running: a backed-up
+    worker then runs it once late rather than several times in a row.
+    """
+    active = set(conn.execute(_SELECT_ACTIVE_KINDS).scalars())
+    due = []
+    for kind, every in RECURRING_JOBS.items():
+        if kind in active:
+            continue
+        last_created = conn.execute(_SELECT_LAST_CREATED, {"kind": kind}).scalar()
+        if last_created is None or now - last_created >= every:
+            due.append(kind)
+    return due
+
+
+def _queue_recurring(conn, now):
+    """Queue every recurring kind that is due."""
+    for kind in _due_recurring(conn, now):
+        conn.execute(insert(jobs).values(kind=kind, params="{}", max_attempts=1, created_at=now))
+
+
+def _work_pending(conn, now, sweep):
+    """Whether a job is queued, a recurring kind is due or (when sweeping) a running job has gone stale."""
+    if conn.execute(_SELECT_NEXT_QUEUED).first() is not None:
+        return True
+    if sweep and conn.execute(_SELECT_STALE, {"cutoff": now - STALE_AFTER}).first() is not None:
+        return True
+    return bool(_due_recurring(conn, now))
+
+
+def claim_next_job(worker):
+    """
+    Atomically take the oldest queued job for this worker, or return None.
+    An idle poll only reads, on a read-only connection; the write lock is
+    taken only when there is a job to claim, queue or requeue.
+    """
+    global _next_sweep
+    engine = db.get_engine()
+    now = time.time()
+    sweep = now >= _next_sweep
+    if sweep:
+        _next_sweep = now + SWEEP_INTERVAL
+    with db.get_read_engine(engine).connect() as conn:
+        if not _work_pending(conn, now, sweep):
+            return None
+    with engine.begin() as conn:
+        if sweep:
+            conn.execute(_REQUEUE_STALE, {"cutoff": now - STALE_AFTER})
+            # Jobs that ran out of attempts while stale are failed rather than requeued
+            conn.execute(_FAIL_EXHAUSTED, {"now": now})
+        _queue_recurring(conn, now)
+        row = conn.execute(_SELECT_NEXT_QUEUED).first()
+        claimed = row is not None and conn.execute(
+            _CLAIM_JOB, {"job_id": row.id, "worker": worker, "now": now}
+        ).rowcount
+        db.record_changes(conn, [jobs])
+    if not claimed:
+        # Nothing left to claim, or another worker got there first
+        return None
+    return fetch_job(row.id)
+
+
+def _heartbeat(job_id, stop_event):
+    """Keep a running job's heartbeat fresh so it is not requeued as stale."""
+    while not stop_event.wait(HEARTBEAT_INTERVAL):
+        with db.get_engine().begin() as conn:
+            conn.execute(_HEARTBEAT, {"job_id": job_id, "now": time.time()})
+            db.record_changes(conn, [jobs])
+
+
+def run_job(job):
+    """Execute a claimed job and record its outcome, retrying failures while attempts remain."""
+    job_id = job["id"]
+    state = {"updated_at": 0.0, "progress": 0.0}
+
+    def progress(fraction, message=None):
+        now = time.time()
+        if now - state["updated_at"] < PROGRESS_INTERVAL and fraction < 1:
+            return
+        state["updated_at"] = now
+        state["progress"] = max(0.0, min(1.0, fraction))
+        with db.get_engine().begin() as conn:
+            conn.execute(_UPDATE_PROGRESS, {
+                "job_id": job_id, "progress": state["progress"], "message": message, "now": now,
+            })
+            db.record_changes(conn, [jobs])
+            cancel_requested = conn.execute(_SELECT_CANCEL_REQUESTED, {"job_id": job_id}).scalar()
+        if cancel_requested:
+            raise JobCancelled()
+
+    stop_heartbeat = threading.Event()
+    threading.Thread(target=_heartbeat, args=(job_id, stop_heartbeat), daemon=True).start()
+    outcome = {"job_id": job_id, "result": None, "error": None}
+    try:
+        handler = JOB_HANDLERS[job["kind"]]
+        result = handler(json.loads(job["params"]), progress)
+        outcome.update(status="succeeded", progress=1.0, result=json.dumps(result))
+    except JobCancelled:
+        outcome.update(status="cancelled", progress=state["progress"])
+    except Exception:
+        retry = job["attempts"] < job["max_attempts"]
+        outcome.update(status="queued" if retry else "failed", progress=0.0, error=traceback.format_exc())
+    finally:
+        stop_heartbeat.set()
+
+    # A job going back to the queue for another attempt is not finished
+    finished_at = None if outcome["status"] == "queued" else time.time()
+    with db.get_engine().begin() as conn:
+        conn.execute(_FINISH_JOB, {**outcome, "finished_at": finished_at})
+        db.record_changes(conn, [jobs])
+    return outcome["status"]
+
+
+def worker_loop(stop_event=None, worker=None):
+    """Claim and run jobs until stop_event is set."""
+    stop_event = stop_event or threading.Event()
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    while not stop_event.is_set():
+        job = claim_next_job(worker)
+        if job is None:
+            stop_event.wait(POLL_INTERVAL)
+            continue
+        run_job(job)
+
+
+def start_workers(count=None):
+    """Start background worker threads for this process (once); returns the number started."""
+    global _workers_started
+    count = JOB_WORKERS if count is None else count
+    with _workers_lock:
+        if _workers_started or count <= 0:
+            return 0
+        for i in range(count):
+            threading.Thread(target=worker_loop, name=f"job-worker-{i}", daemon=True).start()
+        _workers_started = True
+    return count
+
+
+def _process_worker():
+    """Entry point for a standalone worker process."""
+    db.dispose_engines()
+    worker_loop()
+
+
+# Built-in job kinds
+
+@job_handler("reports")
+def _run_reports(params, progress):
+    """Generate static HTML reports (see app/reports.py)."""
+    from app.reports import generate_reports
+
+    statuses = generate_reports(
+        client_id=params.get("client_id"),
+        force=params.get("force", False),
+        embed_plotlyjs=params.get("embed_plotlyjs", True),
+        progress=lambda done, total: progress(done / total, f"{done}/{total} reports"),
+    )
+    counts = {}
+    for _, status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+@job_handler("export_results")
+def _run_export_results(params, progress):
+    """Export every question result of every assessment (optionally one client's) to one CSV file."""
+    client_id = params.get("client_id")
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    path = EXPORT_DIR / f"results_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+    tmp_path = path.with_suffix(".csv.tmp")
+    with db.read_snapshot():
+        assessments = db.fetch_assessments(client_id)
+        with open(tmp_path, "w", newline="", encoding="utf-8") as f:
+            writer = None
+            for i, assessment in enumerate(assessments):
+                for row in db.fetch_assessment_results(assessment["id"]):
+                    record = {
+                        "client_name": assessment["client_name"],
+                        "assessment_id": assessment["id"],
+                        "assessment_name": assessment["name"],
+                        **dict(row),
+                    }
+                    if writer is None:
+                        writer = csv.DictWriter(f, fieldnames=list(record))
+                        writer.writeheader()
+                    writer.writerow(record)
+                progress((i + 1) / len(assessments), f"{i + 1}/{len(assessments)} assessments")
+    tmp_path.replace(path)
+    return {"path": str(path), "assessments": len(assessments)}
+
+
+@job_handler("export_scores")
+def _run_export_scores(params, progress):
+    """Export every answer's scores (optionally one client's) to CSV from the analytics store."""
+    from app.analytics_store import export_scores
+
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    path = EXPORT_DIR / f"scores_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+    count = export_scores(
+        path,
+        client_id=params.get("client_id"),
+        progress=lambda done, total: progress(done / total if total else 1.0, f"{done}/{total} assessments"),
+    )
+    return {"path": str(path), "assessments": count}
+
+
+@job_handler("refresh_analytics", every=ANALYTICS_INTERVAL)
+def _run_refresh_analytics(params, progress):
+    """Reload assessments saved since the last analytics store refresh (see app/analytics_store.py)."""
+    from app.analytics_store import refresh_store
+
+    return refresh_store(
+        full=params.get("full", False),
+        progress=lambda done, total: progress(done / total, f"{done}/{total} assessments"),
+    )
+
+
+@job_handler("purge")
+def _run_purge(params, progress):
+    """Purge and archive stale assessments or whole clients (see app/retention.py)."""
+    from app import retention
+
+    archive = params.get("archive", True)
+    if params.get("client_ids"):
+        count, path = retention.purge_clients(params["client_ids"], archive=archive)
+        return {"clients": count, "archive": str(path) if path else None}
+    older_than_days = params.get("older_than_days", RETENTION_DAYS)
+    if not older_than_days:
+        return {"assessments": 0, "archive": None}
+    progress(0.0, "Finding stale assessments")
+    count, path = retention.purge_stale_assessments(older_than_days, params.get("client_id"), archive=archive)
+    return {"assessments": count, "archive": str(path) if path else None}
+
+
+# The scheduled purge only runs when a retention period is configured
+if RETENTION_DAYS:
+    RECURRING_JOBS["purge"] = PURGE_INTERVAL
+
+
+@job_handler("reclaim_space", every=RECLAIM_INTERVAL)
+def _run_reclaim_space(params, progress):
+    """Release free pages left by deletes back to the filesystem."""
+    return {"pages": db.reclaim_space(params.get("max_pages"))}
+
+
+@job_handler("backup", every=BACKUP_INTERVAL)
+def _run_backup(params, progress):
+    """Online backup of every database (see app/backup.py)."""
+    from app.backup import create_backup
+
+    return {"path": str(create_backup(progress=progress))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Background job workers")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    worker_parser = subparsers.add_parser("worker", help="Run job workers until interrupted")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Worker processes to run")
+    subparsers.add_parser("list", help="List recent jobs")
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        if args.processes <= 1:
+            worker_loop()
+        else:
+            with ProcessPoolExecutor(max_workers=args.processes) as executor:
+                for _ in range(args.processes):
+                    executor.submit(_process_worker)
+    elif args.command == "list":
+        for job in fetch_jobs():
+            print(f"{job['id']}\t{job['kind']}\t{job['status']}\t{job['progress']:.0%}\t{job['message'] or ''}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from app.db import fetch_all_clients
+from app.job_queue import ACTIVE_STATUSES, JOB_WORKERS, cancel_job, enqueue_job, fetch_jobs, retry_job
+
+# Seconds between status refreshes of the jobs table
+REFRESH_INTERVAL = 2
+
+
+def jobs_view():
+    """Panel for queueing and monitoring background jobs."""
+    st.title("Jobs")
+    if not JOB_WORKERS:
+        st.caption("This server runs no job workers, so queued jobs wait for one: set RUDI_JOB_WORKERS "
+                   "or start `python -m app.job_queue worker`.")
+
+    # Queue new jobs
+    with st.expander("Queue a Job", expanded=False):
+        clients = fetch_all_clients()
+        client_options = [None] + [client['id'] for client in clients]
+        client_names = {client['id']: client['name'] for client in clients}
+
+        with st.form("queue_export_form"):
+            st.write("**Export results to CSV**")
+            client_id = st.selectbox(
+                "Client:",
+                client_options,
+                format_func=lambda x: "All Clients" if x is None else client_names[x],
+                key="export_job_client"
+            )
+            submit_button = st.form_submit_button("Queue Export")
+
+            if submit_button:
+                job_id = enqueue_job("export_results", {"client_id": client_id})
+                st.success(f"Export queued as job {job_id}.")
+
+        with st.form("queue_scores_export_form"):
+            st.write("**Export scores from the analytics store to CSV**")
+            st.caption("One row per answer with ids, category and scores only; much faster for large exports.")
+            client_id = st.selectbox(
+                "Client:",
+                client_options,
+                format_func=lambda x: "All Clients" if x is None else client_names[x],
+                key="scores_export_job_client"
+            )
+            submit_button = st.form_submit_button("Queue Scores Export")
+
+            if submit_button:
+                job_id = enqueue_job("export_scores", {"client_id": client_id})
+                st.success(f"Scores export queued as job {job_id}.")
+
+        with st.form("queue_refresh_analytics_form"):
+            st.write("**Refresh the analytics store**")
+            st.caption("Reloads assessments saved since the last refresh, for the Portfolio page and overviews.")
+            full = st.checkbox("Rebuild from every assessment", key="refresh_analytics_full")
+            submit_button = st.form_submit_button("Queue Refresh")
+
+            if submit_button:
+                job_id = enqueue_job("refresh_analytics", {"full": full})
+                st.success(f"Analytics refresh queued as job {job_id}.")
+
+    job_status_panel()
+
+def _format_time(timestamp):
+    """Format an epoch timestamp for display."""
+    if timestamp is None or pd.isna(timestamp):
+        return ""
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+@st.fragment(run_every=REFRESH_INTERVAL)
+def job_status_panel():
+    """Live table of recent jobs with cancel and retry controls; refreshes on its own."""
+    st.header("Recent Jobs")
+
+    jobs = fetch_jobs()
+    if not jobs:
+        st.info("No jobs have been queued yet.")
+        return
+
+    df = pd.DataFrame([dict(job) for job in jobs])
+    df['created_at'] = df['created_at'].apply(_format_time)
+    df['finished_at'] = df['finished_at'].apply(_format_time)
+    st.dataframe(
+        df[['id', 'kind', 'status', 'progress', 'message', 'attempts', 'created_at', 'finished_at']],
+        column_config={
+            'id': 'ID',
+            'kind': 'Kind',
+            'status': 'Status',
+            'progress': st.column_config.ProgressColumn('Progress', min_value=0.0, max_value=1.0),
+            'message': 'Message',
+            'attempts': 'Attempts',
+            'created_at': 'Created',
+            'finished_at': 'Finished',
+        },
+        hide_index=True
+    )
+
+    # Controls for the selected job
+    selected_idx = st.selectbox(
+        "Select Job:",
+        range(len(jobs)),
+        format_func=lambda i: f"Job {jobs[i]['id']}: {jobs[i]['kind']} ({jobs[i]['status']})",
+        key="selected_job"
+    )
+    job = jobs[selected_idx]
+
+    col1, col2 = st.columns(2)
+    if job['status'] in ACTIVE_STATUSES:
+        if col1.button("Cancel Job", key=f"cancel_job_{job['id']}"):
+            cancel_job(job['id'])
+            st.rerun(scope="fragment")
+    elif job['status'] in ("failed", "cancelled"):
+        if col1.button("Retry Job", key=f"retry_job_{job['id']}"):
+            retry_job(job['id'])
+            st.rerun(scope="fragment")
+
+    if job['result']:
+        st.write("**Result:**")
+        st.json(json.loads(job['result']))
+    if job['error']:
+        st.write("**Error:**")
+        st.code(job['error'])
@@ -0,0 +1,262 @@
+"""
+Load test: many simulated users driving the Streamlit app at once.
+
+Each simulated user is a headless Streamlit session (streamlit.testing's
+AppTest) running the real app script in its own process. AppTest keeps
+per-process state, so sessions cannot share a process the way they do in the
+Streamlit server. For the database it makes no difference: every session still
+has its own connections. Each session selects a client, creates an
+assessment, saves every page of every category with random answers,
+completes the assessment and opens the results dashboard. Every rerun is
+timed. Each process first loads the app once untimed, so import time is not
+counted as latency.
+
+The test runs against a freshly generated database in a temporary directory,
+never the configured one. For each concurrency level it reports rerun latency
+percentiles, "database is locked" errors, other errors and throughput.
+
+    python -m app.loadtest --users 1 5 10 20
+    python -m app.loadtest --users 10 --categories 8 --questions 6 --sharded
+"""
+
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+APP_SCRIPT = Path(__file__).parents[1] / "streamlit_app.py"
+
+
+def _percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (0 for an empty list)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def generate_database(clients, categories, questions, answers=4):
+    """Fill the (empty) configured database with a questionnaire per type and some clients."""
+    from app import db
+
+    for qtype in ("org", "action"):
+        # Every question shares one scale, as in the real banks
+        scale_id = db.add_answer_scale(f"Load test {qtype} levels",
+                                       [(score, f"Level {score}") for score in range(1, answers + 1)])
+        for c in range(1, categories + 1):
+            for q in range(1, questions + 1):
+                db.add_question(f"Category {c}", qtype, q, c, f"Load test {qtype} question {c}.{q}", scale_id)
+        db.publish_questionnaire(qtype)
+    return [db.add_client(f"Load Client {i}") for i in range(1, clients + 1)]
+
+
+class SimulatedUser:
+    """One headless session walking through an assessment, recording each rerun's latency and errors."""
+
+    def __init__(self, number, client_name, timeout, rng):
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.client_name = client_name
+        self.rng = rng
+        self.app = AppTest.from_file(str(APP_SCRIPT), default_timeout=timeout)
+        self.latencies = []
+        self.lock_errors = 0
+        self.errors = []
+        self.completed = False
+
+    def _run(self, widget=None):
+        """Rerun the script (through widget if given) and record how long it took and what failed."""
+        start = time.perf_counter()
+        try:
+            (widget or self.app).run()
+        except Exception as e:
+            # Timeouts and script-runner failures end this user's journey
+            self._record_error(str(e))
+            raise
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+        for exception in self.app.exception:
+            self._record_error(exception.message)
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+
+    def _record_error(self, message):
+        if "database is locked" in message:
+            self.lock_errors += 1
+        else:
+            self.errors.append(message)
+
+    def _option_index(self, widget, prefix):
+        return next(i for i, option in enumerate(widget.options) if option.startswith(prefix))
+
+    def _position(self):
+        """The category and page shown in the assessment form."""
+        app = self.app
+        category = next(s.value for s in app.subheader if s.value.startswith("Category: "))
+        page = next((r.value for r in app.radio if r.key and r.key.endswith("_page")), 0)
+        return category, page
+
+    def journey(self):
+        """Select the client, create an assessment, answer every page, complete it and open the results."""
+        app = self.app
+        self._run()
+
+        clients = app.selectbox(key="client_selectbox")
+        self._run(clients.set_value(self._option_index(clients, self.client_name)))
+
+        assessment_name = f"Load test {self.number} {time.time_ns()}"
+        form_input = next(w for w in app.text_input if w.label == "Assessment Name:")
+        form_input.set_value(assessment_name)
+        qtype = self.rng.choice(["org", "action"])
+        next(w for w in app.selectbox if w.label == "Assessment Type:").set_value(qtype)
+        self._run(next(b for b in app.button if b.label == "Create Assessment").click())
+
+        # Saving a page advances to the next page or category; only the last page's save stays put
+        position = self._position()
+        while True:
+            for radio in app.radio:
+                if radio.key and radio.key.startswith(("actual_radio_", "required_radio_")):
+                    radio.set_value(self.rng.randrange(len(radio.options)))
+            self._run(next(b for b in app.button if b.label == "Save Answers").click())
+            previous, position = position, self._position()
+            if position == previous:
+                if any(b.label == "Next Category" for b in app.button):
+                    raise RuntimeError(f"Saving {position[0]} page {position[1] + 1} did not advance")
+                break
+
+        self._run(next(b for b in app.button if b.label == "Complete Assessment").click())
+        self._run(app.sidebar.radio[0].set_value("Results Dashboard"))
+        assessments = next(w for w in app.selectbox if w.label == "Select Assessment:")
+        self._run(assessments.set_value(self._option_index(assessments, assessment_name)))
+        self.completed = True
+
+
+_start_barrier = None
+
+
+def _init_user_process(barrier, timeout):
+    """Pool initializer: load the app once so imports are not timed, and keep the start barrier."""
+    from streamlit.testing.v1 import AppTest
+
+    global _start_barrier
+    _start_barrier = barrier
+    AppTest.from_file(str(APP_SCRIPT), default_timeout=timeout).run()
+
+
+def _drive_user(number, client_name, timeout, seed):
+    """Run one user's journey once all users are ready; returns its measurements."""
+    session = SimulatedUser(number, client_name, timeout, random.Random(seed))
+    _start_barrier.wait()
+    try:
+        session.journey()
+    except Exception as e:
+        if not session.errors and not session.lock_errors:
+            session.errors.append(f"{type(e).__name__}: {e}")
+    return {
+        'latencies': session.latencies,
+        'lock_errors': session.lock_errors,
+        'errors': session.errors,
+        'completed': session.completed,
+        'finished_at': time.time(),
+    }
+
+
+def run_level(users, client_names, timeout, seed):
+    """Run users concurrent journeys, one process each; returns the level's summary dict."""
+    rng = random.Random(seed)
+    context = multiprocessing.get_context("spawn")
+    with context.Manager() as manager:
+        # The parent joins the barrier too, so the clock starts when every user is ready
+        barrier = manager.Barrier(users + 1)
+        with ProcessPoolExecutor(users, mp_context=context, initializer=_init_user_process,
+                                 initargs=(barrier, timeout)) as pool:
+            futures = [
+                pool.submit(_drive_user, i, client_names[i % len(client_names)], timeout, rng.random())
+                for i in range(users)
+            ]
+            barrier.wait()
+            start = time.time()
+            sessions = [future.result() for future in futures]
+    elapsed = max(s['finished_at'] for s in sessions) - start
+
+    latencies = [latency for s in sessions for latency in s['latencies']]
+    completed = sum(s['completed'] for s in sessions)
+    return {
+        'users': users,
+        'completed': completed,
+        'reruns': len(latencies),
+        'p50': _percentile(latencies, 0.50),
+        'p90': _percentile(latencies, 0.90),
+        'p99': _percentile(latencies, 0.99),
+        'max': max(latencies, default=0.0),
+        'lock_errors': sum(s['lock_errors'] for s in sessions),
+        'errors': [error for s in sessions for error in s['errors']],
+        'seconds': elapsed,
+        'journeys_per_s': completed / elapsed,
+        'reruns_per_s': len(latencies) / elapsed,
+    }
+
+
+def print_report(results):
+    print(f"{'users':>5} {'done':>5} {'reruns':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'locked':>6} {'errors':>6} {'journeys/s':>10} {'reruns/s':>8}")
+    for r in results:
+        print(f"{r['users']:>5} {r['completed']:>5} {r['reruns']:>6} {r['p50'] * 1000:>8.0f} {r['p90'] * 1000:>8.0f} "
+              f"{r['p99'] * 1000:>8.0f} {r['max'] * 1000:>8.0f} {r['lock_errors']:>6} {len(r['errors']):>6} "
+              f"{r['journeys_per_s']:>10.2f} {r['reruns_per_s']:>8.1f}")
+    for r in results:
+        for error in sorted(set(r['errors']))[:5]:
+            print(f"[{r['users']} users] {error.splitlines()[0] if error else error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive concurrent simulated users through the app")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 5, 10], metavar="N",
+                        help="Concurrency levels to run, one after another")
+    parser.add_argument("--categories", type=int, default=6, help="Categories per questionnaire")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per category")
+    parser.add_argument("--clients", type=int, help="Clients to generate (default: one per user)")
+    parser.add_argument("--sharded", action="store_true", help="Store each client in its own shard file")
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds a single rerun may take")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random answers")
+    parser.add_argument("--keep", action="store_true", help="Keep the generated database directory")
+    args = parser.parse_args(argv)
+
+    # The app reads its configuration at import time, so point it at the
+    # generated database before anything from app is imported
+    workdir = Path(tempfile.mkdtemp(prefix="rudi-loadtest-"))
+    os.environ["RUDI_DATABASE_URL"] = f"sqlite:///{workdir / 'data.db'}"
+    if args.sharded:
+        os.environ["RUDI_SHARD_DIR"] = str(workdir / "shards")
+    else:
+        os.environ.pop("RUDI_SHARD_DIR", None)
+    for name in ("RUDI_BACKUP_DIR", "RUDI_ARCHIVE_DIR", "RUDI_REPORT_DIR", "RUDI_EXPORT_DIR", "RUDI_ANALYTICS_DIR"):
+        os.environ[name] = str(workdir / name.removeprefix("RUDI_").removesuffix("_DIR").lower())
+
+    try:
+        client_names = [f"Load Client {i}" for i in range(1, (args.clients or max(args.users)) + 1)]
+        generate_database(len(client_names), args.categories, args.questions)
+        print(f"Generated {workdir}: {len(client_names)} clients, "
+              f"{args.categories} categories x {args.questions} questions per type")
+        results = []
+        for users in args.users:
+            results.append(run_level(users, client_names, args.timeout, args.seed + users))
+        print_report(results)
+    finally:
+        if args.keep:
+            print(f"Kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Run the imported module rather than __main__, so the worker functions
+    # pickle by their module path (AppTest replaces __main__ in the workers)
+    from app.loadtest import main as loadtest_main
+    loadtest_main()
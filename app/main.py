@@ -2,6 +2,9 @@ import streamlit as st
 
 from app.admin import admin_view
 from app.client import client_view
+from app.job_queue import start_workers
+from app.jobs import jobs_view
+from app.portfolio import portfolio_view
 # Import app modules
 from app.results import results_view
 
@@ -13,7 +16,14 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource
+def start_job_workers():
+    """Start this server process's background job workers once, shared by all sessions."""
+    return start_workers()
+
 def main():
+    start_job_workers()
+    
     # Set up the sidebar navigation
     st.sidebar.title("Ready Rudi")
     st.sidebar.subheader("Assessment Tool")
@@ -21,7 +31,7 @@ def main():
     # Navigation options
     app_mode = st.sidebar.radio(
         "Select Mode:",
-        options=["Client Assessment", "Results Dashboard", "Admin Panel"],
+        options=["Client Assessment", "Results Dashboard", "Portfolio", "Admin Panel", "Jobs"],
         index=0
     )
     
@@ -32,6 +42,10 @@ def main():
         admin_view()
     elif app_mode == "Results Dashboard":
         results_view()
+    elif app_mode == "Portfolio":
+        portfolio_view()
+    elif app_mode == "Jobs":
+        jobs_view()
 
 if __name__ == "__main__":
     main()
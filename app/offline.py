@@ -0,0 +1,311 @@
+"""
+Offline answer capture.
+
+An assessor downloads a template per assessment (JSON, or CSV for
+spreadsheets) generated from the questionnaire the assessment is pinned to,
+fills it in without a connection, and uploads the completed files later, any
+number at once. Uploads are parsed, validated against the questionnaire's
+answers and merged into `choices` in one transaction (one per shard file with
+sharding). Nothing is written if any row is invalid.
+
+Templates record the choices that existed when they were generated (the
+"base"). A row conflicts when the stored choice has changed since then to
+something other than the uploaded answer; conflicts are skipped, overwritten
+or abort the merge, depending on the chosen policy.
+"""
+
+import csv
+import io
+import json
+import time
+import zipfile
+
+from app import db
+
+FORMAT = "ready-rudi-offline"
+FORMAT_VERSION = 1
+
+CONFLICT_POLICIES = {
+    "skip": "Keep the stored answer",
+    "overwrite": "Use the uploaded answer",
+    "fail": "Reject the upload",
+}
+
+CSV_COLUMNS = [
+    "assessment_id",
+    "questionnaire_version_id",
+    "question_id",
+    "category",
+    "qsequence",
+    "question",
+    "answer_options",
+    "actual_score",
+    "desired_score",
+    "base_actual_answer_id",
+    "base_desired_answer_id",
+]
+
+
+class MergeConflict(Exception):
+    """Raised inside the merge transaction when conflicts are not allowed."""
+
+
+def build_template(assessment_id):
+    """Offline template for an assessment as a dict: its questions, answer options and current choices."""
+    assessment = db.fetch_assessment_by_id(assessment_id)
+    if assessment is None:
+        raise ValueError(f"Assessment {assessment_id} does not exist")
+    questionnaire = db.fetch_assessment_questionnaire(assessment_id, assessment['qtype'])
+    existing = {
+        choice['question_id']: choice for choice in db.fetch_choices_by_assessment(assessment_id)
+    }
+
+    questions = []
+    for question in questionnaire['questions']:
+        choice = existing.get(question['id'])
+        questions.append({
+            'question_id': question['id'],
+            'category': question['category'],
+            'qsequence': question['qsequence'],
+            'question': question['question'],
+            'answers': [
+                {'answer_id': a['id'], 'score': a['score'], 'answer': a['answer']}
+                for a in questionnaire['answers_by_question'].get(question['id'], [])
+            ],
+            'actual_answer_id': choice['answer_id_actual'] if choice else None,
+            'desired_answer_id': choice['answer_id_desired'] if choice else None,
+            'base_actual_answer_id': choice['answer_id_actual'] if choice else None,
+            'base_desired_answer_id': choice['answer_id_desired'] if choice else None,
+        })
+
+    return {
+        'format': FORMAT,
+        'version': FORMAT_VERSION,
+        'generated_at': int(time.time()),
+        'assessment_id': assessment['id'],
+        'assessment_name': assessment['name'],
+        'client_name': assessment['client_name'],
+        'qtype': assessment['qtype'],
+        'questionnaire_version_id': assessment['questionnaire_version_id'],
+        'questions': questions,
+    }
+
+
+def template_json(assessment_id):
+    """Offline template as JSON text."""
+    return json.dumps(build_template(assessment_id), indent=1, ensure_ascii=False)
+
+
+def template_csv(assessment_id):
+    """Offline template as CSV text, one row per question, answered by score."""
+    template = build_template(assessment_id)
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=CSV_COLUMNS)
+    writer.writeheader()
+    for question in template['questions']:
+        scores = {a['answer_id']: a['score'] for a in question['answers']}
+        writer.writerow({
+            'assessment_id': template['assessment_id'],
+            'questionnaire_version_id': template['questionnaire_version_id'] or "",
+            'question_id': question['question_id'],
+            'category': question['category'],
+            'qsequence': question['qsequence'],
+            'question': question['question'],
+            'answer_options': " | ".join(f"{a['score']}: {a['answer']}" for a in question['answers']),
+            'actual_score': scores.get(question['actual_answer_id'], ""),
+            'desired_score': scores.get(question['desired_answer_id'], ""),
+            'base_actual_answer_id': question['base_actual_answer_id'] or "",
+            'base_desired_answer_id': question['base_desired_answer_id'] or "",
+        })
+    return output.getvalue()
+
+
+def templates_zip(assessment_ids, fmt="json"):
+    """Zip archive (bytes) with one template per assessment."""
+    render = template_csv if fmt == "csv" else template_json
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for assessment_id in assessment_ids:
+            archive.writestr(f"assessment_{assessment_id}.{fmt}", render(assessment_id))
+    return buffer.getvalue()
+
+
+def _optional_int(value):
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a whole number") from None
+
+
+def _upload_row(source, template, question):
+    """Normalise one question of an upload, looking fields up in the question first, then the template."""
+    def field(key):
+        return _optional_int(question.get(key, template.get(key)))
+
+    try:
+        return {
+            'source': source,
+            **{key: field(key) for key in (
+                'assessment_id', 'questionnaire_version_id', 'question_id',
+                'actual_answer_id', 'desired_answer_id', 'actual_score', 'desired_score',
+                'base_actual_answer_id', 'base_desired_answer_id',
+            )},
+        }
+    except ValueError as e:
+        raise ValueError(f"{source}: {e}") from None
+
+
+def _rows_from_json(name, text):
+    """Upload rows from a JSON template, or a list of templates."""
+    data = json.loads(text)
+    templates = data if isinstance(data, list) else [data]
+    rows = []
+    for template in templates:
+        if template.get('format') != FORMAT:
+            raise ValueError(f"{name}: not a Ready Rudi offline template")
+        for question in template.get('questions', []):
+            rows.append(_upload_row(f"{name}: question {question.get('question_id')}", template, question))
+    return rows
+
+
+def _rows_from_csv(name, text):
+    """Upload rows from a CSV template."""
+    reader = csv.DictReader(io.StringIO(text))
+    missing = {"assessment_id", "question_id"} - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"{name}: missing column(s) {', '.join(sorted(missing))}")
+    rows = []
+    for line, record in enumerate(reader, start=2):
+        rows.append(_upload_row(f"{name}: line {line}", {}, record))
+    return rows
+
+
+def parse_upload(name, data):
+    """Parse an uploaded .json, .csv or .zip (of either) into upload rows; raises ValueError if unreadable."""
+    lower = name.lower()
+    try:
+        if lower.endswith(".zip"):
+            rows = []
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.namelist():
+                    if member.lower().endswith((".json", ".csv")):
+                        rows.extend(parse_upload(f"{name}/{member}", archive.read(member)))
+            return rows
+        text = data.decode("utf-8-sig")
+        if lower.endswith(".json"):
+            return _rows_from_json(name, text)
+        if lower.endswith(".csv"):
+            return _rows_from_csv(name, text)
+    except (UnicodeDecodeError, json.JSONDecodeError, zipfile.BadZipFile, csv.Error, TypeError) as e:
+        raise ValueError(f"{name}: {e}") from e
+    raise ValueError(f"{name}: unsupported file type (use .json, .csv or .zip)")
+
+
+def _answer_id(row, side, answers):
+    """Resolve the uploaded answer for one side ('actual' or 'desired') to an answer id."""
+    answer_id = row[f'{side}_answer_id']
+    if answer_id is not None:
+        if answer_id not in {a['id'] for a in answers}:
+            raise ValueError(f"{side} answer {answer_id} is not an answer to this question")
+        return answer_id
+    score = row[f'{side}_score']
+    if score is None:
+        return None
+    matches = [a['id'] for a in answers if a['score'] == score]
+    if len(matches) != 1:
+        raise ValueError(f"{side} score {score} does not match exactly one answer")
+    return matches[0]
+
+
+def validate_rows(rows):
+    """
+    Check upload rows against the assessments and their questionnaires.
+    Returns (choices, errors): choices are ready for db.merge_choices and
+    errors are strings naming the offending row. Unanswered rows are dropped.
+    """
+    assessments = {}
+    choices, errors, seen = [], [], set()
+    for row in rows:
+        try:
+            assessment_id = row['assessment_id']
+            if assessment_id not in assessments:
+                assessment = db.fetch_assessment_by_id(assessment_id) if assessment_id is not None else None
+                assessments[assessment_id] = assessment and (
+                    assessment, db.fetch_assessment_questionnaire(assessment_id, assessment['qtype'])
+                )
+            if not assessments[assessment_id]:
+                raise ValueError(f"assessment {assessment_id} does not exist")
+            assessment, questionnaire = assessments[assessment_id]
+            if row['questionnaire_version_id'] != assessment['questionnaire_version_id']:
+                raise ValueError("the template was made for a different questionnaire version")
+            if row['question_id'] not in questionnaire['questions_by_id']:
+                raise ValueError(f"question {row['question_id']} is not part of this assessment")
+            answers = questionnaire['answers_by_question'].get(row['question_id'], [])
+            actual = _answer_id(row, 'actual', answers)
+            desired = _answer_id(row, 'desired', answers)
+            if actual is None and desired is None:
+                continue
+            if actual is None or desired is None:
+                raise ValueError("both the actual and the required answer are needed")
+            key = (assessment_id, row['question_id'])
+            if key in seen:
+                raise ValueError("the question is answered more than once in this upload")
+            seen.add(key)
+        except ValueError as e:
+            errors.append(f"{row['source']}: {e}")
+            continue
+        choices.append({
+            'source': row['source'],
+            'assessment_id': assessment_id,
+            'question_id': row['question_id'],
+            'answer_id_actual': actual,
+            'answer_id_desired': desired,
+            'base': (row['base_desired_answer_id'], row['base_actual_answer_id']),
+        })
+    return choices, errors
+
+
+def merge_upload(rows, on_conflict="skip", dry_run=False):
+    """
+    Validate upload rows and merge them into choices. Returns a report dict
+    with the rows 'written', 'unchanged' and in 'conflict' (each a list of
+    choice dicts), 'errors', and whether the merge was 'applied'.
+    """
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"Unknown conflict policy: {on_conflict}")
+    choices, errors = validate_rows(rows)
+    report = {'written': [], 'unchanged': [], 'conflict': [], 'errors': errors, 'applied': False}
+    if errors or not choices:
+        return report
+
+    def resolve(engine_rows, current):
+        to_write = []
+        for choice in engine_rows:
+            stored = current.get((choice['assessment_id'], choice['question_id']))
+            uploaded = (choice['answer_id_desired'], choice['answer_id_actual'])
+            if stored == uploaded:
+                report['unchanged'].append(choice)
+            elif stored is None or stored == choice['base']:
+                to_write.append(choice)
+            else:
+                report['conflict'].append({**choice, 'stored': stored})
+                if on_conflict == "overwrite":
+                    to_write.append(choice)
+        if report['conflict'] and on_conflict == "fail":
+            raise MergeConflict()
+        return to_write
+
+    if on_conflict == "fail" and not dry_run and db.sharding_enabled():
+        # Each shard commits separately, so look for conflicts in all of them first
+        preview = merge_upload(rows, on_conflict, dry_run=True)
+        if preview['conflict']:
+            return preview
+
+    try:
+        report['written'] = db.merge_choices(choices, resolve, dry_run=dry_run)
+        report['applied'] = not dry_run
+    except MergeConflict:
+        report['written'] = []
+    return report
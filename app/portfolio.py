@@ -0,0 +1,94 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+from app.analysis import category_weakness_chart, client_heatmap
+from app.analytics_store import load_store, portfolio_totals
+from app.db import fetch_assessments, read_snapshot
+
+# Clients shown in the heatmap at most, those with the largest values first
+PORTFOLIO_HEATMAP_ROWS = int(os.environ.get("RUDI_PORTFOLIO_HEATMAP_ROWS", "50"))
+LEADERBOARD_SIZES = [10, 25, 50, 100]
+QTYPES = {None: "All types", "org": "Organization", "action": "Action"}
+_METRICS = {"Gap %": "gap_percentage", "Gap": "gap"}
+
+
+def portfolio_view():
+    """Gaps across every client: weakest categories, a client heatmap and leaderboards."""
+    st.title("Portfolio")
+
+    store = load_store()
+    if store is None:
+        st.info("The portfolio appears once the analytics store has been refreshed "
+                "(queue a refresh on the Jobs page).")
+        return
+    st.caption(f"As of the last analytics refresh, {datetime.fromtimestamp(store.refreshed_at):%Y-%m-%d %H:%M}. "
+               "Each client counts with its latest assessment of each type.")
+
+    col1, col2 = st.columns(2)
+    qtype = col1.selectbox("Assessment type:", list(QTYPES), format_func=QTYPES.get, key="portfolio_qtype")
+    metric = col2.radio("Compare by:", list(_METRICS), horizontal=True, key="portfolio_metric")
+    portfolio = _portfolio(store.generation, qtype)
+    if portfolio['clients'].empty:
+        st.warning("No stored assessments of this type yet.")
+        return
+
+    # Weakest categories across every client
+    st.header("Categories across Clients")
+    st.plotly_chart(category_weakness_chart(portfolio['categories']), use_container_width=True)
+
+    st.header("Clients by Category")
+    rows = st.slider("Clients shown:", 1, max(min(len(portfolio['clients']), 500), 2),
+                     min(PORTFOLIO_HEATMAP_ROWS, len(portfolio['clients'])), key="portfolio_rows")
+    st.caption(f"The {min(rows, len(portfolio['clients']))} of {len(portfolio['clients'])} clients "
+               f"with the largest overall {metric.lower()}.")
+    st.plotly_chart(_heatmap(store.generation, qtype, metric, rows), use_container_width=True)
+
+    st.header("Leaderboards")
+    size = st.selectbox("Clients per board:", LEADERBOARD_SIZES, key="portfolio_board_size")
+    columns = {'client': 'Client', 'gap': 'Gap', 'desired_score': 'Required', 'gap_percentage': 'Gap %'}
+    col1, col2 = st.columns(2)
+    for col, (title, column) in zip((col1, col2), [("Largest gaps", "gap"), ("Largest gap %", "gap_percentage")]):
+        col.subheader(title)
+        col.dataframe(portfolio['clients'].nlargest(size, column)[list(columns)].rename(columns=columns),
+                      hide_index=True, use_container_width=True)
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _portfolio(generation, qtype):
+    """
+    Per-client and per-category totals for one store generation and type.
+    A new generation is a new key, so each refresh is aggregated once per
+    server process and every rerun in between reuses it.
+    """
+    with read_snapshot():
+        assessments = fetch_assessments()
+    gaps, desired = portfolio_totals(load_store(), assessments, qtype)
+    names = {a['client_id']: a['client_name'] for a in assessments}
+    clients = pd.DataFrame({
+        'client': [f"{names[client_id]} (#{client_id})" for client_id in gaps.index],
+        'gap': gaps.sum(axis=1).astype(int),
+        'desired_score': desired.sum(axis=1).astype(int),
+    }, index=gaps.index)
+    clients['gap_percentage'] = (clients['gap'] / clients['desired_score'] * 100).round(1)
+    categories = pd.DataFrame({'gap': gaps.sum(), 'desired_score': desired.sum()}).astype(int).rename_axis('category')
+    categories['gap_percentage'] = (categories['gap'] / categories['desired_score'] * 100).round(1)
+    categories = categories.sort_values('gap_percentage', ascending=False)
+    return {
+        'clients': clients,
+        'categories': categories,
+        # Cell values, with categories weakest first
+        'gap': gaps[categories.index].set_axis(clients['client']),
+        'gap_percentage': (gaps / desired * 100).round(1)[categories.index].set_axis(clients['client']),
+    }
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _heatmap(generation, qtype, metric, rows):
+    """The heatmap of the rows clients with the largest overall metric; only those rows are sent to the browser."""
+    portfolio = _portfolio(generation, qtype)
+    column = _METRICS[metric]
+    top = portfolio['clients'].nlargest(rows, column)['client']
+    return client_heatmap(portfolio[column].loc[top], metric)
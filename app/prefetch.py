@@ -0,0 +1,127 @@
+"""
+Background prefetch of assessment categories.
+
+The assessment flow shows one category at a time. While the assessor works on
+the current one, the previous and next categories' questions, answers and
+saved choices are loaded on a small shared thread pool into a per-session
+CategoryCache, so moving between categories renders from memory. The cache is
+bounded (least recently used entries are dropped first). It is emptied as soon
+as the assessment's change counter (db.assessment_version) moves, so answers
+saved by another session or server process show up on the next rerun.
+Entries also expire after RUDI_PREFETCH_TTL seconds as a backstop.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from app.db import assessment_version, fetch_assessment_questionnaire, fetch_choices_for_questions
+
+# Categories kept per session
+PREFETCH_CACHE_SIZE = int(os.environ.get("RUDI_PREFETCH_CACHE_SIZE", "8"))
+# Seconds a loaded category is reused before it is read again
+PREFETCH_TTL = float(os.environ.get("RUDI_PREFETCH_TTL", "120"))
+# Threads shared by all sessions for background loads
+PREFETCH_WORKERS = int(os.environ.get("RUDI_PREFETCH_WORKERS", "2"))
+
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+
+
+def load_category(assessment_id, qtype, category):
+    """
+    Everything needed to render one category: a dict with its 'questions',
+    their 'answers_by_question' and the saved 'choices' by question id (each
+    {'actual': answer id, 'desired': answer id}).
+    """
+    questionnaire = fetch_assessment_questionnaire(assessment_id, qtype)
+    questions = [q for q in questionnaire['questions'] if q['category'] == category]
+    question_ids = [q['id'] for q in questions]
+    choices = {
+        row['question_id']: {'actual': row['answer_id_actual'], 'desired': row['answer_id_desired']}
+        for row in fetch_choices_for_questions(assessment_id, question_ids)
+    } if question_ids else {}
+    return {
+        'questions': questions,
+        'answers_by_question': {
+            question_id: questionnaire['answers_by_question'].get(question_id, []) for question_id in question_ids
+        },
+        'choices': choices,
+    }
+
+
+class CategoryCache:
+    """Bounded cache of loaded categories for one assessment, filled in the background by prefetch()."""
+
+    def __init__(self, assessment_id, qtype, size=PREFETCH_CACHE_SIZE, ttl=PREFETCH_TTL):
+        self.assessment_id = assessment_id
+        self.qtype = qtype
+        self.size = size
+        self.ttl = ttl
+        # category -> (time the load started, Future of load_category's result)
+        self._entries = OrderedDict()
+        # Streamlit may start a rerun of the session before the previous run has finished
+        self._lock = threading.Lock()
+        # Version of the assessment's rows the entries were loaded at
+        self._version = assessment_version(assessment_id)
+
+    def _check_version(self):
+        """Drop every entry if the assessment has been written since they were loaded."""
+        version = assessment_version(self.assessment_id)
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def _fresh(self, category):
+        entry = self._entries.get(category)
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    def _store(self, category, future):
+        self._entries[category] = (time.monotonic(), future)
+        self._entries.move_to_end(category)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def get(self, category):
+        """The category's data, waiting for a prefetch in flight or loading it now if not cached."""
+        with self._lock:
+            self._check_version()
+            future = self._entries[category][1] if self._fresh(category) else None
+            if future is not None:
+                self._entries.move_to_end(category)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                # Failed in the background; load again below so the error surfaces here
+                pass
+        data = load_category(self.assessment_id, self.qtype, category)
+        done = Future()
+        done.set_result(data)
+        with self._lock:
+            self._store(category, done)
+        return data
+
+    def prefetch(self, categories):
+        """Start loading any of the categories that are not already cached or loading."""
+        with self._lock:
+            self._check_version()
+            for category in categories:
+                if category is not None and not self._fresh(category):
+                    self._store(category, _executor.submit(
+                        load_category, self.assessment_id, self.qtype, category
+                    ))
+
+    def invalidate(self, category=None):
+        """
+        Forget one category after this session saved it, or all of them. The
+        save moved the assessment's version, so the new version is taken as
+        seen; the other categories stay cached.
+        """
+        with self._lock:
+            if category is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(category, None)
+            self._version = assessment_version(self.assessment_id)
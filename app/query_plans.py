@@ -0,0 +1,164 @@
+"""
+Query plan checks for the prebuilt statements in app/db.py and app/job_queue.py.
+
+Every module-level statement is compiled and run through EXPLAIN QUERY PLAN
+against an empty database created from app/schema.py. A statement fails the
+check if it scans a large table (one that grows with assessments or saves)
+instead of searching it through an index, or sorts or de-duplicates those
+rows in a temporary B-tree. A failure prints the statement's name, its SQL
+and the offending plan. Run it before merging a change to a query or an
+index. tests/test_query_plans.py runs the same check in the test suite;
+the command line prints the plans:
+
+    python -m app.query_plans        # exits 1 if any statement fails
+    python -m app.query_plans -v     # also print every plan
+"""
+
+import argparse
+import re
+import sys
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.sql.expression import Executable
+
+from app import db, job_queue
+from app.schema import metadata
+
+MODULES = (db, job_queue)
+
+# Tables that grow with clients, assessments and saves; the catalog tables
+# (questions, answers, questionnaire_versions) stay small and are read whole
+LARGE_TABLES = {
+    "clients",
+    "assessments",
+    "assessment_shards",
+    "choices",
+    "choice_events",
+    "trend_checkpoints",
+    "category_trends",
+    "assessment_versions",
+    "result_documents",
+    "jobs",
+}
+
+# Statements whose purpose is to read a whole large table, with the reason
+EXPECTED_SCANS = {
+    "_SELECT_CLIENTS": "lists every client",
+    "_SELECT_ASSESSMENTS": "lists every assessment",
+    "_SELECT_SHARD_CLIENTS": "lists every client with a shard",
+    "_SELECT_ASSESSMENT_ACTIVITY": "retention looks at every assessment's last change",
+    "_SELECT_LATEST_CHOICE_EVENTS": "the analytics refresh compares every assessment's latest save",
+    "_SELECT_JOBS": "the jobs page lists the most recent jobs",
+    "_UNPINNED_ASSESSMENTS": "the one-off scale migration finds every unpinned assessment",
+    "_SELECT_UNPINNED_ANSWER_IDS": "the one-off scale migration remaps every unpinned assessment's saves",
+}
+# Statements allowed a temporary B-tree, with the reason
+EXPECTED_SORTS = {
+    "_SELECT_ASSESSMENT_RESULTS": "orders one assessment's choices (one per question) by question order",
+    "_SELECT_ASSESSMENT_RESULTS_AS_OF": "orders one assessment's choices (one per question) by question order",
+}
+
+_SCAN = re.compile(r"^SCAN (\w+)")
+_TEMP_BTREE = "USE TEMP B-TREE"
+
+
+def statements():
+    """(name, statement) of every prebuilt statement, expanding dicts of statements keyed by table."""
+    found = []
+    for module in MODULES:
+        for name, value in vars(module).items():
+            if not name.startswith("_") or not name.isupper():
+                continue
+            if isinstance(value, Executable):
+                found.append((f"{module.__name__}.{name}", value))
+            elif isinstance(value, dict) and value and all(isinstance(v, Executable) for v in value.values()):
+                found.extend(
+                    (f"{module.__name__}.{name}[{getattr(key, 'name', key)}]", stmt) for key, stmt in value.items()
+                )
+    return found
+
+
+def _placeholder_params(stmt, dialect):
+    """A value for every bind parameter of a statement (a two-item list for expanding ones)."""
+    compiled = stmt.compile(dialect=dialect)
+    return {
+        name: [1, 2] if bind.expanding else 1
+        for bind, name in compiled.bind_names.items()
+        if bind.value is None and bind.callable is None
+    }
+
+
+def _explain(event_target, sql_seen):
+    """Engine hook that runs EXPLAIN QUERY PLAN in place of each statement, remembering the SQL."""
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        sql_seen.append(statement)
+        return f"EXPLAIN QUERY PLAN {statement}", parameters
+    event.listen(event_target, "before_cursor_execute", before_cursor_execute, retval=True)
+
+
+def problems(plan, name):
+    """Plan lines that break the rules for the statement called name."""
+    short_name = name.rsplit(".", 1)[-1].split("[")[0]
+    found = []
+    touches_large = False
+    for detail in plan:
+        match = _SCAN.match(detail)
+        table = match.group(1) if match else None
+        if table in LARGE_TABLES:
+            touches_large = True
+            if short_name not in EXPECTED_SCANS:
+                found.append(detail)
+        elif any(re.search(rf"\b{table}\b", detail) for table in LARGE_TABLES):
+            touches_large = True
+    if touches_large and short_name not in EXPECTED_SCANS and short_name not in EXPECTED_SORTS:
+        found += [detail for detail in plan if detail.startswith(_TEMP_BTREE)]
+    return found
+
+
+def plans():
+    """Explain every statement against a fresh schema; yields (name, sql, plan lines)."""
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{Path(tmp) / 'plans.db'}")
+        metadata.create_all(engine)
+        sql_seen = []
+        _explain(engine, sql_seen)
+        try:
+            with engine.connect() as conn:
+                for name, stmt in statements():
+                    result = conn.execute(stmt, _placeholder_params(stmt, engine.dialect))
+                    plan = [row[3] for row in result] if result.returns_rows else []
+                    yield name, " ".join(sql_seen[-1].split()), plan
+        finally:
+            engine.dispose()
+
+
+def check(verbose=False, out=sys.stdout):
+    """Print the statements whose plans break the rules; returns how many do."""
+    failures = 0
+    for name, sql, plan in plans():
+        found = problems(plan, name)
+        if found:
+            failures += 1
+            print(f"FAIL {name}: {'; '.join(found)}", file=out)
+        if found or verbose:
+            if not found:
+                print(f"ok   {name}", file=out)
+            print(f"     {sql}", file=out)
+            for detail in plan:
+                print(f"       {detail}", file=out)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the query plans of every prebuilt statement")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every statement's plan")
+    args = parser.parse_args(argv)
+    failures = check(args.verbose)
+    print(f"{len(statements())} statements checked, {failures} failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Batch generation of self-contained HTML result packs, one file per assessment.
+
+Reports are rendered in a process pool (one worker per core by default) and
+cached on disk: each file is keyed by a content hash of the assessment's
+scored choices, so re-running only renders assessments that changed.
+
+    python -m app.reports [--client ID] [--out DIR] [--force] [ASSESSMENT_ID ...]
+"""
+
+import argparse
+import hashlib
+import html
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from plotly.offline import get_plotlyjs
+
+from app import db
+from app.analysis import category_summary, gap_chart, results_frame, score_chart
+
+# Where generated reports are written
+REPORT_DIR = Path(os.environ.get("RUDI_REPORT_DIR", Path(__file__).parents[1] / "reports"))
+
+# Bump when the report layout changes so cached files are regenerated
+REPORT_VERSION = "1"
+
+MANIFEST_NAME = "manifest.json"
+PLOTLYJS_NAME = "plotly.min.js"
+
+
+def report_path(out_dir, assessment_id):
+    """Path of the HTML report for an assessment."""
+    return Path(out_dir) / f"assessment_{assessment_id}.html"
+
+
+def choices_digest(assessment, results, embed_plotlyjs=True):
+    """Content hash of an assessment's metadata and scored choices."""
+    payload = {
+        'version': REPORT_VERSION,
+        'embed_plotlyjs': embed_plotlyjs,
+        'assessment': dict(assessment),
+        'results': [dict(r) for r in results],
+    }
+    encoded = json.dumps(payload, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _table(df, columns):
+    """Render selected DataFrame columns as an HTML table."""
+    return df[list(columns)].rename(columns=columns).to_html(index=False, classes="table", border=0)
+
+
+def render_report_html(assessment, results, embed_plotlyjs=True):
+    """
+    Render the summary metrics, category table, charts and gap details as one
+    HTML page. With embed_plotlyjs=False the page loads plotly.min.js from its
+    own directory instead of inlining it (about 4.5 MB per file).
+    """
+    df = results_frame(results)
+    category_df = category_summary(df)
+
+    figures = "\n".join(
+        fig.to_html(full_html=False, include_plotlyjs=False)
+        for fig in (score_chart(category_df), gap_chart(category_df))
+    )
+
+    gaps = df[df['gap'] > 0].sort_values(['category', 'gap'], ascending=[True, False])
+    gap_sections = []
+    for category, rows in gaps.groupby('category', sort=False):
+        gap_sections.append(f"<h3>{html.escape(category)}</h3>")
+        gap_sections.append(_table(rows, {
+            'question': 'Question',
+            'actual_score': 'Actual',
+            'desired_score': 'Required',
+            'gap': 'Gap',
+            'actual_answer': 'Actual Answer',
+            'desired_answer': 'Required Answer',
+        }))
+    gap_details = "\n".join(gap_sections) or "<p>No gaps: every question meets its required level.</p>"
+
+    title = f"{assessment['client_name']} - {assessment['name']}"
+    if embed_plotlyjs:
+        plotlyjs = f'<script type="text/javascript">{get_plotlyjs()}</script>'
+    else:
+        plotlyjs = f'<script src="{PLOTLYJS_NAME}"></script>'
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+{plotlyjs}
+<style>
+body {{ font-family: sans-serif; margin: 2rem; }}
+.metrics {{ display: flex; gap: 3rem; }}
+.metric .value {{ font-size: 2rem; }}
+.table {{ border-collapse: collapse; margin-bottom: 1rem; }}
+.table th, .table td {{ border-bottom: 1px solid #ddd; padding: 0.3rem 0.6rem; text-align: left; }}
+</style>
+</head>
+<body>
+<h1>Assessment Summary</h1>
+<h2>Client: {html.escape(assessment['client_name'])}</h2>
+<h2>Assessment: {html.escape(assessment['name'])} ({html.escape(assessment['qtype'])} type)</h2>
+<div class="metrics">
+<div class="metric"><div>Total Actual Score</div><div class="value">{df['actual_score'].sum()}</div></div>
+<div class="metric"><div>Total Required Score</div><div class="value">{df['desired_score'].sum()}</div></div>
+<div class="metric"><div>Overall Gap</div><div class="value">{df['gap'].sum()}</div></div>
+</div>
+<h1>Category Analysis</h1>
+{_table(category_df, {
+    'category': 'Category',
+    'actual_score': 'Actual',
+    'desired_score': 'Required',
+    'gap': 'Gap',
+    'gap_percentage': 'Gap %',
+})}
+{figures}
+<h1>Gap Details</h1>
+{gap_details}
+</body>
+</html>
+"""
+
+
+def _render_one(args):
+    """Worker: render one assessment's report unless its cached digest still matches."""
+    assessment_id, out_dir, previous_digest, embed_plotlyjs = args
+    with db.read_snapshot():
+        assessment = db.fetch_assessment_by_id(assessment_id)
+        results = db.fetch_assessment_results(assessment_id) if assessment else []
+    if not results:
+        return assessment_id, None, 'empty'
+
+    digest = choices_digest(assessment, results, embed_plotlyjs)
+    path = report_path(out_dir, assessment_id)
+    if digest == previous_digest and path.exists():
+        return assessment_id, digest, 'cached'
+
+    tmp_path = path.with_suffix('.html.tmp')
+    tmp_path.write_text(render_report_html(assessment, results, embed_plotlyjs), encoding='utf-8')
+    tmp_path.replace(path)
+    return assessment_id, digest, 'rendered'
+
+
+def _load_manifest(out_dir):
+    path = Path(out_dir) / MANIFEST_NAME
+    if path.exists():
+        return {int(k): v for k, v in json.loads(path.read_text()).items()}
+    return {}
+
+
+def _save_manifest(out_dir, manifest):
+    path = Path(out_dir) / MANIFEST_NAME
+    tmp_path = path.with_suffix('.json.tmp')
+    tmp_path.write_text(json.dumps({str(k): v for k, v in sorted(manifest.items())}, indent=1))
+    tmp_path.replace(path)
+
+
+def generate_reports(assessment_ids=None, client_id=None, out_dir=None, workers=None, force=False,
+                     embed_plotlyjs=True, progress=None):
+    """
+    Render HTML reports for the given assessments (default: all, or all of one
+    client) and return a list of (assessment_id, status) with status one of
+    'rendered', 'cached' or 'empty'. progress, if given, is called with
+    (done, total) as reports complete.
+    """
+    out_dir = Path(out_dir or REPORT_DIR)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    if not embed_plotlyjs:
+        (out_dir / PLOTLYJS_NAME).write_text(get_plotlyjs(), encoding='utf-8')
+    if assessment_ids is None:
+        assessment_ids = [a['id'] for a in db.fetch_assessments(client_id)]
+
+    manifest = {} if force else _load_manifest(out_dir)
+    tasks = [
+        (assessment_id, str(out_dir), manifest.get(assessment_id), embed_plotlyjs)
+        for assessment_id in assessment_ids
+    ]
+    if not tasks:
+        return []
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    statuses = []
+    executor = ProcessPoolExecutor(max_workers=workers, initializer=db.dispose_engines)
+    try:
+        chunksize = max(1, len(tasks) // (workers * 4))
+        for assessment_id, digest, status in executor.map(_render_one, tasks, chunksize=chunksize):
+            if digest is None:
+                manifest.pop(assessment_id, None)
+            else:
+                manifest[assessment_id] = digest
+            statuses.append((assessment_id, status))
+            if progress:
+                progress(len(statuses), len(tasks))
+    finally:
+        # If progress aborted the run (e.g. a cancelled job), drop pending work
+        # but keep the digests of reports already written
+        executor.shutdown(cancel_futures=True)
+        _save_manifest(out_dir, manifest)
+    return statuses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate static HTML assessment reports")
+    parser.add_argument("assessment_ids", nargs="*", type=int, help="Assessments to render (default: all)")
+    parser.add_argument("--client", type=int, help="Only render assessments for this client")
+    parser.add_argument("--out", default=str(REPORT_DIR), help="Output directory")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    parser.add_argument("--force", action="store_true", help="Ignore the cache and re-render everything")
+    parser.add_argument("--shared-plotlyjs", action="store_true",
+                        help="Write plotly.min.js once next to the reports instead of inlining it in each file")
+    args = parser.parse_args(argv)
+
+    statuses = generate_reports(
+        assessment_ids=args.assessment_ids or None,
+        client_id=args.client,
+        out_dir=args.out,
+        workers=args.workers,
+        force=args.force,
+        embed_plotlyjs=not args.shared_plotlyjs,
+    )
+    counts = {}
+    for _, status in statuses:
+        counts[status] = counts.get(status, 0) + 1
+    print(f"{len(statuses)} assessments: " + ", ".join(f"{n} {s}" for s, n in sorted(counts.items())))
+    print(f"Reports written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,52 @@
+import inspect
+import os
+from datetime import date, datetime, time
+
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import streamlit as st
 
-from app.db import fetch_all_clients, fetch_assessment_results, fetch_assessments
+from app.analysis import (
+    assessment_heatmap,
+    category_summary,
+    document_frames,
+    gap_chart,
+    results_frame,
+    scenario_chart,
+    score_chart,
+    sweep_chart,
+    top_gaps,
+    trend_chart,
+)
+from app.analytics_store import load_store
+from app.db import (
+    assessment_version,
+    fetch_all_clients,
+    fetch_assessment_questionnaire,
+    fetch_assessment_results,
+    fetch_assessment_results_as_of,
+    fetch_assessments,
+    fetch_result_document,
+    read_snapshot,
+)
+from app.history import fold_category_trends
+from app.scenarios import evaluate, max_scores, scenario, sweep
+
+DETAIL_PAGE_SIZES = [10, 25, 50, 100]
+# Seconds between checks for new saves while live updates are on
+LIVE_REFRESH_INTERVAL = float(os.environ.get("RUDI_LIVE_REFRESH_INTERVAL", "5"))
+# Newer Streamlit versions only build an expander's contents once it is opened
+_LAZY_EXPANDERS = 'on_change' in inspect.signature(st.expander).parameters
 
 
 def results_view():
     """View for displaying assessment results and analysis."""
+    # All reads in one render come from the same read-only snapshot, off the write path
+    with read_snapshot():
+        _render_results()
+
+def _render_results():
+    """Render the dashboard body."""
     st.title("Results Dashboard")
     
     # Step 1: Select Client
@@ -59,151 +99,288 @@ def results_view():
     )
     
     assessment_id = assessment_ids[selected_assessment_idx]
-    
-    # Fetch assessment results
-    results = fetch_assessment_results(assessment_id)
-    if not results:
+    selected = assessments[selected_assessment_idx]
+    if selected['status'] == 'completed':
+        st.caption(f"Completed {datetime.fromtimestamp(selected['completed_at']):%Y-%m-%d %H:%M}; "
+                   "the results were finalized then.")
+    
+    # Optionally reconstruct the assessment as it stood at the end of an earlier day
+    view_as_of = st.checkbox("View results as of an earlier date", value=False)
+    live = False
+    if view_as_of:
+        as_of_date = st.date_input("As of:", value=date.today(), max_value=date.today())
+        as_of = datetime.combine(as_of_date, time.max).timestamp()
+        current = _analysis(fetch_assessment_results_as_of(assessment_id, as_of))
+    else:
+        live = st.toggle(
+            "Live updates", key="results_live",
+            help=f"Check for new saves every {LIVE_REFRESH_INTERVAL:g} seconds and update the summary and charts."
+        )
+        current = _current_results(assessment_id)
+    if current is None:
         st.warning("No results found for this assessment. Please complete the assessment first.")
         return
-    
-    # Convert results to DataFrame for analysis
-    df = pd.DataFrame([dict(r) for r in results])
+    df, category_df = current['df'], current['category_df']
     
     # Display assessment summary
     st.header("Assessment Summary")
     st.subheader(f"Client: {client_names[selected_client_idx]}")
     st.subheader(f"Assessment: {assessment_names[selected_assessment_idx]}")
     
-    # Calculate gap for each row (gap is 0 when actual >= desired)
-    df['gap'] = df.apply(lambda row: max(0, row['desired_score'] - row['actual_score']), axis=1)
+    if live:
+        _live_summary(assessment_id)
+        st.caption("The sections below the charts update when the page reruns.")
+    else:
+        _summary_sections(assessment_id, current if view_as_of else None)
     
-    # Calculate overall scores
-    total_actual = df['actual_score'].sum()
-    total_desired = df['desired_score'].sum()
-    total_gap = df['gap'].sum()
+    # The client's other assessments side by side, from the analytics store
+    st.header("Client Overview")
+    client_overview(assessments)
     
-    # Display overall scores
-    col1, col2, col3 = st.columns(3)
-    col1.metric("Total Actual Score", total_actual)
-    col2.metric("Total Required Score", total_desired)
-    col3.metric("Overall Gap", total_gap)
+    # What-if targets, evaluated in memory against the actual scores
+    st.header("What-if Scenarios")
+    if 'max_score' not in df:
+        questionnaire = fetch_assessment_questionnaire(assessment_id, assessments[selected_assessment_idx]['qtype'])
+        df = df.assign(max_score=max_scores(df, questionnaire))
+    scenarios_view(df, assessment_id)
     
-    # Analysis by category
-    st.header("Category Analysis")
+    # Detailed question analysis
+    st.header("Detailed Question Analysis")
     
-    # Group by category and calculate metrics
-    category_df = df.groupby('category').agg({
-        'actual_score': 'sum',
-        'desired_score': 'sum',
-        'gap': 'sum'
-    }).reset_index()
+    gap_details(df, category_df['category'].tolist(), assessment_id, current.get('ranking'))
+    
+    # Export results option
+    st.header("Export Results")
     
-    # Calculate gap percentage correctly (sum of gaps / sum of desired)
-    category_df['gap_percentage'] = (category_df['gap'] / category_df['desired_score'] * 100).round(1)
+    if st.button("Export to CSV"):
+        # Convert the results DataFrame to CSV
+        csv = df.to_csv(index=False).encode('utf-8')
+        
+        # Create a download button
+        st.download_button(
+            label="Download CSV",
+            data=csv,
+            file_name=f"assessment_{assessment_id}_results.csv",
+            mime="text/csv"
+        )
+
+def _analysis(results):
+    """Results frame, category summary and charts for result rows, or None if there are none."""
+    if not results:
+        return None
+    df = results_frame(results)
+    # Group by category and calculate metrics, largest gap first
+    category_df = category_summary(df)
+    return {
+        'df': df,
+        'category_df': category_df,
+        'score_fig': score_chart(category_df),
+        'gap_fig': gap_chart(category_df),
+    }
+
+def _document_analysis(document):
+    """Results frame, category summary and charts from a completed assessment's result document."""
+    df, category_df = document_frames(document)
+    return {
+        'df': df,
+        'category_df': category_df,
+        'score_fig': score_chart(category_df),
+        'gap_fig': gap_chart(category_df),
+        'ranking': document['ranked_gaps'],
+    }
+
+def _current_results(assessment_id):
+    """
+    The analysis of an assessment's current results, recomputed only when its
+    change counter has moved since this session last computed it. Checking
+    the counter costs no query while nothing has been saved. A completed
+    assessment is read from its result document, one row, instead.
+    """
+    key = (assessment_id, assessment_version(assessment_id))
+    cached = st.session_state.get('results_cache')
+    if cached is None or cached['key'] != key:
+        # A snapshot of its own, taken after reading the counter, so the rows are at least that new
+        with read_snapshot(fresh=True):
+            document = fetch_result_document(assessment_id)
+            if document is not None:
+                analysis, trends = _document_analysis(document), document['trends']
+            else:
+                analysis = _analysis(fetch_assessment_results(assessment_id))
+                # Folds in the saves made since the last stored checkpoint; a render never writes
+                trends, _ = fold_category_trends(assessment_id)
+        if analysis is not None:
+            analysis['trend_fig'] = (
+                trend_chart(trends) if len({point['bucket_start'] for point in trends}) > 1 else None
+            )
+            analysis['updated_at'] = datetime.now()
+        cached = {'key': key, 'analysis': analysis}
+        st.session_state['results_cache'] = cached
+    return cached['analysis']
+
+def _summary_sections(assessment_id, analysis=None):
+    """Overall scores, category analysis and charts, from the current results unless analysis is given."""
+    if analysis is None:
+        analysis = _current_results(assessment_id)
+    if analysis is None:
+        st.warning("No results found for this assessment.")
+        return
+    df, category_df = analysis['df'], analysis['category_df']
     
-    # Sort by gap (largest first)
-    category_df = category_df.sort_values('gap', ascending=False)
+    # Display overall scores
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Total Actual Score", df['actual_score'].sum())
+    col2.metric("Total Required Score", df['desired_score'].sum())
+    col3.metric("Overall Gap", df['gap'].sum())
     
-    # Display category metrics
+    # Analysis by category
+    st.header("Category Analysis")
     st.dataframe(category_df)
     
     # Bar chart of actual vs. desired by category
     st.subheader("Actual vs. Required Scores by Category")
-    
-    # Prepare data for bar chart
-    chart_data = pd.melt(
-        category_df,
-        id_vars=['category'],
-        value_vars=['actual_score', 'desired_score'],
-        var_name='Score Type',
-        value_name='Score'
-    )
-    
-    # Rename the score types for better display
-    chart_data['Score Type'] = chart_data['Score Type'].map({
-        'actual_score': 'Actual',
-        'desired_score': 'Required'
-    })
-    
-    # Create a bar chart with Plotly
-    fig = px.bar(
-        chart_data,
-        x='category',
-        y='Score',
-        color='Score Type',
-        barmode='group',
-        title='Actual vs. Required Scores by Category',
-        labels={'category': 'Category', 'Score': 'Score'}
-    )
-    
-    st.plotly_chart(fig, use_container_width=True)
+    st.plotly_chart(analysis['score_fig'], use_container_width=True)
     
     # Gap analysis chart
     st.subheader("Score Gaps by Category")
-    
-    # Create a bar chart for gaps
-    gap_fig = px.bar(
-        category_df,
-        x='category',
-        y='gap',
-        color='gap',
-        title='Score Gaps by Category',
-        labels={'category': 'Category', 'gap': 'Gap (Required - Actual)'},
-        color_continuous_scale='RdYlGn_r'  # Red for large gaps, green for small gaps
+    st.plotly_chart(analysis['gap_fig'], use_container_width=True)
+    
+    # Trend of gaps over the assessment's history
+    st.subheader("Score Gaps by Category Over Time")
+    # The trend covers the whole history, so a view as of an earlier date shows the current one
+    with_trend = analysis if 'trend_fig' in analysis else _current_results(assessment_id)
+    if with_trend is not None and with_trend['trend_fig'] is not None:
+        st.plotly_chart(with_trend['trend_fig'], use_container_width=True)
+    else:
+        st.info("The trend appears once answers have been saved at different times.")
+    if 'updated_at' in analysis:
+        st.caption(f"Results as of {analysis['updated_at']:%H:%M:%S}.")
+
+# Reruns on its own every interval; between saves each run is only a change counter check
+_live_summary = st.fragment(run_every=LIVE_REFRESH_INTERVAL)(_summary_sections)
+
+def client_overview(assessments):
+    """Gap per category for each of a client's assessments, as of the last analytics store refresh."""
+    store = load_store()
+    labels = {a['id']: f"{a['name']} (#{a['id']})" for a in assessments}
+    category_gaps = store.category_totals(list(labels)) if store is not None else None
+    if category_gaps is None or category_gaps.empty:
+        st.info("The overview appears once the analytics store has been refreshed with this client's answers.")
+        return
+    category_gaps.index = category_gaps.index.map(labels)
+    st.caption(f"As of the last analytics refresh, {datetime.fromtimestamp(store.refreshed_at):%Y-%m-%d %H:%M}.")
+    st.plotly_chart(assessment_heatmap(category_gaps), use_container_width=True)
+
+def scenarios_view(df, assessment_id):
+    """Sweep uniform targets and compare custom target scenarios; nothing is saved."""
+    st.write(
+        "Try other required scores without changing the assessment. "
+        "Targets above a question's best answer count as that answer's score."
+    )
+    categories = sorted(df['category'].unique())
+    top_score = int(df['max_score'].max()) if df['max_score'].notna().any() else int(df['desired_score'].max())
+    
+    # Sweep one uniform target over a range of levels
+    st.subheader("Target Sweep")
+    col1, col2, col3 = st.columns([2, 2, 1])
+    sweep_scope = col1.selectbox("Apply to:", ["All categories"] + categories, key="sweep_scope")
+    low, high = col2.slider("Target levels:", 0, max(top_score, 1), (0, max(top_score, 1)), key="sweep_range")
+    step = col3.number_input("Step:", min_value=0.01, value=1.0, step=0.25, key="sweep_step")
+    levels = np.arange(low, high + step / 2, step)
+    summary, _ = sweep(df, levels, None if sweep_scope == "All categories" else sweep_scope)
+    st.plotly_chart(sweep_chart(summary), use_container_width=True)
+    
+    # Named scenarios built from uniform, category and question targets
+    st.subheader("Compare Scenarios")
+    st.write(
+        "Each row sets a target for all questions, one category or one question. "
+        "Rows with the same scenario name form one scenario; the most specific target wins."
+    )
+    # The editor's options are plain strings, so each label carries its row number to stay unique
+    question_labels = {f"Question {position + 1}: {row.category} / {row.question[:60]}": position
+                       for position, row in enumerate(df.itertuples())}
+    scopes = ["All questions"] + [f"Category: {c}" for c in categories] + list(question_labels)
+    edited = st.data_editor(
+        pd.DataFrame(
+            [{'scenario': 'Everything at target', 'scope': "All questions", 'target': top_score}],
+        ),
+        column_config={
+            'scenario': st.column_config.TextColumn('Scenario', required=True),
+            'scope': st.column_config.SelectboxColumn('Applies to', options=scopes, required=True, width="large"),
+            'target': st.column_config.NumberColumn('Target', min_value=0, required=True),
+        },
+        num_rows="dynamic",
+        hide_index=True,
+        key=f"scenario_editor_{assessment_id}"
     )
     
-    st.plotly_chart(gap_fig, use_container_width=True)
-    
-    # Detailed question analysis
-    st.header("Detailed Question Analysis")
-    
-    # Option to show only gaps (questions where desired > actual)
-    show_only_gaps = st.checkbox("Show only gaps (questions where Required > Actual)", value=True)
-    
+    specs = {}
+    for row in edited.dropna().to_dict('records'):
+        spec = specs.setdefault(row['scenario'], scenario(row['scenario']))
+        if row['scope'] == "All questions":
+            spec['uniform'] = row['target']
+        elif row['scope'].startswith("Category: "):
+            spec['categories'][row['scope'].removeprefix("Category: ")] = row['target']
+        elif row['scope'] in question_labels:
+            spec['questions'][question_labels[row['scope']]] = row['target']
+    
+    summary, category_gaps = evaluate(df, specs.values())
+    st.dataframe(summary)
+    st.plotly_chart(scenario_chart(category_gaps), use_container_width=True)
+
+def gap_details(df, categories, assessment_id, ranking=None):
+    """
+    Paged question results, largest gap first, as a compact table or
+    expandable cards. ranking is a result document's gap order, if there is one.
+    """
+    col1, col2, col3 = st.columns([3, 2, 1])
     # Select a category to view detailed questions
-    selected_category = st.selectbox(
+    selected_category = col1.selectbox(
         "Select Category for Detailed Analysis:",
-        category_df['category'].tolist()
+        ["All categories"] + categories,
+        index=1 if categories else 0
     )
+    view_mode = col2.radio("Show as:", ["Cards", "Table"], horizontal=True, key="detail_view_mode")
+    page_size = col3.selectbox("Per page:", DETAIL_PAGE_SIZES, key="detail_page_size")
     
-    # Filter questions by selected category
-    category_questions = df[df['category'] == selected_category]
-    
-    # Filter to show only gaps if checkbox is checked
-    if show_only_gaps:
-        category_questions = category_questions[category_questions['gap'] > 0]
+    # Option to show only gaps (questions where desired > actual)
+    show_only_gaps = st.checkbox("Show only gaps (questions where Required > Actual)", value=True)
     
-    # Sort by gap (largest first)
-    category_questions = category_questions.sort_values('gap', ascending=False)
+    category = None if selected_category == "All categories" else selected_category
+    _, total = top_gaps(df, category, show_only_gaps, limit=0, ranking=ranking)
+    if not total:
+        st.info("No questions to show.")
+        return
+    page_count = (total + page_size - 1) // page_size
+    page = 1
+    if page_count > 1:
+        # Keyed by the filters so the page resets when they change
+        page = st.number_input(f"Page (of {page_count}):", min_value=1, max_value=page_count, value=1,
+                               key=f"detail_page_{selected_category}_{show_only_gaps}_{page_size}")
+    rows, _ = top_gaps(df, category, show_only_gaps, limit=page_size, offset=(page - 1) * page_size,
+                       ranking=ranking)
+    st.caption(f"Questions {(page - 1) * page_size + 1}-{(page - 1) * page_size + len(rows)} of {total}, largest gap first")
+    
+    if view_mode == "Table":
+        st.dataframe(
+            rows[['category', 'question', 'actual_score', 'desired_score', 'gap', 'actual_answer', 'desired_answer']],
+            hide_index=True,
+            use_container_width=True
+        )
+        return
     
-    # Display questions and their scores
-    for _, row in category_questions.iterrows():
-        question = row['question']
-        actual = row['actual_score']
-        desired = row['desired_score']
-        gap = row['gap']
-        
-        # Create an expander for each question
-        with st.expander(f"{question} (Gap: {gap})"):
+    for position, row in zip(rows.index, rows.itertuples()):
+        label = f"{row.question} (Gap: {row.gap})"
+        if _LAZY_EXPANDERS:
+            expander = st.expander(label, key=f"gap_detail_{assessment_id}_{position}", on_change="rerun")
+            if not expander.open:
+                continue
+        else:
+            expander = st.expander(label)
+        with expander:
             col1, col2, col3 = st.columns(3)
-            col1.metric("Actual", actual)
-            col2.metric("Required", desired)
-            col3.metric("Gap", gap)
+            col1.metric("Actual", row.actual_score)
+            col2.metric("Required", row.desired_score)
+            col3.metric("Gap", row.gap)
             
-            st.write("**Actual Answer:**", row['actual_answer'])
-            st.write("**Required Answer:**", row['desired_answer'])
-    
-    # Export results option
-    st.header("Export Results")
-    
-    if st.button("Export to CSV"):
-        # Convert the results DataFrame to CSV
-        csv = df.to_csv(index=False).encode('utf-8')
-        
-        # Create a download button
-        st.download_button(
-            label="Download CSV",
-            data=csv,
-            file_name=f"assessment_{assessment_id}_results.csv",
-            mime="text/csv"
-        )
+            st.write("**Actual Answer:**", row.actual_answer)
+            st.write("**Required Answer:**", row.desired_answer)
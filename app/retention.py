@@ -0,0 +1,132 @@
+"""
+Retention: purge old assessments or whole clients, archiving them first, and
+hand freed pages back to the filesystem.
+
+Purged rows are written to a gzip-compressed JSON Lines file in ARCHIVE_DIR
+(one line per client or assessment) inside the same transaction that deletes
+them, so nothing is deleted unless its archive was written. The database runs
+with auto_vacuum=INCREMENTAL; the free pages a purge leaves behind are
+released by the recurring "reclaim_space" job, which keeps the files, and so
+the working set, close to the size of the live data.
+
+    python -m app.retention purge --older-than 365 [--client ID] [--no-archive]
+    python -m app.retention purge-client ID [ID ...] [--no-archive]
+    python -m app.retention reclaim
+    python -m app.retention stats
+"""
+
+import argparse
+import gzip
+import json
+import os
+import time
+from pathlib import Path
+
+from app import db
+
+# Where purge archives are written
+ARCHIVE_DIR = Path(os.environ.get("RUDI_ARCHIVE_DIR", Path(__file__).parents[1] / "archive"))
+# Assessments untouched for this many days are purged (and archived) daily; 0 disables
+RETENTION_DAYS = int(os.environ.get("RUDI_RETENTION_DAYS", "0"))
+# Seconds between scheduled reclaims of free pages
+RECLAIM_INTERVAL = float(os.environ.get("RUDI_RECLAIM_INTERVAL", "3600"))
+
+PURGE_INTERVAL = 24 * 3600
+
+
+class _Archive:
+    """Callable that writes records to a new archive file, keeping it under a temporary name until closed."""
+
+    def __init__(self, label):
+        ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+        self.path = ARCHIVE_DIR / f"{time.strftime('%Y%m%d_%H%M%S')}_{label}.jsonl.gz"
+        self.tmp_path = self.path.with_suffix(".gz.tmp")
+        self.count = 0
+        self._file = None
+
+    def __call__(self, records):
+        if isinstance(records, dict):
+            records = [records]
+        if self._file is None:
+            self._file = gzip.open(self.tmp_path, "wt", encoding="utf-8")
+        for record in records:
+            self._file.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+            self.count += 1
+        # Make sure the records are on disk before the caller's transaction deletes them
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        """Finish the file; returns its path, or None if nothing was archived."""
+        if self._file is None:
+            return None
+        self._file.close()
+        self.tmp_path.replace(self.path)
+        return self.path
+
+
+def stale_assessment_ids(older_than_days, client_id=None):
+    """Ids of assessments whose last recorded change is more than older_than_days ago."""
+    cutoff = time.time() - older_than_days * 86400
+    return [
+        row['id'] for row in db.fetch_assessment_activity(client_id)
+        if row['last_activity'] is not None and row['last_activity'] < cutoff
+    ]
+
+
+def purge_assessments(assessment_ids, archive=True):
+    """Purge assessments, archiving them first unless archive=False. Returns (count, archive path)."""
+    writer = _Archive("assessments") if archive else None
+    try:
+        count = db.purge_assessments(assessment_ids, archive=writer)
+    finally:
+        path = writer.close() if writer else None
+    return count, path
+
+
+def purge_stale_assessments(older_than_days, client_id=None, archive=True):
+    """Purge assessments not changed in older_than_days days. Returns (count, archive path)."""
+    return purge_assessments(stale_assessment_ids(older_than_days, client_id), archive=archive)
+
+
+def purge_clients(client_ids, archive=True):
+    """Purge clients with everything they own, archiving them first. Returns (count, archive path)."""
+    writer = _Archive("clients") if archive else None
+    count = 0
+    try:
+        for client_id in client_ids:
+            count += db.purge_client(client_id, archive=writer)
+    finally:
+        path = writer.close() if writer else None
+    return count, path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Purge, archive and reclaim space")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    purge_parser = subparsers.add_parser("purge", help="Purge assessments not changed recently")
+    purge_parser.add_argument("--older-than", type=int, required=True, metavar="DAYS")
+    purge_parser.add_argument("--client", type=int, help="Only purge this client's assessments")
+    purge_parser.add_argument("--no-archive", action="store_true", help="Delete without writing an archive")
+    client_parser = subparsers.add_parser("purge-client", help="Purge clients with all their assessments")
+    client_parser.add_argument("client_ids", nargs="+", type=int)
+    client_parser.add_argument("--no-archive", action="store_true", help="Delete without writing an archive")
+    subparsers.add_parser("reclaim", help="Release free pages to the filesystem")
+    subparsers.add_parser("stats", help="Show database sizes and free space")
+    args = parser.parse_args(argv)
+
+    if args.command == "purge":
+        count, path = purge_stale_assessments(args.older_than, args.client, archive=not args.no_archive)
+        print(f"Purged {count} assessments" + (f", archived to {path}" if path else ""))
+    elif args.command == "purge-client":
+        count, path = purge_clients(args.client_ids, archive=not args.no_archive)
+        print(f"Purged {count} clients" + (f", archived to {path}" if path else ""))
+    elif args.command == "reclaim":
+        print(f"Released {db.reclaim_space()} pages")
+    elif args.command == "stats":
+        for row in db.storage_stats():
+            print(f"{row['database']}\t{row['size_kb']} KB\t{row['free_kb']} KB free\t{row['cache_kb']} KB cache")
+
+
+if __name__ == "__main__":
+    main()
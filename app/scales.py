@@ -0,0 +1,126 @@
+"""
+Answer scales: finding the answer sets that questions repeat and sharing them.
+
+Questions written before scales existed each carry their own copy of their
+answers, and most banks repeat a few sets word for word. Run
+
+    python -m app.scales report      # the repeated sets and what merging them saves
+    python -m app.scales migrate     # replace each repeated set with one scale
+
+to deduplicate them. Every set of (score, answer) pairs that two or more
+questions have word for word becomes one scale, or joins an existing scale
+with the same answers. The questions then reference the scale and their own
+copies are deleted. Questions whose answers are their own keep them.
+
+Choices and history of assessments that resolve against the live catalog are
+moved to the scale's answer ids, in the main database and in every shard.
+Assessments pinned to a published questionnaire keep their answer ids, which
+their snapshot still resolves.
+"""
+
+import argparse
+
+from sqlalchemy import select
+
+from app import db
+from app.schema import answer_scales, answers
+
+
+def _question_answer_sets(conn):
+    """Each question's own answers as ({question_id: ((score, answer), ...)}, {question_id: [answer ids]})."""
+    sets, ids = {}, {}
+    rows = conn.execute(
+        select(answers.c.id, answers.c.question_id, answers.c.score, answers.c.answer)
+        .where(answers.c.question_id.is_not(None))
+        .order_by(answers.c.question_id, answers.c.score, answers.c.id)
+    ).mappings()
+    for row in rows:
+        sets.setdefault(row['question_id'], []).append((row['score'], row['answer']))
+        ids.setdefault(row['question_id'], []).append(row['id'])
+    return {question_id: tuple(answer_set) for question_id, answer_set in sets.items()}, ids
+
+
+def _scale_sets(conn):
+    """Existing scales keyed by their answer set, as {((score, answer), ...): (scale id, [answer ids])}."""
+    scales = {}
+    rows = conn.execute(
+        select(answers.c.id, answers.c.scale_id, answers.c.score, answers.c.answer)
+        .where(answers.c.scale_id.is_not(None))
+        .order_by(answers.c.scale_id, answers.c.score, answers.c.id)
+    ).mappings()
+    for row in rows:
+        entries = scales.setdefault(row['scale_id'], [])
+        entries.append((row['id'], row['score'], row['answer']))
+    return {
+        tuple((score, answer) for _, score, answer in entries): (scale_id, [answer_id for answer_id, _, _ in entries])
+        for scale_id, entries in scales.items()
+    }
+
+
+def repeated_sets(conn):
+    """Answer sets held by two or more questions, as {answer set: [question ids]}, most repeated first."""
+    sets, _ = _question_answer_sets(conn)
+    by_set = {}
+    for question_id, answer_set in sets.items():
+        by_set.setdefault(answer_set, []).append(question_id)
+    repeated = {answer_set: ids for answer_set, ids in by_set.items() if len(ids) > 1}
+    return dict(sorted(repeated.items(), key=lambda item: -len(item[1])))
+
+
+def _scale_name(taken):
+    """The first free default name; admins rename scales in the Admin Panel."""
+    number = 1
+    while f"Scale {number}" in taken:
+        number += 1
+    return f"Scale {number}"
+
+
+def _plan_migration(conn):
+    """The merges for db.apply_scale_migration(): one per repeated answer set, onto a matching or new scale."""
+    _, question_ids_by_answer = _question_answer_sets(conn)
+    existing = _scale_sets(conn)
+    taken = set(conn.execute(select(answer_scales.c.name)).scalars())
+    merges = []
+    for answer_set, question_ids in repeated_sets(conn).items():
+        merge = {
+            'answers': answer_set,
+            'question_answer_ids': {question_id: question_ids_by_answer[question_id] for question_id in question_ids},
+        }
+        if answer_set in existing:
+            merge['scale_id'], merge['scale_answer_ids'] = existing[answer_set]
+        else:
+            merge['name'] = _scale_name(taken)
+            taken.add(merge['name'])
+        merges.append(merge)
+    return merges
+
+
+def migrate_to_scales():
+    """
+    Replace every repeated answer set with a shared scale. Returns (scales
+    used, questions moved onto them, answer rows saved).
+    """
+    # Planned inside the migration's own transaction, so it sees the catalog it changes
+    return db.apply_scale_migration(_plan_migration)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Deduplicate repeated answer sets into shared scales")
+    parser.add_argument("command", choices=["migrate", "report"])
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        scales, moved, removed = migrate_to_scales()
+        print(f"Moved {moved} questions onto {scales} shared scales, removing {removed} duplicate answers.")
+    elif args.command == "report":
+        with db.get_engine().connect() as conn:
+            repeated = repeated_sets(conn)
+            total = len(conn.execute(select(answers.c.id)).all())
+        duplicates = sum(len(answer_set) * (len(ids) - 1) for answer_set, ids in repeated.items())
+        for answer_set, ids in repeated.items():
+            print(f"{len(ids)} questions\t{' | '.join(f'{score}: {answer}' for score, answer in answer_set)}")
+        print(f"{len(repeated)} repeated answer sets; merging them leaves {total - duplicates} of {total} answers.")
+
+
+if __name__ == "__main__":
+    main()
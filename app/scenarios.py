@@ -0,0 +1,116 @@
+"""
+What-if target scenarios over an assessment's results.
+
+A scenario replaces the stored "required" scores with targets. It can set one
+uniform target for every question, a target per category, a target per
+question, or any mix of these. The most specific setting wins, and questions
+a scenario does not mention keep their stored target. Any number of scenarios
+is evaluated at once as a scenarios x questions array against the stored
+actual scores. Nothing is written to the database.
+"""
+
+import numpy as np
+import pandas as pd
+
+BASELINE = "Stored targets"
+
+
+def scenario(name, uniform=None, categories=None, questions=None):
+    """
+    A scenario definition. uniform is a target for every question, categories
+    maps category names to targets and questions maps result row positions
+    (as in the results frame) to targets.
+    """
+    return {
+        'name': name,
+        'uniform': uniform,
+        'categories': dict(categories or {}),
+        'questions': dict(questions or {}),
+    }
+
+
+def _arrays(frame):
+    """Actual scores, stored targets, category codes, category names and per-question score limits."""
+    codes, names = pd.factorize(frame['category'], sort=True)
+    actual = frame['actual_score'].to_numpy(dtype=float)
+    desired = frame['desired_score'].to_numpy(dtype=float)
+    # Targets cannot go past the best answer a question offers
+    if 'max_score' in frame:
+        limit = frame['max_score'].fillna(np.inf).to_numpy(dtype=float)
+    else:
+        limit = np.full(len(frame), np.inf)
+    return actual, desired, codes, list(names), limit
+
+
+def target_matrix(frame, scenarios):
+    """Targets for each scenario (rows) and question (columns) of the results frame."""
+    _, desired, codes, names, limit = _arrays(frame)
+    category_codes = {name: code for code, name in enumerate(names)}
+    targets = np.tile(desired, (len(scenarios), 1))
+    for i, spec in enumerate(scenarios):
+        if spec['uniform'] is not None:
+            targets[i, :] = spec['uniform']
+        for category, target in spec['categories'].items():
+            if category in category_codes:
+                targets[i, codes == category_codes[category]] = target
+        for position, target in spec['questions'].items():
+            targets[i, position] = target
+    return np.minimum(targets, limit)
+
+
+def _summarise(index, actual, targets, codes, names):
+    """Totals and per-category gaps for a scenarios x questions array of targets."""
+    gaps = np.clip(targets - actual, 0, None)
+    # One-hot question -> category matrix turns the per-category sums into one product
+    membership = np.zeros((len(codes), len(names)))
+    membership[np.arange(len(codes)), codes] = 1
+    target_totals = targets.sum(axis=1)
+    gap_totals = gaps.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gap_percentage = np.where(target_totals > 0, gap_totals / target_totals * 100, 0.0)
+    summary = pd.DataFrame({
+        'target_score': target_totals,
+        'gap': gap_totals,
+        'gap_percentage': gap_percentage.round(1),
+        'questions_with_gap': (gaps > 0).sum(axis=1),
+    }, index=index)
+    category_gaps = pd.DataFrame(gaps @ membership, index=index, columns=names)
+    return summary, category_gaps
+
+
+def evaluate(frame, scenarios, include_baseline=True):
+    """
+    Evaluate scenarios against the results frame. Returns (summary, category
+    gaps): DataFrames indexed by scenario name, the first with total target,
+    gap, gap percentage and questions with a gap, the second with the gap per
+    category. The stored targets come first unless include_baseline is False.
+    """
+    if include_baseline:
+        scenarios = [scenario(BASELINE)] + list(scenarios)
+    actual, _, codes, names, _ = _arrays(frame)
+    index = pd.Index([spec['name'] for spec in scenarios], name='scenario')
+    return _summarise(index, actual, target_matrix(frame, scenarios), codes, names)
+
+
+def sweep(frame, levels, category=None):
+    """
+    Evaluate one uniform target per level, for every question or only those of
+    category (the rest keep their stored targets). Returns (summary, category
+    gaps) indexed by target level.
+    """
+    actual, desired, codes, names, limit = _arrays(frame)
+    levels = np.asarray(levels, dtype=float)
+    selected = np.ones(len(frame), dtype=bool) if category is None else (frame['category'] == category).to_numpy()
+    # Broadcast levels x questions without building one scenario per level
+    targets = np.where(selected, levels[:, None], desired)
+    targets = np.minimum(targets, limit)
+    return _summarise(pd.Index(levels, name='target_level'), actual, targets, codes, names)
+
+
+def max_scores(frame, questionnaire):
+    """Highest answer score available to each question of the results frame (None if it has no answers)."""
+    answers_by_question = questionnaire['answers_by_question']
+    return [
+        max((answer['score'] for answer in answers_by_question.get(question_id, [])), default=None)
+        for question_id in frame['question_id'].tolist()
+    ]
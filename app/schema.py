@@ -0,0 +1,222 @@
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, MetaData, Table, Text
+
+# Table definitions; app/db.py creates and upgrades the tables from these.
+# Ownership is expressed with ON DELETE CASCADE (enforced on the main SQLite
+# database, see app/db.py), so deleting a client, assessment or question
+# removes everything that belongs to it in one statement. Choices and their
+# history refer to questions and answers without a constraint: pinned
+# assessments resolve them from questionnaire snapshots, and shard files
+# cannot hold constraints into the attached catalog.
+metadata = MetaData()
+
+clients = Table(
+    "clients",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", Text, nullable=False),
+    sqlite_autoincrement=True,
+)
+
+# Named, reusable answer sets. A question that references a scale offers the
+# scale's answers unless it has answers of its own (a per-question override).
+answer_scales = Table(
+    "answer_scales",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", Text, nullable=False, unique=True),
+    sqlite_autoincrement=True,
+)
+
+questions = Table(
+    "questions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("csequence", Integer, nullable=False, server_default="0"),
+    Column("category", Text, nullable=False, server_default="General"),
+    Column("qtype", Text, nullable=False, server_default="org"),
+    Column("qsequence", Integer, nullable=False, server_default="0"),
+    Column("question", Text, nullable=False),
+    Column("scale_id", Integer, ForeignKey("answer_scales.id", ondelete="SET NULL")),
+    sqlite_autoincrement=True,
+)
+
+# An answer belongs to one question (question_id set) or to one scale (scale_id set)
+answers = Table(
+    "answers",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("question_id", Integer, ForeignKey("questions.id", ondelete="CASCADE")),
+    Column("score", Integer),
+    Column("answer", Text),
+    Column("scale_id", Integer, ForeignKey("answer_scales.id", ondelete="CASCADE")),
+    sqlite_autoincrement=True,
+)
+
+Index("idx_answers_question", answers.c.question_id)
+Index("idx_answers_scale", answers.c.scale_id)
+
+# Immutable published snapshots of the questions and answers for one qtype.
+# Rows are only ever inserted; the snapshot is JSON (see app/db.py publish_questionnaire).
+questionnaire_versions = Table(
+    "questionnaire_versions",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("qtype", Text, nullable=False),
+    Column("published_at", Float, nullable=False),
+    Column("snapshot", Text, nullable=False),
+    sqlite_autoincrement=True,
+)
+
+Index("idx_questionnaire_versions_qtype", questionnaire_versions.c.qtype, questionnaire_versions.c.id)
+
+assessments = Table(
+    "assessments",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("client_id", Integer, ForeignKey("clients.id", ondelete="CASCADE")),
+    Column("qtype", Text, server_default="org"),
+    Column("name", Text, nullable=False),
+    # Published questionnaire the assessment was taken against; NULL for
+    # assessments created before versioning, which resolve against the live catalog
+    Column("questionnaire_version_id", Integer, ForeignKey("questionnaire_versions.id")),
+    # Epoch seconds; NULL for assessments created before it was recorded
+    Column("created_at", Integer),
+    # "open" while answers are being given, "completed" once finalized (see result_documents)
+    Column("status", Text, nullable=False, server_default="open"),
+    Column("completed_at", Integer),
+    sqlite_autoincrement=True,
+)
+
+# Per-client assessment lists, and the cascade when a client is deleted
+Index("idx_assessments_client", assessments.c.client_id)
+
+choices = Table(
+    "choices",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("assessment_id", Integer, ForeignKey("assessments.id", ondelete="CASCADE")),
+    Column("question_id", Integer),
+    Column("answer_id_desired", Integer),
+    Column("answer_id_actual", Integer),
+    sqlite_autoincrement=True,
+)
+
+# Upserts in save_choice conflict on this index
+Index("idx_choices", choices.c.assessment_id, choices.c.question_id, unique=True)
+
+# Catalog-side directory of assessment ids to client shards, used only when
+# per-client sharding is enabled. Ids are allocated here so they stay unique
+# across shards.
+assessment_shards = Table(
+    "assessment_shards",
+    metadata,
+    Column("assessment_id", Integer, primary_key=True),
+    Column("client_id", Integer, ForeignKey("clients.id", ondelete="CASCADE"), nullable=False, index=True),
+    sqlite_autoincrement=True,
+)
+
+# Append-only log of every change to a choice, written in the same transaction
+# as the upsert in save_choice. Ids and timestamps (epoch seconds) are plain
+# integers so each event is a handful of varint-encoded bytes.
+choice_events = Table(
+    "choice_events",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("assessment_id", Integer, ForeignKey("assessments.id", ondelete="CASCADE"), nullable=False),
+    Column("question_id", Integer, nullable=False),
+    Column("answer_id_desired", Integer),
+    Column("answer_id_actual", Integer),
+    Column("recorded_at", Integer, nullable=False),
+)
+
+Index("idx_choice_events_assessment", choice_events.c.assessment_id, choice_events.c.question_id, choice_events.c.id)
+# Incremental trend refreshes read an assessment's events after a given id, in id order
+Index("idx_choice_events_assessment_seq", choice_events.c.assessment_id, choice_events.c.id)
+
+# Per-assessment replay state for the trend series: the last event folded in and
+# the scores per question at that point (JSON {question_id: [category, actual, desired]})
+trend_checkpoints = Table(
+    "trend_checkpoints",
+    metadata,
+    Column("assessment_id", Integer, ForeignKey("assessments.id", ondelete="CASCADE"), primary_key=True),
+    Column("last_event_id", Integer, nullable=False),
+    Column("state", Text, nullable=False),
+)
+
+# Materialised per-category score totals at the end of each time bucket
+category_trends = Table(
+    "category_trends",
+    metadata,
+    Column("assessment_id", Integer, ForeignKey("assessments.id", ondelete="CASCADE"), primary_key=True),
+    Column("bucket_start", Integer, primary_key=True),
+    Column("category", Text, primary_key=True),
+    Column("actual_score", Integer, nullable=False),
+    Column("desired_score", Integer, nullable=False),
+    Column("gap", Integer, nullable=False),
+)
+
+# The finalized results of a completed assessment as one compact JSON document
+# (see app/finalize.py), built from its choice events up to last_event_id.
+# Deleted when a changed answer reopens the assessment.
+result_documents = Table(
+    "result_documents",
+    metadata,
+    Column("assessment_id", Integer, ForeignKey("assessments.id", ondelete="CASCADE"), primary_key=True),
+    Column("last_event_id", Integer, nullable=False),
+    Column("completed_at", Integer, nullable=False),
+    Column("document", Text, nullable=False),
+)
+
+# Tables that live in a client's shard file rather than the catalog
+SHARD_TABLES = [assessments, choices, choice_events, trend_checkpoints, category_trends, result_documents]
+
+# Change tracking for in-process caches (see _ChangeTracker in app/db.py).
+# Every write transaction takes the next value of its file's change sequence
+# (the row named "*") and stamps it on each table it wrote and on each
+# assessment whose rows it wrote. A process that has seen sequence N finds
+# everything changed since with "version > N".
+table_versions = Table(
+    "table_versions",
+    metadata,
+    Column("name", Text, primary_key=True),
+    Column("version", Integer, nullable=False, server_default="0"),
+)
+
+assessment_versions = Table(
+    "assessment_versions",
+    metadata,
+    Column("assessment_id", Integer, primary_key=True),
+    Column("version", Integer, nullable=False),
+)
+
+Index("idx_assessment_versions_version", assessment_versions.c.version)
+
+# Change tracking tables, which every database file (catalog and shards) has
+CHANGE_TABLES = [table_versions, assessment_versions]
+
+# Persistent background jobs (see app/job_queue.py). Timestamps are Unix epoch seconds.
+jobs = Table(
+    "jobs",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("kind", Text, nullable=False),
+    Column("params", Text, nullable=False, server_default="{}"),
+    Column("status", Text, nullable=False, server_default="queued"),
+    Column("progress", Float, nullable=False, server_default="0"),
+    Column("message", Text),
+    Column("result", Text),
+    Column("error", Text),
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("max_attempts", Integer, nullable=False, server_default="3"),
+    Column("cancel_requested", Integer, nullable=False, server_default="0"),
+    Column("worker", Text),
+    Column("created_at", Float, nullable=False),
+    Column("started_at", Float),
+    Column("heartbeat_at", Float),
+    Column("finished_at", Float),
+    sqlite_autoincrement=True,
+)
+
+Index("idx_jobs_status", jobs.c.status, jobs.c.id)
+# Each idle worker poll looks up the latest job of every recurring kind
+Index("idx_jobs_kind", jobs.c.kind, jobs.c.created_at)
@@ -0,0 +1,313 @@
+"""
+Multi-process serving: several Streamlit server processes behind one port.
+
+A single `streamlit run` process serves every session from one interpreter,
+so all assessors share one GIL. This starts RUDI_SERVE_WORKERS Streamlit
+processes (one per core by default) on consecutive local ports from
+RUDI_SERVE_WORKER_PORT. It puts a small asyncio reverse proxy in front of them
+on RUDI_SERVE_PORT.
+
+The proxy is sticky. A browser is assigned a worker on its first request and
+keeps it through a cookie, so its websocket session, uploads and media all
+reach the process that holds its session state. Assignments go to the worker
+with the fewest open connections. A browser whose worker is down is moved to
+another one, and Streamlit reconnects it with a new session.
+
+All workers use the same database files and directories. Relative paths in
+the RUDI_* settings are resolved once here, and the processes keep their
+caches coherent through the change counters in app/db.py. Background job
+workers, if RUDI_JOB_WORKERS enables them, run in the first process only. Every
+RUDI_SERVE_HEALTH_INTERVAL seconds each worker's /_stcore/health endpoint is
+checked. A worker that has exited, or that fails RUDI_SERVE_HEALTH_FAILURES
+checks in a row, is restarted.
+
+    python -m app.serve                      # one worker per core on port 8501
+    python -m app.serve --workers 4 --port 8080
+    python -m app.serve -- --server.maxUploadSize 50    # extra streamlit options
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from sqlalchemy import make_url
+
+APP_SCRIPT = Path(__file__).parents[1] / "streamlit_app.py"
+
+# Streamlit processes to run (default: one per core)
+SERVE_WORKERS = int(os.environ.get("RUDI_SERVE_WORKERS", "0")) or os.cpu_count() or 1
+# Public address of the proxy
+SERVE_HOST = os.environ.get("RUDI_SERVE_HOST", "0.0.0.0")
+SERVE_PORT = int(os.environ.get("RUDI_SERVE_PORT", "8501"))
+# Worker i listens on 127.0.0.1 at this port + i
+SERVE_WORKER_PORT = int(os.environ.get("RUDI_SERVE_WORKER_PORT", "8600"))
+# Seconds between health checks, and failed checks in a row before a restart
+SERVE_HEALTH_INTERVAL = float(os.environ.get("RUDI_SERVE_HEALTH_INTERVAL", "5"))
+SERVE_HEALTH_FAILURES = int(os.environ.get("RUDI_SERVE_HEALTH_FAILURES", "3"))
+# Seconds a new worker has to pass its first health check
+SERVE_STARTUP_TIMEOUT = float(os.environ.get("RUDI_SERVE_STARTUP_TIMEOUT", "60"))
+
+STICKY_COOKIE = "rudi_worker"
+_HEAD_LIMIT = 64 * 1024
+_BUFFER = 64 * 1024
+
+# Path settings every worker must agree on, with their defaults relative to the repository
+_SHARED_DIRS = {
+    "RUDI_TEMPLATE_DB": None,
+    "RUDI_SHARD_DIR": None,
+    "RUDI_ANALYTICS_DIR": "analytics",
+    "RUDI_EXPORT_DIR": "exports",
+    "RUDI_REPORT_DIR": "reports",
+    "RUDI_BACKUP_DIR": "backups",
+    "RUDI_ARCHIVE_DIR": "archive",
+}
+
+
+def shared_environment(environ=None):
+    """
+    The environment for worker processes: the current one with the database URL,
+    the template and every data directory made absolute, so all workers share
+    the same files.
+    """
+    env = dict(os.environ if environ is None else environ)
+    repo = APP_SCRIPT.parent
+    url = make_url(env.get("RUDI_DATABASE_URL", f"sqlite:///{repo / 'data.db'}"))
+    if url.get_backend_name() == "sqlite" and (url.database in (None, "", ":memory:")
+                                               or url.query.get("mode") == "memory"):
+        raise SystemExit("An in-memory database cannot be shared between worker processes; use a file.")
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:" \
+            and not url.database.startswith("file:"):
+        url = url.set(database=str(Path(url.database).resolve()))
+    env["RUDI_DATABASE_URL"] = url.render_as_string(hide_password=False)
+    for name, default in _SHARED_DIRS.items():
+        value = env.get(name) or default
+        if value:
+            env[name] = str((repo / value).resolve() if not Path(value).is_absolute() else Path(value))
+    return env
+
+
+class Worker:
+    """One Streamlit server process and what the proxy knows about it."""
+
+    def __init__(self, number, port):
+        self.number = number
+        self.port = port
+        self.process = None
+        self.started_at = 0.0
+        self.healthy = False
+        self.failures = 0
+        self.restarts = 0
+        self.connections = 0
+
+    def start(self, env, streamlit_args):
+        # Only the first process runs background job workers (RUDI_JOB_WORKERS), however many there are
+        if self.number > 0:
+            env = {**env, "RUDI_JOB_WORKERS": "0"}
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "streamlit", "run", str(APP_SCRIPT),
+            "--server.address", "127.0.0.1",
+            "--server.port", str(self.port),
+            "--server.headless", "true",
+            "--server.fileWatcherType", "none",
+            "--browser.gatherUsageStats", "false",
+            *streamlit_args,
+        ], env=env)
+        self.started_at = time.monotonic()
+        self.healthy = False
+        self.failures = 0
+
+    def stop(self, timeout=10):
+        if self.process is None or self.process.poll() is not None:
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+async def _check_health(port, timeout=2.0):
+    """Whether the Streamlit server on port answers its health endpoint with 200."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        writer.write(b"GET /_stcore/health HTTP/1.0\r\nHost: 127.0.0.1\r\n\r\n")
+        await writer.drain()
+        status_line = await asyncio.wait_for(reader.readline(), timeout)
+        return status_line.split(b" ")[1:2] == [b"200"]
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+
+def _sticky_worker(head):
+    """The worker number in a request head's sticky cookie, or None."""
+    for line in head.split(b"\r\n")[1:]:
+        name, _, value = line.partition(b":")
+        if name.strip().lower() != b"cookie":
+            continue
+        for cookie in value.decode("latin-1").split(";"):
+            key, _, number = cookie.strip().partition("=")
+            if key == STICKY_COOKIE and number.isdigit():
+                return int(number)
+    return None
+
+
+async def _pipe(reader, writer):
+    """Copy bytes from reader to writer until either side closes."""
+    try:
+        while data := await reader.read(_BUFFER):
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        writer.close()
+
+
+class Supervisor:
+    """Runs the worker processes, restarts failed ones and proxies connections to them."""
+
+    def __init__(self, workers, worker_port, streamlit_args=()):
+        self.workers = [Worker(i, worker_port + i) for i in range(workers)]
+        self.streamlit_args = list(streamlit_args)
+        self.env = shared_environment()
+
+    def start_workers(self):
+        for worker in self.workers:
+            worker.start(self.env, self.streamlit_args)
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def _restart(self, worker, reason):
+        print(f"Worker {worker.number} (port {worker.port}) {reason}; restarting", file=sys.stderr)
+        worker.stop(timeout=5)
+        worker.restarts += 1
+        worker.start(self.env, self.streamlit_args)
+
+    async def check_workers(self):
+        """One round of health checks, restarting workers that exited or stopped answering."""
+        results = await asyncio.gather(*(_check_health(w.port) for w in self.workers))
+        for worker, ok in zip(self.workers, results):
+            if worker.process.poll() is not None:
+                worker.healthy = False
+                self._restart(worker, f"exited with status {worker.process.returncode}")
+            elif ok:
+                worker.healthy, worker.failures = True, 0
+            elif worker.healthy or time.monotonic() - worker.started_at > SERVE_STARTUP_TIMEOUT:
+                worker.failures += 1
+                if worker.failures >= SERVE_HEALTH_FAILURES:
+                    worker.healthy = False
+                    self._restart(worker, f"failed {worker.failures} health checks")
+
+    async def health_loop(self, interval):
+        while True:
+            await self.check_workers()
+            await asyncio.sleep(interval)
+
+    def pick(self, sticky):
+        """The worker for a request: its sticky one while healthy, else the least busy healthy one."""
+        healthy = [w for w in self.workers if w.healthy]
+        if sticky is not None and sticky < len(self.workers) and self.workers[sticky].healthy:
+            return self.workers[sticky]
+        if not healthy:
+            return None
+        return min(healthy, key=lambda w: w.connections)
+
+    async def handle(self, client_reader, client_writer):
+        """Proxy one client connection to a worker, setting the sticky cookie when it is (re)assigned."""
+        try:
+            head = await client_reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            client_writer.close()
+            return
+        sticky = _sticky_worker(head)
+        worker = self.pick(sticky)
+        if worker is None:
+            client_writer.write(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\nRetry-After: 2\r\n"
+                                b"Connection: close\r\n\r\n")
+            await client_writer.drain()
+            client_writer.close()
+            return
+        try:
+            backend_reader, backend_writer = await asyncio.open_connection("127.0.0.1", worker.port,
+                                                                           limit=_HEAD_LIMIT)
+        except OSError:
+            worker.healthy = False
+            client_writer.close()
+            return
+        worker.connections += 1
+        try:
+            backend_writer.write(head)
+            await backend_writer.drain()
+            if sticky != worker.number:
+                # Add the cookie to the first response on this connection
+                response_head = await backend_reader.readuntil(b"\r\n\r\n")
+                cookie = f"Set-Cookie: {STICKY_COOKIE}={worker.number}; Path=/; HttpOnly; SameSite=Lax\r\n"
+                client_writer.write(response_head[:-2] + cookie.encode("latin-1") + b"\r\n")
+            await asyncio.gather(_pipe(client_reader, backend_writer), _pipe(backend_reader, client_writer))
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            backend_writer.close()
+            client_writer.close()
+        finally:
+            worker.connections -= 1
+
+    async def serve(self, host, port, health_interval):
+        server = await asyncio.start_server(self.handle, host, port, limit=_HEAD_LIMIT)
+        print(f"Serving on http://{host}:{port} with {len(self.workers)} workers "
+              f"(ports {self.workers[0].port}-{self.workers[-1].port})")
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.health_loop(health_interval))
+
+
+def _interrupt(signum, frame):
+    """Stop on SIGTERM the same way as on Ctrl-C, so the workers are stopped too."""
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the app from several Streamlit processes behind a sticky proxy",
+        epilog="Arguments after -- are passed to every `streamlit run`.",
+    )
+    parser.add_argument("--workers", type=int, default=SERVE_WORKERS, help="Streamlit processes to run")
+    parser.add_argument("--host", default=SERVE_HOST, help="Address the proxy listens on")
+    parser.add_argument("--port", type=int, default=SERVE_PORT, help="Port the proxy listens on")
+    parser.add_argument("--worker-port", type=int, default=SERVE_WORKER_PORT, help="Port of the first worker")
+    parser.add_argument("--health-interval", type=float, default=SERVE_HEALTH_INTERVAL,
+                        help="Seconds between health checks")
+    parser.add_argument("streamlit_args", nargs="*", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    supervisor = Supervisor(args.workers, args.worker_port, args.streamlit_args)
+    # Create or upgrade the schema once, before the workers race to open it
+    os.environ.update(supervisor.env)
+    from app import db
+    db.get_engine()
+    db.dispose_engines()
+
+    signal.signal(signal.SIGTERM, _interrupt)
+    supervisor.start_workers()
+    try:
+        asyncio.run(supervisor.serve(args.host, args.port, args.health_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # A second SIGTERM must not cut the shutdown short
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        supervisor.stop_workers()
+
+
+if __name__ == "__main__":
+    main()
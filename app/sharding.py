@@ -0,0 +1,100 @@
+"""
+Tools for per-client sharding: cross-shard fan-out and migrating an existing
+single-file database into shards.
+
+Enable sharding by setting RUDI_SHARD_DIR, then run
+
+    python -m app.sharding migrate
+
+once to move existing assessments and choices out of the main database.
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import select
+
+from app import analytics_store, db
+from app.schema import assessments
+
+
+def _init_worker():
+    """Pooled connections must not be shared with the parent after a fork."""
+    db.dispose_engines()
+
+
+def map_shards(func, client_ids=None, max_workers=None):
+    """
+    Call func(client_id) for every shard in a process pool and merge the
+    returned lists in client order. func must be a picklable module-level function.
+    """
+    if client_ids is None:
+        client_ids = db.shard_client_ids()
+    if len(client_ids) <= 1:
+        return [row for client_id in client_ids for row in func(client_id)]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(client_ids))
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+        return [row for rows in executor.map(func, client_ids) for row in rows]
+
+
+def _client_scores(client_id):
+    """Per-assessment score totals for one client from the analytics store, as plain dicts for pickling."""
+    with db.read_snapshot():
+        client_assessments = db.fetch_assessments(client_id)
+    # Assessments without saved answers are not in the store and total zero
+    totals = analytics_store.load_store().totals().reindex([a['id'] for a in client_assessments], fill_value=0)
+    return [
+        {
+            'client_id': client_id,
+            'client_name': assessment['client_name'],
+            'assessment_id': assessment['id'],
+            'assessment_name': assessment['name'],
+            'qtype': assessment['qtype'],
+            'actual_score': int(scores.actual_score),
+            'desired_score': int(scores.desired_score),
+            'gap': int(scores.gap),
+        }
+        for assessment, scores in zip(client_assessments, totals.itertuples())
+    ]
+
+
+def fetch_portfolio_scores(client_ids=None):
+    """
+    Fetch score totals for every assessment of every client (or of client_ids),
+    fanning out over shards. Each process reads the memory-mapped analytics
+    store, which is brought up to date once beforehand.
+    """
+    analytics_store.refresh_store()
+    if not db.sharding_enabled():
+        if client_ids is None:
+            client_ids = [client['id'] for client in db.fetch_all_clients()]
+        return [row for client_id in client_ids for row in _client_scores(client_id)]
+    return map_shards(_client_scores, client_ids)
+
+
+def migrate_to_shards():
+    """Move assessments and their choices and history from the main database into per-client shards."""
+    if not db.sharding_enabled():
+        raise RuntimeError("Set RUDI_SHARD_DIR before migrating to shards.")
+    with db.get_engine().connect() as conn:
+        legacy = conn.execute(select(assessments.c.id)).scalars().all()
+    return sum(db.move_assessment_to_shard(assessment_id) for assessment_id in legacy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-client shard maintenance")
+    parser.add_argument("command", choices=["migrate", "report"])
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        moved = migrate_to_shards()
+        print(f"Moved {moved} assessments into shards under {db.SHARD_DIR}.")
+    elif args.command == "report":
+        for row in fetch_portfolio_scores():
+            print(f"{row['client_name']}\t{row['assessment_name']}\t"
+                  f"actual={row['actual_score']}\trequired={row['desired_score']}\tgap={row['gap']}")
+
+
+if __name__ == "__main__":
+    main()
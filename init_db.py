@@ -1,83 +1,69 @@
+"""
+Create or upgrade the database that RUDI_DATABASE_URL points at (data.db next
+to the app by default) and add sample data to a new one. The tables come from
+app/schema.py through app/db.py, the same path the app itself opens.
+
+    python init_db.py
+    python init_db.py --template catalog.db    # write a template for RUDI_TEMPLATE_DB
+
+A template is a copy of the database with its catalog (clients, questions,
+answer scales, answers and questionnaire versions) and none of its
+assessments. With RUDI_TEMPLATE_DB set, a new database (a file or
+db.memory_database_url()) starts as a copy of it, which takes milliseconds
+instead of creating every table and inserting the catalog row by row.
+"""
+
+import argparse
 import sqlite3
+from pathlib import Path
+
+from sqlalchemy import func, select
+
+from app import db
+from app.schema import (
+    answer_scales,
+    answers,
+    clients,
+    metadata,
+    questionnaire_versions,
+    questions,
+    table_versions,
+)
+
+# Tables a template keeps; every other table is emptied
+CATALOG_TABLES = {clients, answer_scales, questions, answers, questionnaire_versions}
 
 
 def init_database():
     """Initialize the database with schema and sample data if it doesn't exist."""
-    # Check if tables already exist
-    conn = sqlite3.connect('data.db')
-    cursor = conn.cursor()
-    
-    # Get list of tables
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables = [row[0] for row in cursor.fetchall()]
-    
-    # Create tables if they don't exist
-    if 'clients' not in tables:
-        print("Creating clients table...")
-        cursor.execute('''
-        CREATE TABLE `clients` (
-            `id` INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, 
-            `name` TEXT NOT NULL
-        )
-        ''')
-    
-    if 'questions' not in tables:
-        print("Creating questions table...")
-        cursor.execute('''
-        CREATE TABLE "questions" (
-            `id` INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, 
-            `csequence` INTEGER NOT NULL DEFAULT 0, 
-            `category` TEXT NOT NULL DEFAULT 'General', 
-            `qtype` TEXT NOT NULL DEFAULT 'org', 
-            `qsequence` INTEGER NOT NULL DEFAULT 0, 
-            `question` TEXT NOT NULL
+    # Creates missing tables and upgrades older files (or clones RUDI_TEMPLATE_DB)
+    engine = db.get_engine()
+    with engine.connect() as conn:
+        is_empty = not any(
+            conn.execute(select(func.count()).select_from(table)).scalar() for table in (clients, questions)
         )
-        ''')
-    
-    if 'answers' not in tables:
-        print("Creating answers table...")
-        cursor.execute('''
-        CREATE TABLE `answers` (
-            `id` INTEGER PRIMARY KEY AUTOINCREMENT, 
-            `question_id` INTEGER REFERENCES `questions`(`id`), 
-            `score` INTEGER, 
-            `answer` TEXT
-        )
-        ''')
-    
-    if 'assessments' not in tables:
-        print("Creating assessments table...")
-        cursor.execute('''
-        CREATE TABLE `assessments` (
-            `id` INTEGER PRIMARY KEY AUTOINCREMENT, 
-            `client_id` INTEGER REFERENCES `clients`(`id`), 
-            `qtype` TEXT DEFAULT 'org', 
-            `name` TEXT NOT NULL
-        )
-        ''')
-    
-    if 'choices' not in tables:
-        print("Creating choices table...")
-        cursor.execute('''
-        CREATE TABLE "choices" (
-            `id` INTEGER PRIMARY KEY AUTOINCREMENT, 
-            `assessment_id` INTEGER REFERENCES `assessments`(`id`),
-            `answer_id_desired` INTEGER REFERENCES `answers`(`id`), 
-            `answer_id_actual` INTEGER REFERENCES `answers`(`id`)
-        )
-        ''')
-    
-    # Add sample data if the database is empty
-    cursor.execute("SELECT COUNT(*) FROM clients")
-    client_count = cursor.fetchone()[0]
-    
-    if client_count == 0:
+
+    if is_empty:
         print("Adding sample data...")
-        
+
         # Add sample clients
-        cursor.execute("INSERT INTO clients (name) VALUES ('Sample Organization')")
-        cursor.execute("INSERT INTO clients (name) VALUES ('Test Company')")
-        
+        db.add_client('Sample Organization')
+        db.add_client('Test Company')
+
+        # Add one shared answer scale per question type
+        org_scale_id = db.add_answer_scale('Organization maturity', [
+            (1, 'Poor - Significant improvement needed'),
+            (2, 'Fair - Some elements in place but gaps exist'),
+            (3, 'Good - Most elements in place, minor improvements needed'),
+            (4, 'Excellent - Fully developed and effective')
+        ])
+        action_scale_id = db.add_answer_scale('Action readiness', [
+            (1, 'Not addressed - Major concerns'),
+            (2, 'Partially addressed - Some concerns remain'),
+            (3, 'Mostly addressed - Minor concerns'),
+            (4, 'Fully addressed - No concerns')
+        ])
+
         # Add sample questions for org type
         org_questions = [
             (1, 'Leadership', 'org', 1, 'How would you rate the organization\'s leadership clarity?'),
@@ -87,28 +73,10 @@ def init_database():
             (3, 'Operations', 'org', 1, 'How efficient are the organization\'s operational processes?'),
             (3, 'Operations', 'org', 2, 'Are there documented procedures for key operations?')
         ]
-        
-        for q in org_questions:
-            cursor.execute(
-                "INSERT INTO questions (csequence, category, qtype, qsequence, question) VALUES (?, ?, ?, ?, ?)",
-                q
-            )
-            question_id = cursor.lastrowid
-            
-            # Add sample answers for each question
-            answers = [
-                (question_id, 1, 'Poor - Significant improvement needed'),
-                (question_id, 2, 'Fair - Some elements in place but gaps exist'),
-                (question_id, 3, 'Good - Most elements in place, minor improvements needed'),
-                (question_id, 4, 'Excellent - Fully developed and effective')
-            ]
-            
-            for a in answers:
-                cursor.execute(
-                    "INSERT INTO answers (question_id, score, answer) VALUES (?, ?, ?)",
-                    a
-                )
-        
+
+        for csequence, category, qtype, qsequence, question in org_questions:
+            db.add_question(category, qtype, qsequence, csequence, question, scale_id=org_scale_id)
+
         # Add sample questions for action type
         action_questions = [
             (1, 'Risk', 'action', 1, 'What is the level of risk associated with this action?'),
@@ -118,31 +86,50 @@ def init_database():
             (3, 'Timeline', 'action', 1, 'Is the timeline realistic for implementation?'),
             (3, 'Timeline', 'action', 2, 'Are there clear milestones and checkpoints?')
         ]
-        
-        for q in action_questions:
-            cursor.execute(
-                "INSERT INTO questions (csequence, category, qtype, qsequence, question) VALUES (?, ?, ?, ?, ?)",
-                q
-            )
-            question_id = cursor.lastrowid
-            
-            # Add sample answers for each question
-            answers = [
-                (question_id, 1, 'Not addressed - Major concerns'),
-                (question_id, 2, 'Partially addressed - Some concerns remain'),
-                (question_id, 3, 'Mostly addressed - Minor concerns'),
-                (question_id, 4, 'Fully addressed - No concerns')
-            ]
-            
-            for a in answers:
-                cursor.execute(
-                    "INSERT INTO answers (question_id, score, answer) VALUES (?, ?, ?)",
-                    a
-                )
-    
-    conn.commit()
-    conn.close()
+
+        for csequence, category, qtype, qsequence, question in action_questions:
+            db.add_question(category, qtype, qsequence, csequence, question, scale_id=action_scale_id)
+
     print("Database initialization complete.")
 
-if __name__ == "__main__":
+
+def build_template(path):
+    """
+    Write a template database to path: the configured database, initialized
+    and upgraded, with only its catalog tables kept. Returns the path.
+    """
+    path = Path(path)
     init_database()
+    path.unlink(missing_ok=True)
+    with db.get_engine().connect() as conn:
+        conn.exec_driver_sql("VACUUM INTO ?", (str(path),))
+    # A plain connection: the copy is not the configured database
+    conn = sqlite3.connect(path)
+    try:
+        with conn:
+            emptied = [table.name for table in reversed(metadata.sorted_tables)
+                       if table not in CATALOG_TABLES and table is not table_versions]
+            for name in emptied:
+                conn.execute(f"DELETE FROM {name}")
+            conn.executemany("DELETE FROM sqlite_sequence WHERE name = ?", [(name,) for name in emptied])
+            # A new database starts its change counters from zero
+            conn.execute("UPDATE table_versions SET version = 0")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create, upgrade and seed the configured database")
+    parser.add_argument("--template", type=Path, metavar="PATH",
+                        help="Also write a catalog-only copy to PATH for RUDI_TEMPLATE_DB")
+    args = parser.parse_args(argv)
+
+    if args.template:
+        print(f"Template written to {build_template(args.template)}")
+    else:
+        init_database()
+
+if __name__ == "__main__":
+    main()
@@ -3,20 +3,36 @@
 """
 Runner script for the Ready Rudi Assessment Tool.
 This script initializes the database and runs the Streamlit application.
+With --workers N it runs N Streamlit processes behind the sticky proxy in
+app/serve.py instead of a single one. Background jobs (report runs, exports,
+analytics refreshes) only run with --job-workers N or RUDI_JOB_WORKERS set.
 """
 
+import argparse
+import os
 import subprocess
 import sys
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Initialize the database and run the app")
+    parser.add_argument("--workers", type=int, help="Serve from this many Streamlit processes (see app/serve.py)")
+    parser.add_argument("--job-workers", type=int,
+                        help="Run background jobs on this many threads (sets RUDI_JOB_WORKERS; off by default)")
+    args = parser.parse_args()
+    if args.job_workers is not None:
+        os.environ["RUDI_JOB_WORKERS"] = str(args.job_workers)
+
     # Initialize the database
     print("Initializing database...")
     subprocess.run([sys.executable, "init_db.py"], check=True)
     
     # Run the Streamlit app
     print("Launching Streamlit app...")
-    subprocess.run([sys.executable, "-m", "streamlit", "run", "streamlit_app.py"], check=True)
+    if args.workers:
+        subprocess.run([sys.executable, "-m", "app.serve", "--workers", str(args.workers)], check=True)
+    else:
+        subprocess.run([sys.executable, "-m", "streamlit", "run", "streamlit_app.py"], check=True)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,43 @@
+import os
+import unittest
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:admin_grids?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import db  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class AnswerGridEditTest(unittest.TestCase):
+    """Editing a loaded row in the Manage Answers and Answer Scales grids."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def test_edit_question_answer(self):
+        question_id = db.fetch_all_questions()[0]['id']
+        db.add_answer(question_id, 1, "Own answer")
+        old = dict(db.fetch_answers_by_question(question_id)[0])
+        db.apply_answer_changes([], [(old, {'question_id': question_id, 'score': 2, 'answer': "Edited"})], [])
+        edited = dict(db.fetch_answers_by_question(question_id)[0])
+        self.assertEqual((edited['score'], edited['answer'], edited['scale_id']), (2, "Edited", None))
+
+    def test_edit_scale_answer(self):
+        old = dict(db.fetch_scale_answers()[0])
+        db.apply_answer_changes([], [(old, {'scale_id': old['scale_id'], 'score': 9, 'answer': "Edited"})], [])
+        edited = next(dict(a) for a in db.fetch_scale_answers() if a['id'] == old['id'])
+        self.assertEqual((edited['score'], edited['answer'], edited['question_id']), (9, "Edited", None))
+
+    def test_stale_edit_is_rejected(self):
+        old = dict(db.fetch_scale_answers()[-1])
+        db.apply_answer_changes([], [(old, {'answer': "First"})], [])
+        with self.assertRaises(ValueError):
+            db.apply_answer_changes([], [(old, {'answer': "Second"})], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
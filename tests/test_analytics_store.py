@@ -0,0 +1,97 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:analytics_store?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import analytics_store, db  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class AnalyticsStoreTest(unittest.TestCase):
+    """Incremental refreshes of the store and the generations they write."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        for patch in (mock.patch.object(analytics_store, "ANALYTICS_DIR", self.dir),
+                      mock.patch.object(analytics_store, "_loaded", None)):
+            patch.start()
+            self.addCleanup(patch.stop)
+        client_id = db.add_client(f"Store {self.id()}")
+        self.assessment_ids = [db.create_assessment(client_id, 'org', f"Store {i}") for i in range(2)]
+        questionnaire = db.fetch_assessment_questionnaire(self.assessment_ids[0], 'org')
+        self.question_ids = [q['id'] for q in questionnaire['questions']][-2:]
+        self.answers = questionnaire['answers_by_question']
+        for assessment_id in self.assessment_ids:
+            for question_id in self.question_ids:
+                self.save(assessment_id, question_id, 3, 0)
+
+    def save(self, assessment_id, question_id, desired, actual):
+        answers = self.answers[question_id]
+        db.save_choice(assessment_id, question_id, answers[desired]['id'], answers[actual]['id'])
+
+    def totals(self, assessment_id):
+        return analytics_store.load_store().totals([assessment_id]).loc[assessment_id].to_dict()
+
+    def expected(self, pairs):
+        """Totals for (question_id, desired, actual) answer indexes."""
+        actual = sum(self.answers[q][a]['score'] for q, _, a in pairs)
+        desired = sum(self.answers[q][d]['score'] for q, d, _ in pairs)
+        gap = sum(max(self.answers[q][d]['score'] - self.answers[q][a]['score'], 0) for q, d, a in pairs)
+        return {'actual_score': actual, 'desired_score': desired, 'gap': gap, 'questions': len(pairs)}
+
+    def test_first_refresh_stores_every_assessment(self):
+        result = analytics_store.refresh_store()
+        self.assertEqual(result['generation'], "gen_000001")
+        self.assertEqual((self.dir / "CURRENT").read_text(), "gen_000001")
+        for assessment_id in self.assessment_ids:
+            self.assertEqual(self.totals(assessment_id), self.expected([(q, 3, 0) for q in self.question_ids]))
+
+    def test_unchanged_refresh_keeps_generation(self):
+        analytics_store.refresh_store()
+        result = analytics_store.refresh_store()
+        self.assertEqual((result['generation'], result['reloaded'], result['removed']), ("gen_000001", 0, 0))
+
+    def test_refresh_reloads_only_saved_assessments(self):
+        analytics_store.refresh_store()
+        changed, unchanged = self.assessment_ids
+        self.save(changed, self.question_ids[0], 3, 2)
+        result = analytics_store.refresh_store()
+        self.assertEqual((result['generation'], result['reloaded']), ("gen_000002", 1))
+        self.assertEqual(self.totals(changed),
+                         self.expected([(self.question_ids[0], 3, 2), (self.question_ids[1], 3, 0)]))
+        self.assertEqual(self.totals(unchanged), self.expected([(q, 3, 0) for q in self.question_ids]))
+
+    def test_deleted_assessment_is_removed(self):
+        analytics_store.refresh_store()
+        db.delete_assessment(self.assessment_ids[0])
+        result = analytics_store.refresh_store()
+        self.assertEqual(result['removed'], 1)
+        self.assertEqual(len(analytics_store.load_store().positions(self.assessment_ids)), 1)
+
+    def test_full_refresh_reloads_everything(self):
+        first = analytics_store.refresh_store()
+        result = analytics_store.refresh_store(full=True)
+        self.assertEqual(result['reloaded'], first['assessments'])
+
+    def test_only_the_previous_generation_is_kept(self):
+        for desired in (1, 2, 3):
+            self.save(self.assessment_ids[0], self.question_ids[0], desired, 0)
+            analytics_store.refresh_store()
+        self.assertEqual(sorted(path.name for path in self.dir.glob("gen_*")), ["gen_000002", "gen_000003"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import time
+import unittest
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:choice_history?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import db  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class ChoiceHistoryTest(unittest.TestCase):
+    """save_choice appends to the choice history only when an answer changes."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def setUp(self):
+        client_id = db.add_client(f"History {self.id()}")
+        self.assessment_id = db.create_assessment(client_id, 'org', "History")
+        questionnaire = db.fetch_assessment_questionnaire(self.assessment_id, 'org')
+        self.question_id = questionnaire['questions'][-1]['id']
+        self.answers = questionnaire['answers_by_question'][self.question_id]
+
+    def save(self, desired, actual):
+        db.save_choice(self.assessment_id, self.question_id, self.answers[desired]['id'], self.answers[actual]['id'])
+
+    def scores(self, desired, actual):
+        return self.answers[desired]['score'], self.answers[actual]['score']
+
+    def events(self):
+        return [(e['desired_score'], e['actual_score']) for e in db.fetch_scored_choice_events(self.assessment_id)]
+
+    def test_each_change_is_recorded(self):
+        self.save(3, 0)
+        self.save(3, 1)
+        self.assertEqual(self.events(), [self.scores(3, 0), self.scores(3, 1)])
+        results = db.fetch_assessment_results(self.assessment_id)
+        self.assertEqual([(r['desired_score'], r['actual_score']) for r in results], [self.scores(3, 1)])
+
+    def test_unchanged_save_adds_no_event(self):
+        self.save(2, 1)
+        last_event = db.last_choice_event_id(self.assessment_id)
+        self.save(2, 1)
+        self.assertEqual(self.events(), [self.scores(2, 1)])
+        self.assertEqual(db.last_choice_event_id(self.assessment_id), last_event)
+
+    def test_results_as_of_replay_history(self):
+        self.save(3, 0)
+        before = int(time.time())
+        time.sleep(1.1)
+        self.save(3, 2)
+        as_of = db.fetch_assessment_results_as_of(self.assessment_id, before)
+        self.assertEqual([(r['desired_score'], r['actual_score']) for r in as_of], [self.scores(3, 0)])
+        first_event = db.fetch_scored_choice_events(self.assessment_id)[0]['id']
+        later = db.fetch_scored_choice_events(self.assessment_id, after_event_id=first_event)
+        self.assertEqual([(e['desired_score'], e['actual_score']) for e in later], [self.scores(3, 2)])
+
+
+if __name__ == "__main__":
+    unittest.main()
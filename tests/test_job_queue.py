@@ -0,0 +1,59 @@
+import os
+import unittest
+from unittest import mock
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:job_queue?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import job_queue  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class RecurringJobTest(unittest.TestCase):
+    """Workers queue a recurring kind when it is due, and never while one of its jobs is active."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def recurring(self, every):
+        """Make this test's kind the only recurring one, queued every `every` seconds."""
+        self.kind = self.id().rsplit(".", 1)[-1]
+        patches = [
+            mock.patch.dict(job_queue.JOB_HANDLERS, {self.kind: lambda params, progress: None}),
+            mock.patch.dict(job_queue.RECURRING_JOBS, {self.kind: every}, clear=True),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def jobs_of_kind(self):
+        return [job for job in job_queue.fetch_jobs(limit=1000) if job['kind'] == self.kind]
+
+    def test_not_queued_again_while_active(self):
+        self.recurring(0)
+        job = job_queue.claim_next_job("first")
+        self.assertEqual((job['kind'], job['status']), (self.kind, "running"))
+        # Due again at once, but its job is still running
+        self.assertIsNone(job_queue.claim_next_job("second"))
+        self.assertEqual(len(self.jobs_of_kind()), 1)
+
+    def test_queued_again_once_finished_and_due(self):
+        self.recurring(0)
+        job_queue.run_job(job_queue.claim_next_job("worker"))
+        job = job_queue.claim_next_job("worker")
+        self.assertEqual(job['kind'], self.kind)
+        self.assertEqual([j['status'] for j in self.jobs_of_kind()], ["running", "succeeded"])
+
+    def test_not_queued_before_interval(self):
+        self.recurring(3600)
+        job_queue.run_job(job_queue.claim_next_job("worker"))
+        self.assertIsNone(job_queue.claim_next_job("worker"))
+        self.assertEqual(len(self.jobs_of_kind()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
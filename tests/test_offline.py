@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+import os
+import unittest
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:offline?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import db, offline  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class OfflineTest(unittest.TestCase):
+    """Offline templates and the merge of uploaded answers."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def setUp(self):
+        client_id = db.add_client(f"Offline {self.id()}")
+        self.assessment_id = db.create_assessment(client_id, 'org', "Offline")
+        questionnaire = db.fetch_assessment_questionnaire(self.assessment_id, 'org')
+        self.question_ids = [q['id'] for q in questionnaire['questions']]
+        self.answers = questionnaire['answers_by_question']
+
+    def stored(self):
+        return {c['question_id']: (c['answer_id_desired'], c['answer_id_actual'])
+                for c in db.fetch_choices_by_assessment(self.assessment_id)}
+
+    def answer(self, question_id, index):
+        return self.answers[question_id][index]['id']
+
+    def filled_json(self, actual, desired):
+        """JSON template with its last question answered by answer index."""
+        template = json.loads(offline.template_json(self.assessment_id))
+        last = template['questions'][-1]
+        last['actual_answer_id'] = last['answers'][actual]['answer_id']
+        last['desired_answer_id'] = last['answers'][desired]['answer_id']
+        return json.dumps(template).encode()
+
+    def test_json_round_trip(self):
+        rows = offline.parse_upload("a.json", self.filled_json(0, 3))
+        report = offline.merge_upload(rows)
+        self.assertTrue(report['applied'])
+        self.assertEqual(report['errors'], [])
+        last = self.question_ids[-1]
+        self.assertEqual(self.stored(), {last: (self.answer(last, 3), self.answer(last, 0))})
+
+    def test_csv_round_trip_by_score(self):
+        records = list(csv.DictReader(io.StringIO(offline.template_csv(self.assessment_id))))
+        self.assertEqual([int(r['question_id']) for r in records], self.question_ids)
+        other = self.question_ids[-2]
+        records[-2]['actual_score'] = self.answers[other][1]['score']
+        records[-2]['desired_score'] = self.answers[other][3]['score']
+        output = io.StringIO()
+        writer = csv.DictWriter(output, fieldnames=offline.CSV_COLUMNS)
+        writer.writeheader()
+        writer.writerows(records)
+        report = offline.merge_upload(offline.parse_upload("a.csv", output.getvalue().encode()))
+        self.assertTrue(report['applied'])
+        self.assertEqual(self.stored(), {other: (self.answer(other, 3), self.answer(other, 1))})
+
+    def test_invalid_row_writes_nothing(self):
+        template = json.loads(self.filled_json(0, 3))
+        template['questions'][-2]['actual_score'] = 9
+        template['questions'][-2]['desired_score'] = 1
+        report = offline.merge_upload(offline.parse_upload("a.json", json.dumps(template).encode()))
+        self.assertFalse(report['applied'])
+        self.assertEqual(len(report['errors']), 1)
+        self.assertEqual(self.stored(), {})
+
+    def conflicting_upload(self):
+        """An upload answering the last question, which was saved differently after the template was made."""
+        data = self.filled_json(0, 3)
+        last = self.question_ids[-1]
+        db.save_choice(self.assessment_id, last, self.answer(last, 2), self.answer(last, 1))
+        return offline.parse_upload("a.json", data)
+
+    def test_conflict_skip_keeps_stored(self):
+        report = offline.merge_upload(self.conflicting_upload(), "skip")
+        last = self.question_ids[-1]
+        self.assertEqual(len(report['conflict']), 1)
+        self.assertEqual(report['written'], [])
+        self.assertEqual(self.stored()[last], (self.answer(last, 2), self.answer(last, 1)))
+
+    def test_conflict_overwrite_uses_upload(self):
+        report = offline.merge_upload(self.conflicting_upload(), "overwrite")
+        last = self.question_ids[-1]
+        self.assertEqual(len(report['written']), 1)
+        self.assertEqual(self.stored()[last], (self.answer(last, 3), self.answer(last, 0)))
+
+    def test_conflict_fail_writes_nothing(self):
+        template = json.loads(self.filled_json(0, 3))
+        other = template['questions'][-2]
+        other['actual_answer_id'] = other['answers'][1]['answer_id']
+        other['desired_answer_id'] = other['answers'][2]['answer_id']
+        last = self.question_ids[-1]
+        db.save_choice(self.assessment_id, last, self.answer(last, 2), self.answer(last, 1))
+        report = offline.merge_upload(offline.parse_upload("a.json", json.dumps(template).encode()), "fail")
+        self.assertFalse(report['applied'])
+        self.assertEqual(len(report['conflict']), 1)
+        self.assertNotIn(self.question_ids[-2], self.stored())
+
+    def test_dry_run_rolls_back(self):
+        rows = offline.parse_upload("a.json", self.filled_json(0, 3))
+        report = offline.merge_upload(rows, dry_run=True)
+        self.assertFalse(report['applied'])
+        self.assertEqual(len(report['written']), 1)
+        self.assertEqual(self.stored(), {})
+        self.assertEqual(db.last_choice_event_id(self.assessment_id), 0)
+
+    def test_identical_upload_is_unchanged(self):
+        rows = offline.parse_upload("a.json", self.filled_json(0, 3))
+        offline.merge_upload(rows)
+        report = offline.merge_upload(rows)
+        self.assertEqual((len(report['written']), len(report['unchanged'])), (0, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import unittest
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:query_plans?mode=memory&cache=shared&uri=true"
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import query_plans  # noqa: E402
+
+# Statements on the save, results and job paths, with the index each must search
+HOT_QUERIES = {
+    "app.db._UPDATE_CHOICE": "idx_choices",
+    "app.db._SELECT_RAW_CHOICES": "idx_choices",
+    "app.db._SELECT_ASSESSMENT_RESULTS": "idx_choices",
+    "app.db._SELECT_ASSESSMENT_RESULTS_AS_OF": "idx_choice_events_assessment",
+    "app.job_queue._SELECT_NEXT_QUEUED": "idx_jobs_status",
+    "app.job_queue._SELECT_STALE": "idx_jobs_status",
+}
+
+
+class QueryPlanTest(unittest.TestCase):
+    """EXPLAIN QUERY PLAN of every prebuilt statement against an empty schema."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.plans = {name: plan for name, _, plan in query_plans.plans()}
+
+    def test_no_unexpected_scans_or_sorts(self):
+        for name, plan in self.plans.items():
+            with self.subTest(statement=name):
+                self.assertEqual(query_plans.problems(plan, name), [], "\n".join(plan))
+
+    def test_hot_queries_search_their_index(self):
+        for name, index in HOT_QUERIES.items():
+            with self.subTest(statement=name):
+                plan = self.plans[name]
+                self.assertTrue(any(detail.startswith("SEARCH") and index in detail for detail in plan),
+                                "\n".join(plan))
+                self.assertFalse(any(detail.startswith("SCAN") for detail in plan
+                                     if any(table in detail for table in query_plans.LARGE_TABLES)),
+                                 "\n".join(plan))
+
+    def test_scan_of_large_table_is_reported(self):
+        self.assertEqual(query_plans.problems(["SCAN choices"], "app.db._SELECT_SOMETHING"), ["SCAN choices"])
+        self.assertEqual(query_plans.problems(["SCAN assessments"], "app.db._SELECT_ASSESSMENTS"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import unittest
+
+# The app reads its configuration at import time
+os.environ["RUDI_DATABASE_URL"] = "sqlite:///file:result_documents?mode=memory&cache=shared&uri=true"
+os.environ.pop("RUDI_SHARD_DIR", None)
+os.environ.pop("RUDI_TEMPLATE_DB", None)
+os.environ["RUDI_JOB_WORKERS"] = "0"
+
+from app import db  # noqa: E402
+from app.finalize import complete_assessment  # noqa: E402
+from init_db import init_database  # noqa: E402
+
+
+class ResultDocumentTest(unittest.TestCase):
+    """Completing an assessment, and reopening it when an answer changes."""
+
+    @classmethod
+    def setUpClass(cls):
+        init_database()
+
+    def setUp(self):
+        client_id = db.add_client(f"Documents {self.id()}")
+        self.assessment_id = db.create_assessment(client_id, 'org', "Documents")
+        questionnaire = db.fetch_assessment_questionnaire(self.assessment_id, 'org')
+        self.question_id = questionnaire['questions'][-1]['id']
+        self.answers = questionnaire['answers_by_question'][self.question_id]
+        self.save(3, 1)
+
+    def save(self, desired, actual):
+        db.save_choice(self.assessment_id, self.question_id, self.answers[desired]['id'], self.answers[actual]['id'])
+
+    def test_stale_event_id_is_rejected(self):
+        last_event_id = db.last_choice_event_id(self.assessment_id)
+        self.save(3, 2)
+        with self.assertRaises(ValueError):
+            db.save_result_document(self.assessment_id, last_event_id, {'stale': True})
+        self.assertIsNone(db.fetch_result_document(self.assessment_id))
+        self.assertIsNone(db.fetch_assessment_by_id(self.assessment_id)['completed_at'])
+
+    def test_current_event_id_completes(self):
+        completed_at = db.save_result_document(
+            self.assessment_id, db.last_choice_event_id(self.assessment_id), {'total': 2})
+        self.assertEqual(db.fetch_result_document(self.assessment_id), {'total': 2})
+        self.assertEqual(db.fetch_assessment_by_id(self.assessment_id)['completed_at'], completed_at)
+
+    def test_changed_answer_reopens(self):
+        complete_assessment(self.assessment_id, 'org')
+        self.assertIsNotNone(db.fetch_result_document(self.assessment_id))
+        self.save(3, 2)
+        self.assertIsNone(db.fetch_result_document(self.assessment_id))
+        self.assertIsNone(db.fetch_assessment_by_id(self.assessment_id)['completed_at'])
+
+    def test_unchanged_answer_keeps_document(self):
+        complete_assessment(self.assessment_id, 'org')
+        self.save(3, 1)
+        self.assertIsNotNone(db.fetch_result_document(self.assessment_id))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import pandas as pd
+
+from app import scenarios
+
+
+def results():
+    """A results frame: two Leadership questions with the same text and one Strategy question."""
+    return pd.DataFrame({
+        'question_id': [1, 2, 3],
+        'category': ["Leadership", "Leadership", "Strategy"],
+        'question': ["Same text", "Same text", "Other text"],
+        'actual_score': [1, 2, 3],
+        'desired_score': [3, 2, 4],
+        'max_score': [4, 5, 4],
+    })
+
+
+class EvaluateTest(unittest.TestCase):
+    """Scenarios evaluated together against the stored actual scores."""
+
+    def test_baseline_uses_stored_targets(self):
+        summary, category_gaps = scenarios.evaluate(results(), [])
+        baseline = summary.loc[scenarios.BASELINE]
+        self.assertEqual((baseline['target_score'], baseline['gap'], baseline['questions_with_gap']), (9, 3, 2))
+        self.assertEqual(category_gaps.loc[scenarios.BASELINE].to_dict(), {"Leadership": 2, "Strategy": 1})
+
+    def test_most_specific_target_wins(self):
+        spec = scenarios.scenario("Mixed", uniform=2, categories={"Strategy": 3}, questions={0: 4})
+        targets = scenarios.target_matrix(results(), [spec])
+        self.assertEqual(targets.tolist(), [[4, 2, 3]])
+
+    def test_targets_stop_at_the_best_answer(self):
+        spec = scenarios.scenario("High", uniform=9)
+        self.assertEqual(scenarios.target_matrix(results(), [spec]).tolist(), [[4, 5, 4]])
+
+    def test_scenarios_evaluated_together(self):
+        summary, _ = scenarios.evaluate(
+            results(), [scenarios.scenario("Low", uniform=1), scenarios.scenario("Top", uniform=4)],
+            include_baseline=False,
+        )
+        self.assertEqual(summary.index.tolist(), ["Low", "Top"])
+        self.assertEqual(summary['gap'].tolist(), [0, 6])
+        self.assertEqual(summary.loc["Top", 'gap_percentage'], 50.0)
+
+
+class SweepTest(unittest.TestCase):
+    """One uniform target per level, for every question or one category."""
+
+    def test_sweep_matches_uniform_scenarios(self):
+        frame = results()
+        levels = [1, 2, 3, 4]
+        swept, swept_gaps = scenarios.sweep(frame, levels)
+        evaluated, evaluated_gaps = scenarios.evaluate(
+            frame, [scenarios.scenario(level, uniform=level) for level in levels], include_baseline=False)
+        self.assertEqual(swept['gap'].tolist(), evaluated['gap'].tolist())
+        self.assertEqual(swept_gaps.to_numpy().tolist(), evaluated_gaps.to_numpy().tolist())
+
+    def test_sweep_of_one_category_keeps_other_targets(self):
+        summary, category_gaps = scenarios.sweep(results(), [4], category="Leadership")
+        self.assertEqual(category_gaps.loc[4].to_dict(), {"Leadership": 5, "Strategy": 1})
+        self.assertEqual(summary.loc[4, 'target_score'], 12)
+
+
+class MaxScoresTest(unittest.TestCase):
+    """Score limits are matched to questions by id, not by text."""
+
+    def test_duplicate_text_gets_each_questions_limit(self):
+        questionnaire = {'answers_by_question': {
+            1: [{'score': 1}, {'score': 2}],
+            2: [{'score': 1}, {'score': 5}],
+        }}
+        self.assertEqual(scenarios.max_scores(results(), questionnaire), [2, 5, None])
+
+
+if __name__ == "__main__":
+    unittest.main()